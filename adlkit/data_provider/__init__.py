@@ -19,6 +19,15 @@ from .fillers import BaseFiller, H5Filler
 from .readers import BaseReader, H5Reader
 from .generators import BaseGenerator
 from .watchers import BaseWatcher
+from .buckets import BucketFreeList
+from .arenas import SharedArena
+from .rings import DescriptorRing
+from .file_handles import FileHandleCache
+from .metrics import MetricsRegistry
 from .cached_data_providers import GeneratorCacher
 
-__all__ = ['config', 'data_providers', 'fillers', 'generators', 'readers', 'watchers', 'workers']
+# pools, schedulers, autoscalers, tracing and diagnosis are only imported by the data
+# providers that use them, import ReaderPool and co. from their modules
+__all__ = ['arenas', 'autoscalers', 'buckets', 'config', 'data_providers', 'diagnosis', 'file_handles',
+           'fillers', 'generators', 'metrics', 'pools', 'readers', 'rings', 'schedulers', 'tracing',
+           'watchers', 'workers']
@@ -0,0 +1,85 @@
+import collections
+import multiprocessing
+
+import numpy as np
+
+from .config import PROCESS_BACKEND, THREAD_BACKEND
+
+# every data set of every bucket starts on a cache line
+ALIGNMENT = 64
+
+
+def align(n_bytes, alignment=ALIGNMENT):
+    return -(-n_bytes // alignment) * alignment
+
+
+class BucketLayout(object):
+    """
+    Where every data set of a bucket lives relative to the start of the bucket. Each one
+    is padded to the ALIGNMENT, so buckets laid out back to back stay aligned too.
+    """
+
+    def __init__(self, malloc_requests, read_size):
+        # (data_set, shape, dtype, offset, n_bytes)
+        self.data_sets = list()
+
+        offset = 0
+        for request in malloc_requests:
+            shape = (read_size,) + tuple(request[1])
+
+            # requests from older fillers do not carry a dtype
+            if len(request) > 2:
+                dtype = np.dtype(request[2])
+            else:
+                dtype = np.dtype('float64')
+
+            n_bytes = int(np.prod(shape)) * dtype.itemsize
+            self.data_sets.append((request[0], shape, dtype, offset, n_bytes))
+            offset += align(n_bytes)
+
+        self.bucket_bytes = offset
+
+    def data_set_bytes(self):
+        """
+        :return: {data_set: bytes in one bucket}, without the padding
+        """
+        return collections.OrderedDict((data_set, n_bytes) for data_set, _, _, _, n_bytes in self.data_sets)
+
+
+class SharedArena(object):
+    """
+    One zero filled block of memory that every bucket of a set of readers is a view
+    into. Processes share it, threads get a plain numpy array.
+    """
+
+    def __init__(self, n_bytes, backend=PROCESS_BACKEND):
+        self.n_bytes = n_bytes
+
+        if backend == THREAD_BACKEND:
+            self.base = np.zeros(n_bytes + ALIGNMENT, dtype=np.uint8)
+            memory = self.base
+        else:
+            self.base = multiprocessing.RawArray('b', n_bytes + ALIGNMENT)
+            memory = np.frombuffer(self.base, dtype=np.uint8)
+
+        start = -memory.ctypes.data % ALIGNMENT
+        self.memory = memory[start:start + n_bytes]
+
+    def view(self, offset, shape, dtype):
+        """
+        :return: a numpy array of shape and dtype backed by the arena from offset on
+        """
+        dtype = np.dtype(dtype)
+        n_bytes = int(np.prod(shape)) * dtype.itemsize
+        return self.memory[offset:offset + n_bytes].view(dtype).reshape(shape)
+
+    def buckets(self, layout, n_buckets, offset=0):
+        """
+        :return: the data sets of n_buckets buckets laid out back to back from offset on
+        """
+        buckets = list()
+        for bucket_index in range(n_buckets):
+            bucket_offset = offset + bucket_index * layout.bucket_bytes
+            buckets.append([self.view(bucket_offset + data_set_offset, shape, dtype)
+                            for _, shape, dtype, data_set_offset, _ in layout.data_sets])
+        return buckets
@@ -0,0 +1,99 @@
+import logging as lg
+import threading
+
+autoscale_logger = lg.getLogger('data_provider.main.autoscale')
+
+SCALE_UP = 1
+HOLD = 0
+SCALE_DOWN = -1
+
+
+class ReaderAutoscaler(threading.Thread):
+    """
+    Runs in the consumer's process next to the generators and resizes the reader pool
+    from queue depth feedback.
+
+    Readers are added when the generators are starved, that is the out_queue is empty
+    while the filler has read batches waiting in the in_queue. Readers are retired when
+    the filler is the bottleneck, the in_queue is empty and most of the buckets are free.
+    A decision has to repeat for `patience` samples before it is acted on.
+    """
+
+    def __init__(self, data_provider, min_readers, max_readers, interval=0.5, patience=3,
+                 idle_occupancy=0.5):
+        super(ReaderAutoscaler, self).__init__(name='reader-autoscaler')
+        self.daemon = True
+
+        if not 1 <= min_readers <= max_readers:
+            raise ValueError("expected 1 <= min_readers <= max_readers, got {0} and {1}".format(min_readers,
+                                                                                             max_readers))
+
+        self.data_provider = data_provider
+        self.min_readers = min_readers
+        self.max_readers = max_readers
+        self.interval = interval
+        self.patience = patience
+        self.idle_occupancy = idle_occupancy
+
+        self.stop_event = threading.Event()
+
+        self.last_decision = HOLD
+        self.streak = 0
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                autoscale_logger.error(e)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def step(self):
+        # a paused pipeline looks starved, it is not
+        if self.data_provider.paused:
+            self.streak = 0
+            return HOLD
+
+        n_readers = self.data_provider.n_active_readers()
+        in_depth, out_depth, occupancy = self.data_provider.sample_load()
+
+        decision = self.decide(in_depth, out_depth, occupancy)
+        if decision != HOLD and decision == self.last_decision:
+            self.streak += 1
+        else:
+            self.streak = 1
+        self.last_decision = decision
+
+        autoscale_logger.debug(" n_readers={0} in_depth={1} out_depth={2} occupancy={3} decision={4}".format(
+                n_readers, in_depth, out_depth, occupancy, decision))
+
+        if decision == HOLD or self.streak < self.patience:
+            return HOLD
+
+        self.streak = 0
+        if decision == SCALE_UP and n_readers < self.max_readers:
+            reader_id = self.data_provider.add_reader()
+            autoscale_logger.info(" added reader_id={0} n_readers={1}".format(reader_id, n_readers + 1))
+            return SCALE_UP
+
+        if decision == SCALE_DOWN and n_readers > self.min_readers:
+            reader_id = self.data_provider.retire_reader()
+            autoscale_logger.info(" retired reader_id={0} n_readers={1}".format(reader_id, n_readers - 1))
+            return SCALE_DOWN
+
+        return HOLD
+
+    def decide(self, in_depth, out_depth, occupancy):
+        """
+        :param in_depth: read batches waiting for a reader
+        :param out_depth: filled buckets waiting for a generator
+        :param occupancy: the fraction of the active readers' buckets that are in use
+        :return: SCALE_UP, HOLD or SCALE_DOWN
+        """
+        if in_depth > 0 and out_depth == 0:
+            return SCALE_UP
+        if in_depth == 0 and occupancy < self.idle_occupancy:
+            return SCALE_DOWN
+        return HOLD
@@ -0,0 +1,216 @@
+"""
+Searches n_readers, read_multiplier, n_buckets and q_multipler for the config that
+delivers the most samples per second from a sample_specification, without the shared
+memory buckets growing past a memory budget.
+
+    python autotune.py sample_specification.json --memory_budget 512 --output tuned.json
+
+The saved config can then be handed to a data provider:
+
+    FileDataProvider(sample_specification, **load_tuned_config('tuned.json'))
+"""
+import argparse
+import collections
+import json
+import logging as lg
+import time
+
+import h5py
+import numpy as np
+
+from adlkit.data_provider.data_providers import H5FileDataProvider
+
+autotune_logger = lg.getLogger('data_provider.bin.autotune')
+
+# the knobs are tuned one at a time, in this order, holding the others at their best
+SEARCH_SPACE = collections.OrderedDict([
+    ('n_readers', [1, 2, 4, 8, 16]),
+    ('read_multiplier', [1, 2, 4, 8]),
+    ('n_buckets', [2, 4, 10, 20]),
+    ('q_multipler', [1, 2, 4])
+])
+
+DEFAULT_START = {
+    'n_readers'      : 4,
+    'read_multiplier': 1,
+    'n_buckets'      : 4,
+    'q_multipler'    : 1
+}
+
+
+def malloc_requests(sample_specification):
+    """
+    :return: the (data_set, shape, dtype) malloc requests a filler sends for the data sets
+    of sample_specification
+    """
+    requests = list()
+    with h5py.File(sample_specification[0][0], 'r') as h5_file_handle:
+        for data_set in sample_specification[0][1]:
+            h5_data_set = h5_file_handle[data_set]
+            requests.append((data_set, h5_data_set.shape[1:], h5_data_set.dtype.name))
+    return requests
+
+
+def estimate_memory(sample_specification, config, batch_size, requests):
+    """
+    :param requests: see malloc_requests
+    :return: the bytes the buckets of every reader take up with this config, as the data
+    provider's own memory_report() counts them, padding and the extra tensors like
+    one_hot included
+    """
+    data_provider = H5FileDataProvider(sample_specification, batch_size=batch_size, **config)
+    data_provider.malloc_requests = list(requests)
+    return data_provider.memory_report()['total']
+
+
+def read_examples(stats):
+    """
+    :return: how many examples the readers have stored so far
+    """
+    return sum(worker['counters']['examples'] for name, worker in stats.items() if name.startswith('reader'))
+
+
+def trial(sample_specification, config, batch_size, trial_batches=50, warmup_batches=5):
+    """
+    Starts a data provider with config and has the consumer draw trial_batches batches as
+    fast as it can. The rate is what the readers store meanwhile, not what the consumer
+    draws, otherwise configs with more buckets look faster than they can keep up with
+    by handing out the batches buffered before the trial.
+    :return: samples per second
+    """
+    trial_config = dict(config)
+    trial_config['collect_metrics'] = True
+
+    data_provider = H5FileDataProvider(sample_specification, batch_size=batch_size, **trial_config)
+    data_provider.start()
+    try:
+        generator = data_provider.first().generate()
+        for _ in range(warmup_batches):
+            generator.next()
+
+        start_examples = read_examples(data_provider.stats())
+        start_time = time.time()
+        for _ in range(trial_batches):
+            generator.next()
+        delta = time.time() - start_time
+        n_examples = read_examples(data_provider.stats()) - start_examples
+    finally:
+        data_provider.hard_stop()
+
+    return n_examples / delta
+
+
+def autotune(sample_specification, memory_budget, batch_size=2048, trial_batches=50,
+             warmup_batches=5, search_space=None, start_config=None, n_rounds=2, **config):
+    """
+    A coordinate search, each knob is swept while holding the others at the best values
+    so far, and the sweep is repeated n_rounds times or until nothing improves.
+
+    :param memory_budget: the most bytes the buckets may take up
+    :param config: passed to every trial, e.g. make_one_hot
+    :return: (best tuned config, its samples per second, every trial as (config, samples/s, bytes))
+    """
+    search_space = search_space or SEARCH_SPACE
+    requests = malloc_requests(sample_specification)
+
+    def memory_bytes_of(candidate):
+        candidate_config = dict(config)
+        candidate_config.update(candidate)
+        return estimate_memory(sample_specification, candidate_config, batch_size, requests)
+
+    best_config = dict(DEFAULT_START)
+    best_config.update(start_config or dict())
+
+    if memory_bytes_of(best_config) > memory_budget:
+        for key, values in search_space.items():
+            best_config[key] = min(values)
+
+    if memory_bytes_of(best_config) > memory_budget:
+        raise ValueError("even the smallest config needs more than memory_budget={0} bytes".format(memory_budget))
+
+    measured = dict()
+    trials = list()
+
+    def measure(candidate):
+        key = tuple(sorted(candidate.items()))
+        if key not in measured:
+            trial_config = dict(config)
+            trial_config.update(candidate)
+            memory_bytes = memory_bytes_of(candidate)
+
+            samples_per_second = trial(sample_specification, trial_config, batch_size,
+                                       trial_batches=trial_batches, warmup_batches=warmup_batches)
+            measured[key] = samples_per_second
+            trials.append((candidate, samples_per_second, memory_bytes))
+            autotune_logger.info(" config={0} samples/s={1:.0f} memory_bytes={2}".format(candidate,
+                                                                                        samples_per_second,
+                                                                                        memory_bytes))
+        return measured[key]
+
+    best_rate = measure(best_config)
+    for _ in range(n_rounds):
+        improved = False
+        for key, values in search_space.items():
+            for value in values:
+                candidate = dict(best_config)
+                candidate[key] = value
+                if memory_bytes_of(candidate) > memory_budget:
+                    continue
+
+                rate = measure(candidate)
+                if rate > best_rate:
+                    best_config, best_rate = candidate, rate
+                    improved = True
+        if not improved:
+            break
+
+    return best_config, best_rate, trials
+
+
+def save_tuned_config(path, config, samples_per_second, batch_size, memory_budget):
+    with open(path, 'w') as tuned_file:
+        json.dump({
+            'config'            : config,
+            'samples_per_second': samples_per_second,
+            'batch_size'        : batch_size,
+            'memory_budget'     : memory_budget
+        }, tuned_file, indent=2, sort_keys=True)
+
+
+def load_tuned_config(path):
+    """
+    :return: the tuned knobs, ready to be passed as keyword arguments to a data provider
+    """
+    with open(path) as tuned_file:
+        return dict((str(key), value) for key, value in json.load(tuned_file)['config'].items())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='searches for the fastest data provider config')
+    parser.add_argument('sample_specification', type=str,
+                        help='a json file holding the list of [file_name, data_sets, class_name, class_prob]')
+    parser.add_argument('--memory_budget', type=float, required=True,
+                        help='the most MiB the shared memory buckets may take up')
+    parser.add_argument('--batch_size', type=int, default=2048)
+    parser.add_argument('--trial_batches', type=int, default=50)
+    parser.add_argument('--output', type=str, default=None, help='where to save the tuned config')
+    parser.add_argument('--loglevel', type=str, default='info')
+
+    args = parser.parse_args()
+
+    lg.basicConfig(level=lg.DEBUG if args.loglevel == 'debug' else lg.INFO)
+
+    with open(args.sample_specification) as sample_specification_file:
+        sample_specification = json.load(sample_specification_file)
+
+    memory_budget = int(args.memory_budget * 1024 ** 2)
+    tuned_config, tuned_rate, _ = autotune(sample_specification, memory_budget,
+                                           batch_size=args.batch_size,
+                                           trial_batches=args.trial_batches)
+
+    print('**autotune**')
+    print('config', tuned_config)
+    print('samples/s', tuned_rate)
+
+    if args.output is not None:
+        save_tuned_config(args.output, tuned_config, tuned_rate, args.batch_size, memory_budget)
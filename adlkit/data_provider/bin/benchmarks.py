@@ -1,26 +1,125 @@
+"""
+Benchmarks for the data provider, both for the individual stages and the whole
+pipeline. Every benchmark returns result rows, one per metric:
+
+    {'benchmark': 'reader_bandwidth', 'batch_size': 2048, ..., 'metric': 'bandwidth',
+     'value': 2521.3, 'unit': 'MB/s'}
+
+so that a run can be saved as JSON or CSV and compared against a previous one.
+
+    python benchmarks.py --matrix --batch_sizes 256,2048 --dtypes float32,float64 --output new.json
+    python benchmarks.py --compare old.json new.json --threshold 0.1
+
+--diagnose runs the pipeline and reports what limits it and which knob to turn:
+
+    python benchmarks.py --diagnose --n_readers 2 --consumer_delay 0.01
+"""
 import argparse
+import collections
 import copy
+import csv
+import itertools
+import json
 import logging as lg
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import time
 
-from adlkit.data_provider.data_providers import H5FileDataProvider
+import billiard
+import h5py
+import numpy as np
+
+import adlkit
+from adlkit.data_provider.bin.gen_rand_data import gen_rand_data
+from adlkit.data_provider.config import BACKENDS
+from adlkit.data_provider.data_providers import FileDataProvider, H5FileDataProvider, WatchedH5FileDataProvider
+from adlkit.data_provider.fillers import H5Filler
+from adlkit.data_provider.readers import H5Reader
+from adlkit.data_provider.rings import DescriptorCodec, DescriptorRing
 
 lg.basicConfig(level=lg.INFO)
 
+DATA_SETS = ['tensor_1', 'tensor_2']
 
-def generator_output(batch_size=2048, end_count=100, n_readers=20,
-                     q_multiplier=3, read_multiplier=1):
+# the direction of a regression depends on the unit
+HIGHER_IS_BETTER = ('MB/s', 'batches/s', 'samples/s', 'messages/s')
+
+STAGES = ('filler', 'reader', 'latency', 'watcher')
+
+
+def result_rows(benchmark, params, metrics):
+    """
+    :param params: what the benchmark was run with
+    :param metrics: (metric, value, unit) tuples
+    :return: one row per metric
+    """
+    rows = list()
+    for metric, value, unit in metrics:
+        row = collections.OrderedDict([('benchmark', benchmark)])
+        row.update(sorted(params.items()))
+        row['metric'] = metric
+        row['value'] = float(value)
+        row['unit'] = unit
+        rows.append(row)
+    return rows
+
+
+def make_sample_specification(path, n_files, n_rows, row_shape=(5,), dtype='float64', compression=None):
+    """
+    Writes synthetic files with gen_rand_data, one class per file.
+    """
+    gen_rand_data(path, n_files, n_rows, shape=row_shape, dtype=dtype, compression=compression)
+    return [[os.path.join(path, 'test_file_{0}.h5'.format(file_index)), DATA_SETS,
+             'class_{0}'.format(file_index), 1] for file_index in range(n_files)]
+
+
+def describe_sample_specification(sample_specification):
+    """
+    :return: (n_files, row_shape, dtype, compression) of the first file's first data set
+    """
+    with h5py.File(sample_specification[0][0], 'r') as h5_file_handle:
+        h5_data_set = h5_file_handle[sample_specification[0][1][0]]
+        return (len(sample_specification), h5_data_set.shape[1:], h5_data_set.dtype.name,
+                h5_data_set.compression)
+
+
+def data_params(sample_specification):
+    n_files, row_shape, dtype, compression = describe_sample_specification(sample_specification)
+    return {
+        'n_files'    : n_files,
+        'row_shape'  : 'x'.join(str(dim) for dim in row_shape),
+        'dtype'      : dtype,
+        'compression': compression or 'none'
+    }
+
+
+def mock_sample_specification():
     from adlkit.data_provider.tests.mock_config import mock_sample_specification
-    mock_sample_specification = copy.deepcopy(mock_sample_specification)
-    tmp_data_provider = H5FileDataProvider(mock_sample_specification,
+    return copy.deepcopy(mock_sample_specification)
+
+
+def generator_output(batch_size=2048, end_count=100, n_readers=20,
+                     q_multiplier=3, read_multiplier=1, backend='process', n_fillers=1,
+                     sample_specification=None):
+    sample_specification = sample_specification or mock_sample_specification()
+    tmp_data_provider = H5FileDataProvider(sample_specification,
                                            batch_size=batch_size,
                                            n_readers=n_readers,
                                            q_multipler=q_multiplier,
                                            wrap_examples=True,
                                            read_multiplier=read_multiplier,
+                                           n_fillers=n_fillers,
                                            make_file_index=True)
 
-    tmp_data_provider.start()
+    start_time = time.time()
+    tmp_data_provider.start(backend=backend)
+    # the first batch is part of what a consumer waits for at startup
+    tmp_data_provider.first().generate().next()
+    startup_delta = time.time() - start_time
     count = 0
 
     # spool up time
@@ -34,20 +133,509 @@ def generator_output(batch_size=2048, end_count=100, n_readers=20,
 
     delta = time.time() - bench_start_time
     tmp_data_provider.hard_stop()
-    print_results('generator_output', delta, count, batch_size, n_readers,
-                  q_multiplier, read_multiplier)
 
+    params = dict(batch_size=batch_size, n_readers=n_readers, q_multiplier=q_multiplier,
+                  read_multiplier=read_multiplier, backend=backend, n_fillers=n_fillers)
+    params.update(data_params(sample_specification))
+    return result_rows('generator_output', params, [
+        ('throughput', count * batch_size / delta, 'samples/s'),
+        ('avg_delta', delta / count, 's'),
+        ('startup_delta', startup_delta, 's')
+    ])
+
+
+def batch_latency(batch_size=2048, end_count=100, n_readers=20,
+                  q_multiplier=3, read_multiplier=1, n_buckets=10, sleep_duration=0.5,
+                  backend='process', sample_specification=None):
+    """
+    Times every individual `next()` on a single generator so that stalls
+    in the handoff between stages show up in the tail percentiles.
+    """
+    sample_specification = sample_specification or mock_sample_specification()
+    tmp_data_provider = H5FileDataProvider(sample_specification,
+                                           batch_size=batch_size,
+                                           n_readers=n_readers,
+                                           n_buckets=n_buckets,
+                                           q_multipler=q_multiplier,
+                                           wrap_examples=True,
+                                           read_multiplier=read_multiplier,
+                                           sleep_duration=sleep_duration)
+
+    tmp_data_provider.start(backend=backend)
+    generator = tmp_data_provider.first().generate()
+
+    # spool up time
+    for _ in range(10):
+        generator.next()
+
+    latencies = list()
+    while len(latencies) < end_count:
+        start_time = time.time()
+        generator.next()
+        latencies.append(time.time() - start_time)
+
+    tmp_data_provider.hard_stop()
+
+    params = dict(batch_size=batch_size, n_readers=n_readers, q_multiplier=q_multiplier,
+                  read_multiplier=read_multiplier, n_buckets=n_buckets, backend=backend)
+    params.update(data_params(sample_specification))
+    return result_rows('batch_latency', params, [
+        ('p50_latency', np.percentile(latencies, 50), 's'),
+        ('p99_latency', np.percentile(latencies, 99), 's')
+    ])
+
+
+def watcher_multicast(batch_size=2048, end_count=100, n_readers=4, n_generators=4,
+                      sample_specification=None):
+    """
+    Compares how long a generator waits per batch when a watcher multicasts every batch
+    to n_generators generators against a single unwatched generator.
+    """
+    sample_specification = sample_specification or mock_sample_specification()
+
+    deltas = dict()
+    for provider_class, watched_n_generators in ((H5FileDataProvider, 1),
+                                                 (WatchedH5FileDataProvider, n_generators)):
+        tmp_data_provider = provider_class(sample_specification,
+                                           batch_size=batch_size,
+                                           n_readers=n_readers,
+                                           n_generators=watched_n_generators,
+                                           wrap_examples=True,
+                                           sleep_duration=0.05)
+        tmp_data_provider.start()
+        generators = [generator.generate() for generator in tmp_data_provider.generators]
+
+        # spool up time
+        for _ in range(10):
+            for generator in generators:
+                generator.next()
+
+        bench_start_time = time.time()
+        for _ in range(end_count):
+            for generator in generators:
+                generator.next()
+        deltas[provider_class] = (time.time() - bench_start_time) / end_count
+        tmp_data_provider.hard_stop()
+
+    params = dict(batch_size=batch_size, n_readers=n_readers, n_generators=n_generators)
+    params.update(data_params(sample_specification))
+    return result_rows('watcher_multicast', params, [
+        ('unwatched_avg_delta', deltas[H5FileDataProvider], 's'),
+        ('watched_avg_delta', deltas[WatchedH5FileDataProvider], 's'),
+        ('multicast_overhead', deltas[WatchedH5FileDataProvider] - deltas[H5FileDataProvider], 's')
+    ])
+
+
+def produce(queue, messages, n_messages):
+    for message_index in range(n_messages):
+        queue.put(messages[message_index % len(messages)])
+
+
+def queue_hops(batch_size=2048, n_messages=5000, read_multiplier=1, n_classes=3):
+    """
+    Passes n_messages messages from a producer process to this one, once through a
+    billiard.Queue and once through a DescriptorRing, for each hop of the pipeline: a read
+    plan of start/end ranges and one of index lists into the in_queue, and a data pointer
+    into the out_queue and the multicast_queues. Reports messages per second per hop.
+    """
+    read_size = batch_size * read_multiplier
+    class_names = ['class_{0}'.format(class_index) for class_index in range(n_classes)]
+    per_class = read_size // n_classes
+
+    hops = collections.OrderedDict()
+    hops['in_queue_ranges'] = [[(class_index, DATA_SETS, class_name,
+                                 (batch_id * per_class, (batch_id + 1) * per_class), batch_id)
+                                for class_index, class_name in enumerate(class_names)]
+                               for batch_id in range(10)]
+    hops['in_queue_indices'] = [[(class_index, DATA_SETS, class_name,
+                                  range(batch_id * per_class * 2, (batch_id + 1) * per_class * 2, 2), batch_id)
+                                 for class_index, class_name in enumerate(class_names)]
+                                for batch_id in range(10)]
+    hops['out_queue'] = [(batch_id % 4, batch_id % 10, DATA_SETS, batch_id) for batch_id in range(10)]
+
+    codec = DescriptorCodec(DATA_SETS + class_names)
+    slot_words = 2 * read_size + 256 * n_classes
+
+    metrics = list()
+    for hop, messages in hops.items():
+        for transport in ('queue', 'ring'):
+            if transport == 'ring':
+                queue = DescriptorRing(16, slot_words, codec)
+            else:
+                queue = billiard.Queue(maxsize=16)
+
+            producer = billiard.Process(target=produce, args=(queue, messages, n_messages))
+            bench_start_time = time.time()
+            producer.start()
+            for _ in range(n_messages):
+                queue.get()
+            delta = time.time() - bench_start_time
+            producer.join()
+
+            metrics.append(('{0}_{1}_rate'.format(hop, transport), n_messages / delta, 'messages/s'))
+
+    return result_rows('queue_hops', dict(batch_size=batch_size, read_multiplier=read_multiplier,
+                                          n_classes=n_classes), metrics)
+
+
+def diagnose_run(batch_size=2048, n_readers=4, q_multiplier=3, read_multiplier=1, n_buckets=10,
+                 n_fillers=1, backend='process', window=2.0, consumer_delay=0.0,
+                 sample_specification=None):
+    """
+    Consumes batches, sleeping consumer_delay seconds per batch like a training step
+    would, while FileDataProvider.diagnose samples the pipeline for window seconds.
+    :return: the diagnosis report
+    """
+    sample_specification = sample_specification or mock_sample_specification()
+    tmp_data_provider = H5FileDataProvider(sample_specification,
+                                           batch_size=batch_size,
+                                           n_readers=n_readers,
+                                           n_buckets=n_buckets,
+                                           q_multipler=q_multiplier,
+                                           read_multiplier=read_multiplier,
+                                           n_fillers=n_fillers,
+                                           wrap_examples=True,
+                                           collect_metrics=True,
+                                           sleep_duration=0.05)
+
+    tmp_data_provider.start(backend=backend)
+    try:
+        generator = tmp_data_provider.first().generate()
+
+        # spool up time
+        for _ in range(10):
+            generator.next()
 
-def print_results(name, delta, count, batch_size, n_readers, q_multiplier,
-                  read_multiplier):
-    print('**{0}**'.format(name))
-    print('delta', delta)
-    print('delivered', count)
-    print('avg_delta', delta / count)
-    print('batch_size', batch_size)
-    print('n_readers', n_readers)
-    print('q_multiplier', q_multiplier)
-    print('read_multiplier', read_multiplier)
+        reports = list()
+        diagnosis_thread = threading.Thread(target=lambda: reports.append(tmp_data_provider.diagnose(window)))
+        diagnosis_thread.start()
+        while diagnosis_thread.is_alive():
+            generator.next()
+            if consumer_delay:
+                time.sleep(consumer_delay)
+        diagnosis_thread.join()
+    finally:
+        tmp_data_provider.hard_stop()
+
+    return reports[0]
+
+
+def print_diagnosis(report):
+    print('**diagnosis**')
+    print('bound', report['bound'])
+    print('stage', report['stage'])
+    print('knob', report['knob'])
+    print('in_fill={0:.2f} out_fill={1:.2f} occupancy={2:.2f} n_samples={3}'.format(report['in_fill'],
+                                                                                  report['out_fill'],
+                                                                                  report['occupancy'],
+                                                                                  report['n_samples']))
+    for role, stages in sorted(report['totals'].items()):
+        busiest = sorted(stages.items(), key=lambda item: -item[1])
+        print(role, ' '.join('{0}={1:.3f}s'.format(stage, seconds) for stage, seconds in busiest))
+
+
+def reader_bandwidth(batch_size=2048, end_count=50, row_shape=(32, 32), n_files=3,
+                     read_direct=True, step=None, coalesce_gap=32, sample_specification=None):
+    """
+    Drives a single H5Reader in-process over synthetic files and reports how many
+    MB/s it moves from disk into the shared memory buckets. With a step, every
+    read_request is a list of indices like the ones a filter_function produces.
+    Given a sample_specification, its files need batch_size * 4 * step rows.
+    """
+    tmp_dir = None
+    if sample_specification is None:
+        tmp_dir = tempfile.mkdtemp()
+        sample_specification = make_sample_specification(tmp_dir, n_files, batch_size * 4 * (step or 1),
+                                                         row_shape=row_shape)
+    n_files, row_shape, dtype, _ = describe_sample_specification(sample_specification)
+
+    params = dict(batch_size=batch_size, read_direct=read_direct, step=step or 1,
+                  coalesce_gap=coalesce_gap)
+    params.update(data_params(sample_specification))
+
+    try:
+        tmp_data_provider = FileDataProvider(sample_specification,
+                                             batch_size=batch_size,
+                                             n_buckets=1)
+        tmp_data_provider.malloc_requests = [(data_set, row_shape, dtype) for data_set in DATA_SETS]
+        tmp_data_provider.make_shared_malloc(0)
+
+        reader = H5Reader(worker_id=0, in_queue=None, out_queue=None,
+                          shared_memory_pointer=tmp_data_provider.shared_memory[0],
+                          free_buckets=tmp_data_provider.free_buckets[0],
+                          read_size=tmp_data_provider.config.read_size,
+                          class_index_map=tmp_data_provider.config.class_index_map,
+                          file_index_list=tmp_data_provider.config.file_index_list,
+                          cache_handles=True,
+                          read_direct=read_direct,
+                          coalesce_gap=coalesce_gap)
+
+        # one read_request per file, walking through the files
+        rows_per_request = batch_size // n_files
+        batches = list()
+        for batch_id in range(batch_size * 4 // rows_per_request - 1):
+            start = batch_id * rows_per_request
+            batch = list()
+            for file_index in range(n_files):
+                end = start + rows_per_request
+                if file_index == n_files - 1:
+                    end = start + batch_size - rows_per_request * (n_files - 1)
+
+                if step is None:
+                    read_descriptor = (start, end)
+                else:
+                    read_descriptor = range(start * step, end * step, step)
+                batch.append((file_index, DATA_SETS, 'class_{0}'.format(file_index), read_descriptor, batch_id))
+            batches.append(batch)
+
+        bench_start_time = time.time()
+        for count in range(end_count):
+            _, bucket_index, _, _ = reader.process_batch(batches[count % len(batches)])
+            tmp_data_provider.shared_memory[0][bucket_index][0].value = 0
+            tmp_data_provider.free_buckets[0].put(bucket_index)
+        delta = time.time() - bench_start_time
+        reader.file_handle_holder.close_all()
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    n_bytes = end_count * batch_size * len(DATA_SETS) * int(np.prod(row_shape)) * np.dtype(dtype).itemsize
+    return result_rows('reader_bandwidth', params, [
+        ('bandwidth', n_bytes / delta / 1e6, 'MB/s')
+    ])
+
+
+def filler_planning(batch_size=2048, end_count=200, read_multiplier=8, n_classes=32,
+                    sample_specification=None):
+    """
+    Calls H5Filler.build_batch in-process, without readers, and reports how many
+    read batches it can plan per second.
+    """
+    tmp_dir = None
+    if sample_specification is None:
+        tmp_dir = tempfile.mkdtemp()
+        sample_specification = make_sample_specification(tmp_dir, n_classes, batch_size * read_multiplier)
+        for file_index, sample in enumerate(sample_specification):
+            sample[3] = file_index + 1
+
+    params = dict(batch_size=batch_size, read_multiplier=read_multiplier)
+    params.update(data_params(sample_specification))
+
+    try:
+        tmp_data_provider = FileDataProvider(sample_specification,
+                                             batch_size=batch_size,
+                                             read_multiplier=read_multiplier)
+
+        filler = H5Filler(classes=tmp_data_provider.config.classes,
+                          class_index_map=tmp_data_provider.config.class_index_map,
+                          in_queue=None,
+                          malloc_queue=None,
+                          worker_id=0,
+                          read_size=tmp_data_provider.config.read_size,
+                          data_sets=tmp_data_provider.config.data_sets,
+                          file_index_list=tmp_data_provider.config.file_index_list,
+                          wrap_examples=True,
+                          cache_handles=True)
+        filler.report = False
+
+        # opening every file once is not what we are measuring
+        for _ in range(5):
+            filler.build_batch()
+
+        bench_start_time = time.time()
+        for _ in range(end_count):
+            filler.build_batch()
+        delta = time.time() - bench_start_time
+        filler.file_handle_holder.close_all()
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    return result_rows('filler_planning', params, [
+        ('planning_rate', end_count / delta, 'batches/s')
+    ])
+
+
+# runs in a fresh interpreter, so that nothing is imported yet
+STARTUP_SCRIPT = """
+import json, sys, time
+
+start_time = time.time()
+from adlkit.data_provider import H5FileDataProvider
+import_time = time.time() - start_time
+
+h5py_imported = 'h5py' in sys.modules
+
+sample_specification, n_readers, backend = json.loads(sys.argv[1])
+data_provider = H5FileDataProvider(sample_specification, batch_size=100, n_readers=n_readers,
+                                   wrap_examples=True, sleep_duration=0.05)
+
+start_time = time.time()
+data_provider.start(backend=backend)
+start_delta = time.time() - start_time
+
+data_provider.first().generate().next()
+first_batch_delta = time.time() - start_time
+
+data_provider.hard_stop()
+print(json.dumps([import_time, h5py_imported, start_delta, first_batch_delta]))
+"""
+
+
+def startup(n_readers=4, backend='process', n_repeats=3, sample_specification=None):
+    """
+    Starts a data provider in a fresh interpreter n_repeats times and reports the median
+    time to import adlkit.data_provider, for start() to return and to the first batch,
+    counted from the call to start().
+    """
+    sample_specification = sample_specification or mock_sample_specification()
+
+    # the fresh interpreter has to find the same adlkit
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(adlkit.__file__)),
+                                                      env.get('PYTHONPATH')]))
+
+    timings = list()
+    h5py_imported = False
+    for _ in range(n_repeats):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT,
+                                          json.dumps([sample_specification, n_readers, backend])], env=env)
+        import_time, h5py_imported, start_delta, first_batch_delta = json.loads(output.strip().splitlines()[-1])
+        timings.append((import_time, start_delta, first_batch_delta))
+
+    import_time, start_delta, first_batch_delta = np.median(timings, axis=0)
+
+    params = dict(n_readers=n_readers, backend=backend)
+    params.update(data_params(sample_specification))
+    if h5py_imported:
+        print('warning: importing adlkit.data_provider imported h5py')
+
+    return result_rows('startup', params, [
+        ('import_time', import_time, 's'),
+        ('start_delta', start_delta, 's'),
+        ('first_batch_delta', first_batch_delta, 's')
+    ])
+
+
+def run_matrix(batch_sizes=(2048,), n_readers_list=(4,), dtypes=('float64',), n_files_list=(3,),
+               compressions=(None,), stages=STAGES, row_shape=(32, 32), end_count=50):
+    """
+    Runs the stage benchmarks over every combination of the parameters, generating the
+    synthetic files for each dtype, file count and compression on the fly.
+    :return: the result rows of every run
+    """
+    rows = list()
+    for dtype, n_files, compression in itertools.product(dtypes, n_files_list, compressions):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # enough rows for the strided reads of the largest batch
+            sample_specification = make_sample_specification(tmp_dir, n_files, max(batch_sizes) * 8,
+                                                             row_shape=row_shape, dtype=dtype,
+                                                             compression=compression)
+            for batch_size in batch_sizes:
+                if 'filler' in stages:
+                    rows.extend(filler_planning(batch_size=batch_size, end_count=end_count, read_multiplier=1,
+                                                sample_specification=sample_specification))
+                if 'reader' in stages:
+                    for step in (None, 2):
+                        rows.extend(reader_bandwidth(batch_size=batch_size, end_count=end_count, step=step,
+                                                     sample_specification=sample_specification))
+                for n_readers in n_readers_list:
+                    if 'latency' in stages:
+                        rows.extend(batch_latency(batch_size=batch_size, end_count=end_count, n_readers=n_readers,
+                                                  sleep_duration=0.05,
+                                                  sample_specification=sample_specification))
+                    if 'watcher' in stages:
+                        rows.extend(watcher_multicast(batch_size=batch_size, end_count=end_count,
+                                                      n_readers=n_readers,
+                                                      sample_specification=sample_specification))
+        finally:
+            shutil.rmtree(tmp_dir)
+    return rows
+
+
+def write_results(path, rows):
+    """
+    Writes CSV if path ends with .csv and JSON otherwise.
+    """
+    if path.endswith('.csv'):
+        field_names = list()
+        for row in rows:
+            field_names.extend(key for key in row if key not in field_names)
+        # the measurement last, after every parameter
+        for key in ('metric', 'value', 'unit'):
+            field_names.remove(key)
+            field_names.append(key)
+
+        with open(path, 'wb') as results_file:
+            writer = csv.DictWriter(results_file, field_names)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w') as results_file:
+            json.dump({
+                'created'   : time.time(),
+                'python'    : sys.version.split()[0],
+                'numpy'     : np.__version__,
+                'h5py'      : h5py.version.version,
+                'results'   : rows
+            }, results_file, indent=2)
+
+
+def load_results(path):
+    if path.endswith('.csv'):
+        with open(path, 'rb') as results_file:
+            rows = list(csv.DictReader(results_file))
+        for row in rows:
+            row['value'] = float(row['value'])
+        return rows
+
+    with open(path) as results_file:
+        return json.load(results_file)['results']
+
+
+def result_key(row):
+    # CSV reads everything back as strings and leaves blanks for missing parameters
+    return tuple(sorted((str(key), '' if value is None else str(value))
+                        for key, value in row.items() if key != 'value' and value not in (None, '')))
+
+
+def compare_results(baseline_rows, candidate_rows, threshold=0.1):
+    """
+    :param threshold: the relative change that counts as a regression
+    :return: (row key, baseline value, candidate value, relative change) of every regression
+    """
+    baseline = dict((result_key(row), row['value']) for row in baseline_rows)
+
+    regressions = list()
+    for row in candidate_rows:
+        key = result_key(row)
+        if key not in baseline or baseline[key] == 0:
+            continue
+
+        change = (row['value'] - baseline[key]) / abs(baseline[key])
+        if row['unit'] not in HIGHER_IS_BETTER:
+            change = -change
+
+        if change < -threshold:
+            regressions.append((key, baseline[key], row['value'], change))
+    return regressions
+
+
+def print_results(rows):
+    params = None
+    for row in rows:
+        row_params = [(key, value) for key, value in row.items() if key not in ('metric', 'value', 'unit')]
+        if row_params != params:
+            params = row_params
+            print('**{0}**'.format(row['benchmark']))
+            for key, value in params[1:]:
+                print(key, value)
+        print(row['metric'], row['value'], row['unit'])
+
+
+def parse_list(value, cast=str):
+    return [None if item == 'none' else cast(item) for item in value.split(',')]
 
 
 if __name__ == '__main__':
@@ -56,6 +644,46 @@ if __name__ == '__main__':
     parser.add_argument('--n_readers', type=int, default=4)
     parser.add_argument('--q_multiplier', type=int, default=3)
     parser.add_argument('--read_multiplier', type=int, default=1)
+    parser.add_argument('--n_buckets', type=int, default=10)
+    parser.add_argument('--n_fillers', type=int, default=1)
+    parser.add_argument('--batch_size', type=int, default=2048)
+    parser.add_argument('--latency', action='store_true',
+                        help='report p50/p99 per-batch latency instead of throughput')
+    parser.add_argument('--bandwidth', action='store_true',
+                        help='report reader MB/s with and without read_direct')
+    parser.add_argument('--filler', action='store_true',
+                        help='report how many batches the filler plans per second')
+    parser.add_argument('--watcher', action='store_true',
+                        help='report the per-batch overhead of multicasting through a watcher')
+    parser.add_argument('--hops', action='store_true',
+                        help='messages/s through a billiard.Queue and a DescriptorRing for every queue hop')
+    parser.add_argument('--startup', action='store_true',
+                        help='report the import time and the time to the first batch in a fresh interpreter')
+    parser.add_argument('--diagnose', action='store_true',
+                        help='report whether the run is filler, reader, memory or consumer bound')
+    parser.add_argument('--window', type=float, default=2.0,
+                        help='how many seconds --diagnose samples the pipeline for')
+    parser.add_argument('--consumer_delay', type=float, default=0.0,
+                        help='seconds the --diagnose consumer spends on every batch')
+    parser.add_argument('--backend', type=str, default='process', choices=BACKENDS + ('all',),
+                        help="run the pipeline's workers as processes, threads or compare both")
+
+    parser.add_argument('--matrix', action='store_true',
+                        help='run the stage benchmarks over every combination of the lists below')
+    parser.add_argument('--batch_sizes', type=str, default='256,2048')
+    parser.add_argument('--n_readers_list', type=str, default='1,4')
+    parser.add_argument('--dtypes', type=str, default='float32,float64')
+    parser.add_argument('--n_files_list', type=str, default='3')
+    parser.add_argument('--compressions', type=str, default='none,gzip')
+    parser.add_argument('--stages', type=str, default=','.join(STAGES))
+    parser.add_argument('--end_count', type=int, default=50)
+
+    parser.add_argument('--output', type=str, default=None,
+                        help='save the results, as CSV if the name ends with .csv and JSON otherwise')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+                        help='report metrics of CANDIDATE that regressed against BASELINE')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='the relative change that --compare flags as a regression')
 
     args = parser.parse_args()
 
@@ -68,5 +696,63 @@ if __name__ == '__main__':
     else:
         level = lg.WARNING
 
-    lg.basicConfig(level=level)
-    generator_output(n_readers=args.n_readers, read_multiplier=args.read_multiplier)
+    lg.getLogger().setLevel(level)
+
+    if args.compare:
+        regressions = compare_results(load_results(args.compare[0]), load_results(args.compare[1]),
+                                      threshold=args.threshold)
+        for key, baseline_value, candidate_value, change in regressions:
+            print('REGRESSION {0} {1} -> {2} ({3:+.1%})'.format(dict(key), baseline_value, candidate_value,
+                                                                change))
+        print('{0} regressions'.format(len(regressions)))
+        sys.exit(1 if regressions else 0)
+
+    if args.backend == 'all':
+        backends = BACKENDS
+    else:
+        backends = (args.backend,)
+
+    if args.diagnose:
+        for backend in backends:
+            print_diagnosis(diagnose_run(batch_size=args.batch_size, n_readers=args.n_readers,
+                                         q_multiplier=args.q_multiplier, read_multiplier=args.read_multiplier,
+                                         n_buckets=args.n_buckets, n_fillers=args.n_fillers, backend=backend,
+                                         window=args.window, consumer_delay=args.consumer_delay))
+        sys.exit(0)
+
+    results = list()
+    if args.matrix:
+        results.extend(run_matrix(batch_sizes=parse_list(args.batch_sizes, int),
+                                  n_readers_list=parse_list(args.n_readers_list, int),
+                                  dtypes=parse_list(args.dtypes),
+                                  n_files_list=parse_list(args.n_files_list, int),
+                                  compressions=parse_list(args.compressions),
+                                  stages=parse_list(args.stages),
+                                  end_count=args.end_count))
+    elif args.hops:
+        results.extend(queue_hops(batch_size=args.batch_size, read_multiplier=args.read_multiplier))
+    elif args.startup:
+        for backend in backends:
+            results.extend(startup(n_readers=args.n_readers, backend=backend))
+    elif args.filler:
+        results.extend(filler_planning(batch_size=args.batch_size, read_multiplier=args.read_multiplier))
+    elif args.bandwidth:
+        for read_direct in (False, True):
+            results.extend(reader_bandwidth(batch_size=args.batch_size, read_direct=read_direct))
+        for coalesce_gap in (None, 32):
+            results.extend(reader_bandwidth(batch_size=args.batch_size, step=2, coalesce_gap=coalesce_gap))
+    elif args.watcher:
+        results.extend(watcher_multicast(batch_size=args.batch_size, n_readers=args.n_readers))
+    elif args.latency:
+        for backend in backends:
+            results.extend(batch_latency(batch_size=args.batch_size, n_readers=args.n_readers,
+                                         q_multiplier=args.q_multiplier, read_multiplier=args.read_multiplier,
+                                         n_buckets=args.n_buckets, backend=backend))
+    else:
+        for backend in backends:
+            results.extend(generator_output(n_readers=args.n_readers, read_multiplier=args.read_multiplier,
+                                            backend=backend, n_fillers=args.n_fillers))
+
+    print_results(results)
+    if args.output is not None:
+        write_results(args.output, results)
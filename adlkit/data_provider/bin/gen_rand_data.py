@@ -1,13 +1,14 @@
+import argparse
 import os
-import sys
 
 import numpy as np
 import h5py
 
 
-def gen_rand_data(path, n_files, n_rows):
+def gen_rand_data(path, n_files, n_rows, shape=(5,), dtype='float64', compression=None):
     # TODO auto import to tests
     data_set_range = ['tensor_1', 'tensor_2']
+    dtype = np.dtype(dtype)
 
     for item in range(0, n_files):
         # '/'.join(os.getcwd().split('/')[:-1])
@@ -16,15 +17,26 @@ def gen_rand_data(path, n_files, n_rows):
 
         with h5py.File(file_name, 'w') as h5_file_handle:
             for data_set in data_set_range:
-                h5_file_handle.create_dataset(str(data_set), data=np.random.rand(n_rows, 5))
+                data = np.random.rand(n_rows, *shape)
+                if dtype.kind in 'iu':
+                    # rand() would truncate to zeros
+                    data *= min(np.iinfo(dtype).max, 2 ** 16)
 
+                h5_file_handle.create_dataset(str(data_set), data=data.astype(dtype),
+                                              compression=compression)
 
-# TODO generate different types of test data
-if __name__ == '__main__':
-    # TODO argparse
-
-    path = os.path.abspath(sys.argv[1])
-    n_files = int(sys.argv[2])
-    n_rows = int(sys.argv[3])
 
-    gen_rand_data(path, n_files, n_rows)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='writes h5 files of random tensor_1 and tensor_2 data sets')
+    parser.add_argument('path', type=str)
+    parser.add_argument('n_files', type=int)
+    parser.add_argument('n_rows', type=int)
+    parser.add_argument('--shape', type=str, default='5', help='the shape of a row, e.g. 32x32')
+    parser.add_argument('--dtype', type=str, default='float64')
+    parser.add_argument('--compression', type=str, default=None, help='e.g. gzip or lzf')
+    args = parser.parse_args()
+
+    gen_rand_data(os.path.abspath(args.path), args.n_files, args.n_rows,
+                  shape=tuple(int(dim) for dim in args.shape.split('x')),
+                  dtype=args.dtype,
+                  compression=args.compression)
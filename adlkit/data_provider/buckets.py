@@ -0,0 +1,94 @@
+import multiprocessing
+
+
+class BucketFreeList(object):
+    """
+    A fixed capacity FIFO of free bucket indices that lives in shared memory.
+
+    Whoever releases a bucket pushes its index, the owning reader pops one. Popping
+    blocks on a semaphore until an index is available, so acquiring a bucket is O(1)
+    and never scans or takes the per-bucket locks.
+
+    A ReaderPool's readers wait for read batches and free buckets of several data providers
+    at once, on one semaphore, the signal. Every release also releases the signal then.
+    """
+
+    def __init__(self, n_buckets, signal=None):
+        self.n_buckets = n_buckets
+        self.signal = signal
+
+        self.indices = multiprocessing.RawArray('i', n_buckets)
+        self.head = multiprocessing.RawValue('l', 0)
+        self.tail = multiprocessing.RawValue('l', 0)
+
+        self.lock = multiprocessing.Lock()
+        self.available = multiprocessing.Semaphore(0)
+
+        for bucket_index in range(n_buckets):
+            self.put(bucket_index, notify=False)
+
+    def put(self, bucket_index, notify=True):
+        """
+        :param notify: False for a bucket that was popped but not used, no one needs waking
+        """
+        with self.lock:
+            self.indices[self.tail.value % self.n_buckets] = bucket_index
+            self.tail.value += 1
+        self.available.release()
+        if notify and self.signal is not None:
+            self.signal.release()
+
+    def get(self, timeout=None):
+        """
+        :param timeout: seconds to wait for a free bucket, None waits forever.
+        :return: a bucket index or None if the timeout expired.
+        """
+        if not self.available.acquire(True, timeout):
+            return None
+
+        with self.lock:
+            bucket_index = self.indices[self.head.value % self.n_buckets]
+            self.head.value += 1
+        return bucket_index
+
+    def qsize(self):
+        return self.tail.value - self.head.value
+
+    def reset(self):
+        """
+        Marks every bucket free again. Only safe while no one else uses the list.
+        """
+        while self.available.acquire(False):
+            pass
+
+        with self.lock:
+            self.head.value = 0
+            self.tail.value = 0
+
+        for bucket_index in range(self.n_buckets):
+            self.put(bucket_index, notify=False)
+
+
+def drop_references(bucket, bucket_index, free_buckets=None, n_references=1):
+    """
+    Drops references to a bucket that was handed to several generators, whoever drops
+    the last one releases it. Only the bucket's own lock is taken, so releasing costs the
+    same however many readers and buckets there are.
+
+    :param bucket: [state, data_sets, references, releases]
+    :param free_buckets: the BucketFreeList of the bucket's reader, the index is pushed on release
+    :return: True if the bucket was released
+    """
+    state, _, references, releases = bucket
+    with references.get_lock():
+        references.value -= n_references
+        if references.value > 0:
+            return False
+        references.value = 0
+        releases.value += 1
+
+    with state.get_lock():
+        state.value = 0
+    if free_buckets is not None:
+        free_buckets.put(bucket_index)
+    return True
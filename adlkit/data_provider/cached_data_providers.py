@@ -2,10 +2,10 @@ import glob
 import os
 import random
 
-import h5py
 import numpy as np
 
 from adlkit.data_provider import H5FileDataProvider
+from adlkit.data_provider.lazy import h5py
 
 
 # TODO - wghilliard - refactor this
@@ -6,11 +6,26 @@ FILLER_OFFSET = 1000
 READER_OFFSET = 2000
 WATCHER_OFFSET = 3000
 GENERATOR_OFFSET = 4000
+POOL_OFFSET = 5000
 
 # RANDOM = np.random.random
 
 STOP_MESSAGE = 'stop'
 
+# Commands a running worker takes on its control queue. Those with a payload are sent
+# as (command, payload) tuples.
+PAUSE_MESSAGE = 'pause'
+RESUME_MESSAGE = 'resume'
+# ({class_name: class_prob},) the probabilities add up to 1
+SET_CLASS_PROB_MESSAGE = 'set_class_prob'
+# (read_batches_per_epoch,) None keeps the current one
+RESET_EPOCH_MESSAGE = 'reset_epoch'
+
+# How workers are run, as child processes or as threads of the consumer's process.
+PROCESS_BACKEND = 'process'
+THREAD_BACKEND = 'thread'
+BACKENDS = (PROCESS_BACKEND, THREAD_BACKEND)
+
 
 class Config(dict):
     def __init__(self, a_dictionary):
@@ -1,22 +1,46 @@
 import Queue
-import ctypes
+import copy
 import logging as lg
 import multiprocessing
 import signal
 import time
 
-import billiard
-import numpy as np
 from abc import ABCMeta, abstractmethod
 
-from .config import ConfigurableObject, STOP_MESSAGE
+from .arenas import BucketLayout, SharedArena
+from .buckets import BucketFreeList
+from .config import BACKENDS, ConfigurableObject, PAUSE_MESSAGE, RESET_EPOCH_MESSAGE, RESUME_MESSAGE, \
+    SET_CLASS_PROB_MESSAGE, STOP_MESSAGE, THREAD_BACKEND
 from .fillers import BaseFiller, H5Filler
 from .generators import BaseGenerator
+from .lazy import LazyModule
+from .metrics import MetricsGroup, MetricsRegistry
 from .readers import BaseReader, H5Reader
+from .rings import DescriptorCodec, DescriptorRing
 from .watchers import BaseWatcher
+from .workers import Worker, make_queue
 
 data_provider_logger = lg.getLogger('data_provider.main.dataprovdr')
 
+# only the data providers that autoscale, trace, group their readers, share a reader pool or
+# are diagnosed need these, the others do not pay for importing them
+autoscalers = LazyModule('adlkit.data_provider.autoscalers')
+diagnosis = LazyModule('adlkit.data_provider.diagnosis')
+pools = LazyModule('adlkit.data_provider.pools')
+schedulers = LazyModule('adlkit.data_provider.schedulers')
+tracing = LazyModule('adlkit.data_provider.tracing')
+
+# encoded words of a read plan's list, of each of its requests but the data set names and
+# indices, and of a data pointer but its data set names
+PLAN_WORDS = 2
+REQUEST_WORDS = 16
+POINTER_WORDS = 10
+
+
+def is_scheduler(queue):
+    # a FileAffinityScheduler can only exist once its module was imported
+    return schedulers.is_loaded() and isinstance(queue, schedulers.FileAffinityScheduler)
+
 
 class AbstractDataProvider(ConfigurableObject):
     name = None
@@ -63,10 +87,45 @@ class FileDataProvider(AbstractDataProvider):
             # If examples can be reused.
             'wrap_examples'         : True,
 
+            # If the filler, readers and watcher run as child processes ('process') or as
+            # threads of the consumer's process ('thread'). Threads skip the process spawn,
+            # pickling and shared ctypes buffers, which pays off for small or fast data sets.
+            'backend'               : 'process',
+
+            # The number of filler processes planning read batches. Each owns a disjoint
+            # shard of every class's files, raise this when the readers are starved.
+            'n_fillers'             : 1,
+
             # The number of reader processes to spawn. Each takes about ~4
             # file descriptors, so if you run out => make this number smaller.
             'n_readers'             : 20,
 
+            # If the reader pool should be resized while running. n_readers readers are
+            # started and a controller adds readers when the generators are starved or
+            # retires idle ones when the filler is the bottleneck, staying within
+            # min_readers and max_readers (None means n_readers). A decision has to hold
+            # for autoscale_patience samples taken every autoscale_interval seconds.
+            # Not supported with a watcher, its process cannot see readers added later.
+            'autoscale'             : False,
+            'min_readers'           : 1,
+            'max_readers'           : None,
+            'autoscale_interval'    : 0.5,
+            'autoscale_patience'    : 3,
+
+            # Should the workers record per stage latency histograms and counters into
+            # shared memory? Read them with stats(). Off, recording is a no-op.
+            'collect_metrics'       : False,
+
+            # The most bytes the buckets of all readers may take up, start() raises a
+            # ValueError instead of allocating more. None means no limit.
+            'memory_budget'         : None,
+
+            # Should the workers record a span per stage per batch? The newest
+            # trace_capacity spans of each worker are kept, write_trace() saves them
+            # as a Chrome trace event file for chrome://tracing or Perfetto.
+            'trace'                 : False,
+            'trace_capacity'        : 10000,
+
             # How many generators will be reading the same data? Less than
             # one will cause an error. -1 might work...
             'n_generators'          : 1,
@@ -88,6 +147,14 @@ class FileDataProvider(AbstractDataProvider):
             # Queue depth coefficient for scaling with number of readers.
             'q_multipler'           : 1,
 
+            # Should read plans and data pointers pass between the processes through
+            # shared memory rings of int64 descriptors instead of pickled queues? Ignored
+            # with the thread backend. A read plan slot holds ring_slot_words words, None
+            # sizes it for a read plan that visits every file of every class once. Larger
+            # read plans are pickled instead.
+            'descriptor_rings'      : True,
+            'ring_slot_words'       : None,
+
             # Not Implemented
             'GeneratorTimeout'      : 10,
 
@@ -133,13 +200,47 @@ class FileDataProvider(AbstractDataProvider):
             # This is used with os.sleep so either a float or an int should work.
             'sleep_duration'        : 0.5,
 
+            # The longest a worker will block on a queue or a bucket before re-checking for
+            # commands. Workers are woken as soon as the resource frees up, so this only bounds
+            # how long a stop can go unnoticed.
+            'block_timeout'         : 1,
+
+            # How long hard_stop() and restart() wait for the workers to stop by themselves
+            # before they terminate their processes, a last resort since a terminated worker
+            # may leave a lock held. None waits twice block_timeout, which is long enough for
+            # any blocked worker to notice. Threads are always left to finish on their own.
+            'stop_timeout'          : None,
+
             # If the rows should be shuffled on a per-batch basis.
             'shuffle'               : True,
 
+            # If readers should read straight into the shared memory buckets. This is only
+            # possible without a process_function, since it may change the shapes.
+            'read_direct'           : True,
+
+            # Filtered (list) reads are turned into contiguous slab reads, rows that fall in
+            # gaps of at most this many rows are read and dropped instead of seeking over
+            # them. None falls back to h5py point selection.
+            'coalesce_gap'          : 32,
+
+            # If set, readers are split into this many groups and each read batch is routed to
+            # a group by its main file, so file handles and chunk caches are not duplicated
+            # across every reader. Idle groups steal work from the others.
+            'reader_groups'         : None,
+
+            # How long an idle reader group waits on its own queue before stealing.
+            'steal_timeout'         : 0.01,
+
             # If the workers should cache the file handles or close files after reading.
-            # NOTE: File handle caching can cause undesired memory allocation.
             'cache_reader_handles'  : True,
-            'cache_filler_handles'  : False,
+            'cache_filler_handles'  : True,
+
+            # Cached file handles are kept in a least recently used pool per worker. These
+            # bound how many files each worker keeps open and how much HDF5 chunk cache
+            # those files may use in total, None means unbounded. The chunk cache can only
+            # be bounded along with the open files.
+            'max_open_files'        : 16,
+            'max_chunk_cache_bytes' : 16 * 1024 ** 2,
 
             # The number of batches a filler should create before resetting.
             'read_batches_per_epoch': None
@@ -168,36 +269,58 @@ class FileDataProvider(AbstractDataProvider):
         self.malloc_queue = None
 
         self.multicast_queues = list()
+        # encodes what passes through the descriptor rings
+        self.codec = None
 
         self.stop_check = False
         self.is_started = False
+        # set by pause(), readers started while paused start paused
+        self.paused = False
 
+        # the first filler, it is the one that reports the malloc requests
         self.filler = None
-        # self.fillers = list()
+        self.fillers = list()
         self.readers = list()
+        self.retired_readers = list()
         self.watcher = None
+        self.autoscaler = None
+        self.metrics = None
+        self.tracer = None
+
+        # set by ReaderPool.register, the pool's readers read for this data provider instead
+        # of its own, lane_metrics are their slots
+        self.reader_pool = None
+        self.lane_metrics = list()
+
+        # kept so that readers can be added after start() and for restart()
+        self.reader_class = None
+        self.reader_kwargs = dict()
+        self.worker_classes = None
         self.generators = list()
 
         # self.preloaded = False
 
         self.shared_memory = list()
+        # the blocks of memory the buckets in shared_memory are views into
+        self.arenas = list()
+        self.free_buckets = list()
         self.malloc_requests = list()
         self.extra_malloc_requests = list()
 
         if self.config.make_class_index:
             self.extra_malloc_requests.append(
-                    ('class_index', tuple())
+                    ('class_index', tuple(), 'int64')
             )
 
         if self.config.make_one_hot:
             self.extra_malloc_requests.append(
-                    ('one_hot', (len(self.config.classes),))
+                    ('one_hot', (len(self.config.classes),), 'float32')
             )
 
         self.config.translate_col_to_file_name = None
         if self.config.make_file_index:
             self.extra_malloc_requests.append(
-                    ('file_index', (2,))
+                    ('file_index', (2,), 'int64')
             )
             self.config.translate_col_to_file_name = -1
 
@@ -307,9 +430,14 @@ class FileDataProvider(AbstractDataProvider):
             self.malloc_requests.extend(malloc_requests)
         self.debug("malloc_wait_time={0}".format(time.time() - malloc_wait_time))
 
+    def bucket_layout(self):
+        return BucketLayout(self.malloc_requests + self.extra_malloc_requests, self.config.read_size)
+
     def make_shared_malloc(self, in_reader_id):
         """
-        This should be executed when a new reader is added.
+        Allocates the buckets of one or more readers as views into a single arena. This
+        should be executed when a new reader is added.
+        :param in_reader_id: a reader_id or a list of them
         :return:
         """
 
@@ -321,34 +449,75 @@ class FileDataProvider(AbstractDataProvider):
         elif isinstance(in_reader_id, list):
             loop_list = in_reader_id
 
-        for reader_id in loop_list:
+        if not loop_list:
+            return
+
+        layout = self.bucket_layout()
+        n_buckets = self.slot_buckets()
+        reader_bytes = layout.bucket_bytes * n_buckets
+
+        arena = SharedArena(reader_bytes * len(loop_list), backend=self.config.backend)
+        self.arenas.append(arena)
+
+        for arena_index, reader_id in enumerate(loop_list):
             # ensuring we don't index error
             if len(self.shared_memory) < reader_id + 1:
                 self.shared_memory.extend(
                         range(len(self.shared_memory), reader_id + 1))
+            self._extend_array(self.free_buckets, reader_id)
 
             buckets = list()
-            for bucket in range(self.config.n_buckets):
-                data_sets = []
-                for request in (
-                            self.malloc_requests + self.extra_malloc_requests):
-                    # reshape the requested shape to match the read_size
-                    shape = (self.config.read_size,) + request[1]
-
-                    shared_array_base = multiprocessing.Array(ctypes.c_double,
-                                                              np.prod(shape),
-                                                              lock=False)
-                    shared_array = np.ctypeslib.as_array(shared_array_base)
-                    shared_array = shared_array.reshape(shape)
-                    data_sets.append(shared_array)
-
+            for data_sets in arena.buckets(layout, n_buckets, offset=arena_index * reader_bytes):
                 state = multiprocessing.Value('i', 0)
-                generator_start_counter = multiprocessing.Value('i', 0)
-                generator_end_counter = multiprocessing.Value('i', 0)
-                buckets.append([state, data_sets, generator_start_counter,
-                                generator_end_counter])
+                # with a watcher, the generators still to finish with the bucket
+                references = multiprocessing.Value('i', 0)
+                releases = multiprocessing.Value('i', 0)
+                buckets.append([state, data_sets, references, releases])
+
+            self.shared_memory[reader_id] = buckets
 
-                self.shared_memory[reader_id] = buckets
+            # readers block on this instead of scanning their buckets for a free one
+            self.free_buckets[reader_id] = self.make_free_list(n_buckets)
+
+    def has_buckets(self, reader_id):
+        return reader_id < len(self.shared_memory) and isinstance(self.shared_memory[reader_id], list)
+
+    def reader_slots(self):
+        """
+        :return: how many readers start() allocates buckets for, with autoscale enough for max_readers
+        """
+        if self.reader_pool is not None:
+            return 1
+        if self.config.autoscale:
+            return max(self.config.n_readers, self.config.max_readers or 0)
+        return self.config.n_readers
+
+    def slot_buckets(self):
+        """
+        :return: how many buckets a reader slot has, the readers of a pool share a single
+        slot of n_buckets for each of them
+        """
+        if self.reader_pool is not None:
+            return self.config.n_buckets * self.reader_pool.n_readers
+        return self.config.n_buckets
+
+    def memory_report(self):
+        """
+        Bytes the buckets take up, known once the malloc requests are in.
+        :return: {'data_sets': {data_set: bytes per bucket}, 'bucket': bytes per bucket,
+        'reader': bytes per reader, 'n_readers': reader slots start() allocates, 'total': bytes
+        for all of them, 'allocated': bytes allocated so far}
+        """
+        layout = self.bucket_layout()
+        reader_bytes = layout.bucket_bytes * self.slot_buckets()
+        return {
+            'data_sets': layout.data_set_bytes(),
+            'bucket'   : layout.bucket_bytes,
+            'reader'   : reader_bytes,
+            'n_readers': self.reader_slots(),
+            'total'    : reader_bytes * self.reader_slots(),
+            'allocated': sum(arena.n_bytes for arena in self.arenas)
+        }
 
     # def wait_for_malloc_requests(self):
     #     malloc_wait_time = time.time()
@@ -358,7 +527,7 @@ class FileDataProvider(AbstractDataProvider):
 
 
     def start(self, filler_class, reader_class, generator_class,
-              watcher_class=None, shape_reader_class=None, **kwargs):
+              watcher_class=None, shape_reader_class=None, backend=None, **kwargs):
         """
 
         :param filler_class:
@@ -366,28 +535,71 @@ class FileDataProvider(AbstractDataProvider):
         :param generator_class:
         :param watcher_class:
         :param shape_reader_class:
+        :param backend: 'process' or 'thread', overrides the configured backend
         :param kwargs: sent to all fillers / readers
         :return:
         """
         start_time = time.time()
         # TODO check instance
 
-        # TODO start x2 (reset)
         if self.is_started is True:
-            self.debug("already started!")
+            self.debug("already started, use restart()")
             return
+
+        # the workers of an earlier start(), kept until now so that they can be looked at
+        self.forget_workers()
+        self.generators = list()
+        self.generator_count = 0
+
+        if backend is not None:
+            self.config.backend = backend
+        if self.config.backend not in BACKENDS:
+            raise ValueError("backend must be one of {0}, got {1}".format(BACKENDS, self.config.backend))
+
+        if self.config.autoscale and watcher_class is not None:
+            raise ValueError("autoscale cannot be used with a watcher")
+        if self.reader_pool is not None and (self.config.autoscale or self.config.reader_groups):
+            raise ValueError("autoscale and reader_groups cannot be used with a reader pool")
+
+        self.reader_class = reader_class
+        self.reader_kwargs = kwargs
+        self.worker_classes = (filler_class, shape_reader_class, watcher_class)
+
+        # one spare filler slot, start_filler may be called once more than configured
+        n_readers = max(self.config.n_readers, self.config.max_readers or 0)
+        if self.reader_pool is not None:
+            n_readers = self.reader_pool.n_readers
+        n_slots = self.config.n_fillers + 1 + n_readers + 1 + self.config.n_generators
+        if self.config.collect_metrics and self.metrics is None:
+            self.metrics = MetricsRegistry(n_slots)
+        if self.config.trace and self.tracer is None:
+            self.tracer = tracing.TraceRecorder(n_slots, capacity=self.config.trace_capacity)
+
         self.start_queues()
 
-        self.start_filler(filler_class, shape_reader_class=shape_reader_class,
-                          **kwargs)
+        for filler_id in range(self.config.n_fillers):
+            self.start_filler(filler_class, shape_reader_class=shape_reader_class,
+                              **kwargs)
         # if self.config.wait_for_malloc:
         #     self.wait_for_malloc_requests()
         self.process_malloc_requests()
-        self.make_shared_malloc(range(self.config.n_readers))
+
+        memory_report = self.memory_report()
+        data_provider_logger.info(" memory_report={0}".format(memory_report))
+        if self.config.memory_budget is not None and memory_report['total'] > self.config.memory_budget:
+            self.hard_stop()
+            raise ValueError("the buckets need {0} bytes, {1} per reader, more than memory_budget={2}".format(
+                    memory_report['total'], memory_report['reader'], self.config.memory_budget))
+
+        self.make_shared_malloc(range(self.reader_slots()))
 
         try:
-            for reader_id in range(self.config.n_readers):
-                self.start_reader(reader_class, **kwargs)
+            if self.reader_pool is None:
+                for reader_id in range(self.config.n_readers):
+                    self.start_reader(reader_class, **kwargs)
+            else:
+                self.lane_metrics = [self.worker_metrics('reader_{0}'.format(pool_reader_id))
+                                     for pool_reader_id in range(self.reader_pool.n_readers)]
         except Exception as e:
             data_provider_logger.error(e)
             self.hard_stop()
@@ -404,6 +616,9 @@ class FileDataProvider(AbstractDataProvider):
             self.hard_stop()
             raise ValueError("n_generators most likely isn't set correctly")
 
+        if self.config.autoscale:
+            self.start_autoscaler()
+
         self.is_started = True
         self.debug("start_time={0}".format(time.time() - start_time))
 
@@ -425,69 +640,288 @@ class FileDataProvider(AbstractDataProvider):
                                               file_index_list=self.config.file_index_list,
                                               process_function=self.config.process_function)
 
-        # TODO handle case where filler already exists
         if issubclass(filler_class, BaseFiller):
             filler_id = self.filler_count
             self.filler_count += 1
 
-            self.filler = filler_class(classes=self.config.classes,
-                                       class_index_map=self.config.class_index_map,
-                                       max_batches=self.config.max_batches,
-                                       file_index_list=self.config.file_index_list,
-                                       in_queue=self.in_queue,
-                                       worker_id=filler_id,
-                                       read_size=self.config.read_size,
-                                       malloc_queue=self.malloc_queue,
-                                       data_sets=self.config.data_sets,
-                                       shape_reader=shape_reader,
-                                       wrap_examples=self.config.wrap_examples,
-                                       filter_function=self.config.filter_function,
-                                       sleep_duration=self.config.sleep_duration,
-                                       read_batches_per_epoch=self.config.read_batches_per_epoch,
-                                       cache_handles=self.config.cache_filler_handles,
-                                       **kwargs)
-
-            self.filler.daemon = True
-            self.filler.start()
+            # start_filler may be called once more than configured, that filler gets its own shard
+            n_fillers = max(self.config.n_fillers, filler_id + 1)
+
+            self._extend_array(self.fillers, filler_id)
+
+            classes = self.shard_classes(self.config.classes, n_fillers)[filler_id]
+            max_batches = self.split_count(self.config.max_batches, n_fillers, filler_id)
+            read_batches_per_epoch = self.split_count(self.config.read_batches_per_epoch,
+                                                      n_fillers, filler_id, minimum=1)
+
+            filler = filler_class(classes=classes,
+                                  class_index_map=self.config.class_index_map,
+                                  max_batches=max_batches,
+                                  file_index_list=self.config.file_index_list,
+                                  in_queue=self.in_queue,
+                                  worker_id=filler_id,
+                                  read_size=self.config.read_size,
+                                  malloc_queue=self.malloc_queue,
+                                  data_sets=self.config.data_sets,
+                                  shape_reader=shape_reader,
+                                  wrap_examples=self.config.wrap_examples,
+                                  filter_function=self.config.filter_function,
+                                  sleep_duration=self.config.sleep_duration,
+                                  block_timeout=self.config.block_timeout,
+                                  read_batches_per_epoch=read_batches_per_epoch,
+                                  cache_handles=self.config.cache_filler_handles,
+                                  max_open_files=self.config.max_open_files,
+                                  max_chunk_cache_bytes=self.config.max_chunk_cache_bytes,
+                                  backend=self.config.backend,
+                                  metrics=self.worker_metrics('filler_{0}'.format(filler_id)),
+                                  **kwargs)
+
+            if filler_id == 0:
+                self.filler = filler
+            if filler_id != 0 or self.malloc_requests:
+                # the data provider only waits for one set of malloc requests, restart() none
+                filler.report = False
+
+            self.fillers[filler_id] = filler
+            filler.daemon = True
+            filler.start()
             return filler_id
         else:
             return None
 
-    def start_reader(self, reader_class, **kwargs):
+    @staticmethod
+    def shard_classes(classes, n_shards):
+        """
+        Splits every class's file_names into n_shards strided, disjoint shards, one per filler.
+        Every shard keeps every class and its class_prob, so together the fillers still
+        produce the configured class mix. A class with fewer files than shards hands its
+        files out round robin, so some fillers will share those files.
+        :param classes:
+        :param n_shards:
+        :return: a list of n_shards classes dictionaries
+        """
+        shards = list()
+        for shard_index in range(n_shards):
+            shard = copy.deepcopy(classes)
+            for class_name in shard:
+                file_names = classes[class_name]['file_names']
+                if len(file_names) >= n_shards:
+                    shard[class_name]['file_names'] = file_names[shard_index::n_shards]
+                else:
+                    shard[class_name]['file_names'] = [file_names[shard_index % len(file_names)]]
+            shards.append(shard)
+        return shards
+
+    @staticmethod
+    def split_count(count, n_shards, shard_index, minimum=0):
+        """
+        The share of count that shard_index should produce, the shares add up to count.
+        """
+        if count is None:
+            return None
+
+        share = count // n_shards
+        if shard_index < count % n_shards:
+            share += 1
+        return max(share, minimum)
+
+    def start_reader(self, reader_class, reader_id=None, **kwargs):
+        """
+        :param reader_class:
+        :param reader_id: the slot of a retired reader to reuse along with its buckets,
+        None starts a new one.
+        :param kwargs:
+        :return:
+        """
         if issubclass(reader_class, BaseReader):
-            # TODO possible off by one error
-            reader_id = self.reader_count
-            self.reader_count += 1
+            if reader_id is None:
+                # TODO possible off by one error
+                reader_id = self.reader_count
+                self.reader_count += 1
 
-            self.make_shared_malloc(reader_id)
+            if not self.has_buckets(reader_id):
+                self.make_shared_malloc(reader_id)
 
             # extending our arrays to track the readers
             self._extend_array(self.readers, reader_id)
 
-            self.readers[reader_id] = reader_class(in_queue=self.in_queue,
+            if is_scheduler(self.in_queue):
+                in_queue = self.in_queue.group(reader_id % self.in_queue.n_groups)
+            else:
+                in_queue = self.in_queue
+
+            self.readers[reader_id] = reader_class(in_queue=in_queue,
                                                    out_queue=self.out_queue,
                                                    shared_memory_pointer=self.shared_memory[reader_id],
-                                                   max_batches=self.config.max_batches,
+                                                   free_buckets=self.free_buckets[reader_id],
                                                    worker_id=reader_id,
-                                                   read_size=self.config.read_size,
-                                                   class_index_map=self.config.class_index_map,
-                                                   file_index_list=self.config.file_index_list,
-                                                   make_one_hot=self.config.make_one_hot,
-                                                   make_class_index=self.config.make_class_index,
-                                                   make_file_index=self.config.make_file_index,
-                                                   process_function=self.config.process_function,
-                                                   sleep_duration=self.config.sleep_duration,
-                                                   shuffle=self.config.shuffle,
-                                                   cache_handles=self.config.cache_reader_handles,
-                                                   **kwargs)
+                                                   metrics=self.worker_metrics('reader_{0}'.format(reader_id)),
+                                                   **self.reader_config(**kwargs))
 
             self.readers[reader_id].daemon = True
             self.readers[reader_id].start()
+            if self.paused:
+                self.readers[reader_id].send_command(PAUSE_MESSAGE)
 
             return reader_id
         else:
             return None
 
+    def reader_config(self, **kwargs):
+        """
+        :return: the keyword arguments every reader is made with, on top of its queues and buckets
+        """
+        config = dict(max_batches=self.config.max_batches,
+                      read_size=self.config.read_size,
+                      class_index_map=self.config.class_index_map,
+                      file_index_list=self.config.file_index_list,
+                      make_one_hot=self.config.make_one_hot,
+                      make_class_index=self.config.make_class_index,
+                      make_file_index=self.config.make_file_index,
+                      process_function=self.config.process_function,
+                      sleep_duration=self.config.sleep_duration,
+                      block_timeout=self.config.block_timeout,
+                      shuffle=self.config.shuffle,
+                      cache_handles=self.config.cache_reader_handles,
+                      max_open_files=self.config.max_open_files,
+                      max_chunk_cache_bytes=self.config.max_chunk_cache_bytes,
+                      read_direct=self.config.read_direct,
+                      coalesce_gap=self.config.coalesce_gap,
+                      backend=self.config.backend)
+        config.update(kwargs)
+        return config
+
+    def make_lane(self, pool_reader_id):
+        """
+        Called by a reader of the reader pool, in its own process, for a reader of this data
+        provider's read batches that it does not start but hands batches to. All of the pool's
+        lanes share the one reader slot.
+        """
+        return self.reader_class(in_queue=self.in_queue.queue,
+                                 out_queue=self.out_queue,
+                                 shared_memory_pointer=self.shared_memory[0],
+                                 free_buckets=self.free_buckets[0],
+                                 worker_id=0,
+                                 metrics=self.lane_metrics[pool_reader_id],
+                                 **self.reader_config(**self.reader_kwargs))
+
+    def start_autoscaler(self):
+        max_readers = self.config.max_readers or self.config.n_readers
+        self.autoscaler = autoscalers.ReaderAutoscaler(self,
+                                                       min_readers=self.config.min_readers,
+                                                       max_readers=max_readers,
+                                                       interval=self.config.autoscale_interval,
+                                                       patience=self.config.autoscale_patience)
+        self.autoscaler.start()
+
+    def n_active_readers(self):
+        return len(self.readers) - len(self.retired_readers)
+
+    def sample_load(self):
+        """
+        :return: (in_queue depth, out_queue depth, fraction of the active readers' buckets in use)
+        """
+        reader_ids = [reader_id for reader_id in range(len(self.readers)) if reader_id not in self.retired_readers]
+        if self.reader_pool is not None:
+            reader_ids = [0]
+
+        n_buckets = 0
+        n_free = 0
+        for reader_id in reader_ids:
+            n_buckets += self.slot_buckets()
+            n_free += self.free_buckets[reader_id].qsize()
+
+        occupancy = 1 - float(n_free) / n_buckets if n_buckets else 0.0
+        return self.in_queue.qsize(), self.out_queue.qsize(), occupancy
+
+    def queue_capacity(self):
+        """
+        :return: (in_queue capacity, capacity of the queue the generators read)
+        """
+        capacity = self.config.q_multipler * self.config.n_readers
+        in_capacity = capacity
+        if self.config.reader_groups:
+            in_capacity = self.config.reader_groups * max(1, capacity // self.config.reader_groups)
+        return in_capacity, self.out_queue_size()
+
+    def out_queue_size(self):
+        """
+        :return: the capacity of the out_queue and the multicast_queues. With a reader pool it
+        holds a data pointer for every bucket, so a pool reader never waits to put one.
+        """
+        capacity = self.config.q_multipler * self.config.n_readers
+        if self.reader_pool is not None:
+            capacity = max(capacity, self.slot_buckets())
+        return capacity
+
+    def sample_consumer_load(self):
+        """
+        :return: like sample_load, but the out depth is of the queues the generators read,
+        the multicast_queues when a watcher is running
+        """
+        in_depth, out_depth, occupancy = self.sample_load()
+        if self.watcher is not None and self.multicast_queues:
+            out_depth = sum(queue.qsize() for queue in self.multicast_queues) / float(len(self.multicast_queues))
+        return in_depth, out_depth, occupancy
+
+    def diagnose(self, window=2.0, interval=0.05):
+        """
+        Samples the queue depths and the bucket occupancy for window seconds and says whether
+        the run is filler, reader, memory or consumer bound, which stage limits it and which
+        knob to turn. The stage timings sharpen the answer when collect_metrics is set.
+
+        The consumer has to keep drawing batches meanwhile, so call this from another thread.
+        :return: see diagnosis.diagnose
+        """
+        stats_before = self.stats()
+
+        samples = list()
+        end_time = time.time() + window
+        while not samples or time.time() < end_time:
+            samples.append(self.sample_consumer_load())
+            time.sleep(interval)
+
+        totals = None
+        if self.metrics is not None:
+            totals = diagnosis.stage_totals(stats_before, self.stats())
+
+        report = diagnosis.diagnose(samples, self.queue_capacity(), totals)
+        data_provider_logger.info(" diagnosis bound={0} stage={1} knob={2}".format(report['bound'],
+                                                                                  report['stage'],
+                                                                                  report['knob']))
+        return report
+
+    def add_reader(self):
+        """
+        Starts one more reader, reusing the slot of a retired one when possible.
+        :return: the reader_id
+        """
+        reader_id = None
+        if self.retired_readers:
+            reader_id = self.retired_readers.pop()
+            # the retired reader may still be finishing its last batch
+            self.readers[reader_id].join(self.config.block_timeout * 2)
+
+        return self.start_reader(self.reader_class, reader_id=reader_id, **self.reader_kwargs)
+
+    def retire_reader(self):
+        """
+        Stops the most recently started active reader. Its buckets stay allocated, so the
+        batches it already delivered remain valid and the slot can be reused.
+        :return: the reader_id
+        """
+        reader_id = max(reader_id for reader_id in range(len(self.readers))
+                        if reader_id not in self.retired_readers)
+        self.stop_reader(reader_id)
+        self.retired_readers.append(reader_id)
+        return reader_id
+
+    def stop_autoscaler(self):
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+            self.autoscaler.join()
+            self.autoscaler = None
+
     def start_generator(self, generator_class, **kwargs):
         if issubclass(generator_class, BaseGenerator):
             generator_id = self.generator_count
@@ -514,6 +948,10 @@ class FileDataProvider(AbstractDataProvider):
                     translate_col_to_file_name=self.config.translate_col_to_file_name,
                     delivery_function=self.config.delivery_function,
                     sleep_duration=self.config.sleep_duration,
+                    block_timeout=self.config.block_timeout,
+                    free_buckets=self.free_buckets,
+                    backend=self.config.backend,
+                    metrics=self.worker_metrics('generator_{0}'.format(generator_id)),
                     **kwargs)
 
             return generator_id
@@ -527,6 +965,10 @@ class FileDataProvider(AbstractDataProvider):
                                          out_queue=self.out_queue,
                                          multicast_queues=self.multicast_queues,
                                          sleep_duration=self.config.sleep_duration,
+                                         block_timeout=self.config.block_timeout,
+                                         free_buckets=self.free_buckets,
+                                         backend=self.config.backend,
+                                         metrics=self.worker_metrics('watcher_{0}'.format(watcher_id)),
                                          **kwargs)
 
             self.watcher.daemon = True
@@ -536,115 +978,292 @@ class FileDataProvider(AbstractDataProvider):
         else:
             return None
 
+    def make_queue(self, maxsize, slot_words=None):
+        """
+        :param slot_words: the words of a ring slot, None sizes it for read plans
+        """
+        if self.config.descriptor_rings and self.config.backend != THREAD_BACKEND:
+            return DescriptorRing(maxsize, slot_words or self.ring_slot_words(), self.codec)
+        return make_queue(maxsize, self.config.backend)
+
+    def ring_slot_words(self):
+        """
+        :return: the words of a read plan slot. A read plan is a list of (file_index, data_sets,
+        class_name, read_descriptor, batch_id) requests, at most one per file of a class plus
+        the one it started in, and all of their indices add up to read_size.
+        """
+        if self.config.ring_slot_words is not None:
+            return self.config.ring_slot_words
+
+        n_words = PLAN_WORDS + self.config.read_size
+        for class_holder in self.config.classes.values():
+            n_requests = min(self.config.read_size, len(class_holder['file_names']) + 1)
+            n_words += n_requests * (REQUEST_WORDS + 2 * len(class_holder['data_set_names']))
+        return n_words
+
+    def pointer_slot_words(self):
+        """
+        :return: the words of a data pointer slot, (reader_id, bucket_index, data_sets, batch_id)
+        """
+        n_data_sets = len(self.config.data_sets) + len(self.extra_malloc_requests)
+        return POINTER_WORDS + 2 * n_data_sets
+
     def start_queues(self):
-        self.in_queue = billiard.Queue(
-                maxsize=self.config.q_multipler * self.config.n_readers)
-        self.out_queue = billiard.Queue(
-                maxsize=self.config.q_multipler * self.config.n_readers)
-        self.malloc_queue = billiard.Queue(
-                maxsize=self.config.q_multipler * self.config.n_readers)
+        # the names in the messages take one word each
+        strings = list(self.config.data_sets) + list(self.config.classes)
+        strings.extend(request[0] for request in self.extra_malloc_requests)
+        for class_holder in self.config.classes.values():
+            strings.extend(class_holder['data_set_names'])
+        self.codec = DescriptorCodec(strings)
+
+        if self.config.reader_groups:
+            self.in_queue = schedulers.FileAffinityScheduler(
+                    self.config.reader_groups,
+                    maxsize=max(1, self.config.q_multipler * self.config.n_readers // self.config.reader_groups),
+                    steal_timeout=self.config.steal_timeout,
+                    backend=self.config.backend)
+        else:
+            self.in_queue = self.make_queue(self.config.q_multipler * self.config.n_readers)
+        if self.reader_pool is not None:
+            self.in_queue = pools.PooledQueue(self.in_queue, self.reader_pool.work)
+        self.out_queue = self.make_queue(self.out_queue_size(), self.pointer_slot_words())
+        self.malloc_queue = make_queue(self.config.q_multipler * self.config.n_readers, self.config.backend)
 
         for _ in range(self.config.n_generators):
-            self.multicast_queues.append(
-                    billiard.Queue(maxsize=self.config.q_multipler * self.config.n_readers))
+            self.multicast_queues.append(self.make_queue(self.out_queue_size(), self.pointer_slot_words()))
             # multiprocessing.Queue(maxsize=self.config.q_multipler * self.config.n_readers))
 
+    @staticmethod
+    def close_queue(queue):
+        # thread backend queues have nothing to close
+        if hasattr(queue, 'close'):
+            queue.close()
+
     def stop_queues(self):
         try:
-            self.in_queue.close()
+            self.close_queue(self.in_queue)
             self.in_queue = None
         except Exception as e:
             data_provider_logger.error(e)
 
         try:
-            self.out_queue.close()
+            self.close_queue(self.out_queue)
             self.out_queue = None
         except Exception as e:
             data_provider_logger.error(e)
 
         try:
-            self.malloc_queue.close()
+            self.close_queue(self.malloc_queue)
             self.malloc_queue = None
         except Exception as e:
             data_provider_logger.error(e)
 
         for queue_index in range(len(self.multicast_queues)):
             try:
-                self.multicast_queues[queue_index].close()
+                self.close_queue(self.multicast_queues[queue_index])
             except Exception as e:
                 data_provider_logger.error(e)
 
         self.multicast_queues = list()
 
-    def hard_stop(self):
-        try:
-            self.stop_filler()
-        except Exception as e:
-            print(e)
+    def hard_stop(self, timeout=None):
+        """
+        Stops every worker and frees the queues and the buckets, start() can be called
+        again afterwards.
+        :param timeout: seconds to wait for the workers before terminating them, None
+        uses stop_grace()
+        """
+        if timeout is None:
+            timeout = self.stop_grace()
 
-        for reader_index in range(len(self.readers)):
-            try:
-                self.stop_reader(reader_index)
-            except Exception as e:
-                data_provider_logger.debug(e)
+        self.stop_workers(timeout)
+        self.drain_queues()
+        self.stop_queues()
+
+        # a generator still being iterated stops at its next batch instead of looking up a
+        # bucket that is gone, and does not hand its last one back
+        for generator in self.generators:
+            if isinstance(generator, BaseGenerator):
+                generator.request_stop()
+                generator.reset()
+
+        # the readers and generators hold on to these lists, the buckets go with their contents
+        for buckets in self.shared_memory:
+            if isinstance(buckets, list):
+                del buckets[:]
+        del self.shared_memory[:]
+        self.arenas = list()
+        self.free_buckets = list()
+        self.malloc_requests = list()
+
+        self.paused = False
+        self.is_started = False
 
-        if self.watcher is not None:
-            self.stop_watcher()
+    def restart(self):
+        """
+        Starts the data over from the first example of every class without reallocating.
+        The queues, the arena and the buckets are kept and reset, the generators are kept
+        too. A process cannot be started twice, so the fillers, readers and watcher are
+        stopped and new ones forked, which is cheap once h5py is imported.
+        """
+        if not self.is_started:
+            raise ValueError("cannot restart a data provider that was not started")
+        if self.reader_pool is not None:
+            raise ValueError("the pool's readers hold on to the queues and buckets, "
+                             "stop the pool, hard_stop and start the data provider and the pool again")
+
+        filler_class, shape_reader_class, watcher_class = self.worker_classes
 
+        stopped = self.stop_workers(self.stop_grace())
         self.drain_queues()
-        self.stop_queues()
 
-        try:
-            self.filler.join()
-        except Exception as e:
-            data_provider_logger.debug(e)
+        if not stopped:
+            # a terminated process may have died holding any lock it shared, the queues'
+            # are renewed here, the buckets' and free lists' below
+            self.stop_queues()
+            self.start_queues()
+            for generator_id, generator in enumerate(self.generators):
+                if watcher_class is None:
+                    generator.out_queue = self.out_queue
+                else:
+                    generator.out_queue = self.multicast_queues[generator_id]
+
+        for reader_id in range(len(self.shared_memory)):
+            if not self.has_buckets(reader_id):
+                continue
+            if stopped:
+                self.reset_buckets(reader_id)
+            else:
+                self.renew_buckets(reader_id)
+        for generator in self.generators:
+            generator.reset()
 
-        for reader in self.readers:
-            try:
-                reader.join()
-            except Exception as e:
-                data_provider_logger.debug(e)
+        self.forget_workers()
+        self.paused = False
 
-        if self.watcher is not None:
-            try:
-                self.watcher.join()
-            except Exception as e:
-                data_provider_logger.debug(e)
+        for filler_id in range(self.config.n_fillers):
+            self.start_filler(filler_class, shape_reader_class=shape_reader_class, **self.reader_kwargs)
+        for reader_id in range(self.config.n_readers):
+            self.start_reader(self.reader_class, **self.reader_kwargs)
+        if watcher_class is not None:
+            self.start_watcher(watcher_class)
+        if self.config.autoscale:
+            self.start_autoscaler()
 
-        # attempting to free memory, according to the internet, this may or may not actually work.
-        # del self.shared_memory
-        # gc.collect()
-        self.is_started = False
+    def stop_workers(self, timeout):
+        """
+        Stops the autoscaler, fillers, readers and watcher. A worker blocked on a queue is
+        woken by draining the queues and by a None in the queue it reads, processes still
+        running after timeout seconds are terminated.
+        :return: True if every worker stopped by itself, none was terminated or is still running
+        """
+        # otherwise it may start readers while we stop them
+        self.stop_autoscaler()
+
+        workers = [worker for worker in self.fillers + self.readers + [self.watcher]
+                   if isinstance(worker, Worker)]
+        for worker in workers:
+            worker.request_stop()
+
+        deadline = time.time() + timeout
+        alive = [worker for worker in workers if worker.is_alive()]
+        while alive and time.time() < deadline:
+            self.drain_queues()
+            self.wake(self.in_queue, len(alive))
+            self.wake(self.out_queue, 1)
+            time.sleep(0.002)
+            alive = [worker for worker in alive if worker.is_alive()]
+
+        stopped = True
+        for worker in alive:
+            if worker.backend == THREAD_BACKEND:
+                # cannot be terminated, it notices the stop within block_timeout
+                worker.join(self.config.block_timeout * 2)
+                stopped = stopped and not worker.is_alive()
+            else:
+                data_provider_logger.debug(" terminating worker_id={0}".format(worker.worker_id))
+                worker.terminate()
+                worker.join()
+                stopped = False
 
-    def stop_watcher(self):
-        self.watcher.send_command(STOP_MESSAGE)
+        for worker in workers:
+            if not worker.is_alive():
+                worker.close()
+        return stopped
 
-    def drain_queues(self):
-        while True:
-            try:
-                self.in_queue.get(timeout=1)
-            except Queue.Empty:
-                break
+    def stop_grace(self):
+        """
+        :return: seconds to wait for the workers to stop before terminating them, a worker
+        blocked on a bucket or a queue notices a stop within block_timeout
+        """
+        if self.config.stop_timeout is not None:
+            return self.config.stop_timeout
+        return self.config.block_timeout * 2
 
-        while True:
-            try:
-                self.out_queue.get(timeout=1)
-            except Queue.Empty:
-                break
+    def forget_workers(self):
+        self.filler = None
+        self.fillers = list()
+        self.filler_count = 0
+        self.readers = list()
+        self.retired_readers = list()
+        self.reader_count = 0
+        self.watcher = None
+
+    def reset_buckets(self, reader_id):
+        for bucket in self.shared_memory[reader_id]:
+            bucket[0].value = 0
+            bucket[2].value = 0
+        self.free_buckets[reader_id].reset()
+
+    def renew_buckets(self, reader_id):
+        """
+        Like reset_buckets, but with new Values and a new free list, since a terminated
+        worker may have died holding their locks. The data sets are kept, the generators
+        and the watcher look the buckets up through the same lists.
+        """
+        buckets = self.shared_memory[reader_id]
+        for bucket_index, bucket in enumerate(buckets):
+            buckets[bucket_index] = [multiprocessing.Value('i', 0), bucket[1], multiprocessing.Value('i', 0),
+                                     multiprocessing.Value('i', bucket[3].value)]
+        self.free_buckets[reader_id] = self.make_free_list(len(buckets))
+
+    def make_free_list(self, n_buckets):
+        # a reader pool waits for free buckets and read batches alike
+        signal = self.reader_pool.work if self.reader_pool is not None else None
+        return BucketFreeList(n_buckets, signal=signal)
+
+    @staticmethod
+    def wake(queue, n):
+        """
+        Puts up to n Nones into a queue, a worker waiting on it takes one and looks for a stop.
+        """
+        if queue is None:
+            return
+        queues = queue.queues if is_scheduler(queue) else [queue]
+        for _ in range(n):
+            for target in queues:
+                try:
+                    target.put(None, block=False)
+                except (Queue.Full, ValueError, AssertionError):
+                    # full or closed, either way no one is waiting to get from it
+                    pass
+
+    def stop_watcher(self):
+        self.watcher.send_command(STOP_MESSAGE)
 
+    @staticmethod
+    def drain(queue):
+        if queue is None:
+            return
         while True:
             try:
-                self.malloc_queue.get(timeout=1)
+                queue.get(block=False)
             except Queue.Empty:
-                break
+                return
 
-        for queue_index in range(len(self.multicast_queues)):
-            while True:
-                try:
-                    self.multicast_queues[queue_index].get(timeout=1)
-                except Queue.Empty:
-                    break
-                break
+    def drain_queues(self):
+        for queue in [self.in_queue, self.out_queue, self.malloc_queue] + self.multicast_queues:
+            self.drain(queue)
 
     def stop_filler(self):
         """
@@ -652,7 +1271,8 @@ class FileDataProvider(AbstractDataProvider):
         if stop fails, kill by pid / handle at end of timeout ?
         :return:
         """
-        self.filler.send_command(STOP_MESSAGE)
+        for filler in self.fillers:
+            filler.send_command(STOP_MESSAGE)
 
     def stop_reader(self, reader_id):
         try:
@@ -660,6 +1280,96 @@ class FileDataProvider(AbstractDataProvider):
         except IndexError:
             pass
 
+    def broadcast(self, command, workers):
+        """
+        Sends a command to every running worker in workers. A worker that has not taken its
+        previous command yet holds the caller up until it does, up to twice block_timeout,
+        see Worker.send_command.
+        """
+        for worker in workers:
+            if isinstance(worker, Worker) and worker.is_alive():
+                if not worker.send_command(command, timeout=self.config.block_timeout * 2):
+                    data_provider_logger.warning(" worker_id={0} did not take its last command, dropped {1}".format(
+                            worker.worker_id, command))
+
+    def pause(self):
+        """
+        Pauses the fillers and readers, e.g. so that they do not compete for CPU during a
+        validation pass. Each one stops at its next check and holds on to its read batch
+        and bucket. The queues, buckets and processes stay as they are.
+        """
+        self.paused = True
+        self.broadcast(PAUSE_MESSAGE, self.fillers + self.readers)
+
+    def resume(self):
+        self.paused = False
+        self.broadcast(RESUME_MESSAGE, self.fillers + self.readers)
+
+    def set_class_prob(self, class_probs):
+        """
+        Changes the class mix of the read batches the fillers plan from now on, e.g. for a
+        curriculum. Read batches already in the queues keep the old mix.
+        :param class_probs: {class_name: weight} for some or all classes, the others keep
+        theirs and all are normalized to add up to 1
+        :return: {class_name: class_prob} as sent to the fillers
+        """
+        unknown = set(class_probs) - set(self.config.classes)
+        if unknown:
+            raise ValueError("unknown classes {0}".format(sorted(unknown)))
+
+        weights = dict((class_name, class_holder['class_prob'])
+                       for class_name, class_holder in self.config.classes.items())
+        weights.update(class_probs)
+
+        total = float(sum(weights.values()))
+        if min(weights.values()) < 0 or total <= 0:
+            raise ValueError("class probabilities have to be non-negative and not all zero, got {0}".format(weights))
+
+        class_probs = dict((class_name, weight / total) for class_name, weight in weights.items())
+        for class_name, class_prob in class_probs.items():
+            self.config.classes[class_name]['class_prob'] = class_prob
+
+        self.broadcast((SET_CLASS_PROB_MESSAGE, class_probs), self.fillers)
+        return class_probs
+
+    def reset_epoch(self, read_batches_per_epoch=None):
+        """
+        Has the fillers start a new epoch from the first example of every class.
+        :param read_batches_per_epoch: the new epoch length, None keeps the current one
+        """
+        if read_batches_per_epoch is not None:
+            self.config.read_batches_per_epoch = read_batches_per_epoch
+
+        for filler_id, filler in enumerate(self.fillers):
+            share = self.split_count(read_batches_per_epoch, len(self.fillers), filler_id, minimum=1)
+            self.broadcast((RESET_EPOCH_MESSAGE, share), [filler])
+
+    def worker_metrics(self, name):
+        members = [registry.worker(name) for registry in (self.metrics, self.tracer) if registry is not None]
+        if not members:
+            return None
+        if len(members) == 1:
+            return members[0]
+        return MetricsGroup(members)
+
+    def stats(self):
+        """
+        :return: per worker counters and per stage latency summaries, see MetricsRegistry.stats.
+        Empty unless collect_metrics is set.
+        """
+        if self.metrics is None:
+            return dict()
+        return self.metrics.stats()
+
+    def write_trace(self, path):
+        """
+        Saves the spans recorded so far as a Chrome trace event JSON file.
+        :return: the number of events written
+        """
+        if self.tracer is None:
+            raise ValueError("tracing is off, start the data provider with trace=True")
+        return self.tracer.write(path)
+
     def first(self):
         if isinstance(self.generators[0], BaseGenerator):
             return self.generators[0]
@@ -0,0 +1,136 @@
+import collections
+
+FILLER_BOUND = 'filler'
+READER_BOUND = 'reader'
+MEMORY_BOUND = 'memory'
+CONSUMER_BOUND = 'consumer'
+BALANCED = 'balanced'
+
+# the stages a worker spends doing work rather than waiting on a queue, by worker role,
+# a reader waiting for a free bucket counts, it is short of memory
+WORK_STAGES = {
+    'filler'   : ('build_batch', 'filter_function'),
+    'reader'   : ('bucket_seek', 'h5_read', 'concat', 'process_function', 'shared_store'),
+    'generator': ('yield_wait',)
+}
+
+# the stage that limits the run when the stage timings cannot tell, e.g. without collect_metrics
+DEFAULT_STAGES = {
+    FILLER_BOUND  : 'build_batch',
+    READER_BOUND  : 'h5_read',
+    MEMORY_BOUND  : 'bucket_seek',
+    CONSUMER_BOUND: 'yield_wait',
+    BALANCED      : None
+}
+
+KNOBS = {
+    'build_batch'     : "raise n_fillers, the fillers cannot plan read batches fast enough",
+    'filter_function' : "speed up filter_function or raise n_fillers, filtering dominates the fillers",
+    'h5_read'         : "raise n_readers, or make reads cheaper with read_direct, coalesce_gap, "
+                        "cache_reader_handles or uncompressed files",
+    'concat'          : "enable read_direct so that readers read straight into the buckets",
+    'process_function': "speed up process_function or raise n_readers, it dominates the readers",
+    'shared_store'    : "enable read_direct so that readers read straight into the buckets",
+    'bucket_seek'     : "raise n_buckets, the readers are waiting for free buckets",
+    'yield_wait'      : "nothing to tune in the data provider, the consumer is the bottleneck; "
+                        "n_readers and n_buckets can be lowered to save memory",
+    None              : "nothing to tune, no stage is holding the others back"
+}
+
+# the fraction of a queue's capacity that counts as full, and as empty
+FULL = 0.5
+EMPTY = 0.1
+
+# the fraction of the buckets in use that counts as out of buckets
+EXHAUSTED = 0.9
+
+
+def stage_totals(stats_before, stats_after):
+    """
+    :param stats_before: FileDataProvider.stats() at the start of the window
+    :param stats_after: FileDataProvider.stats() at the end of the window
+    :return: {role: {stage: seconds spent in the window}} summed over the workers of a role,
+    e.g. reader_0 and reader_1 are both readers
+    """
+    totals = collections.defaultdict(lambda: collections.defaultdict(float))
+    for name, worker_stats in stats_after.items():
+        role = name.rsplit('_', 1)[0]
+        before = stats_before.get(name, {'stages': dict()})['stages']
+        for stage, summary in worker_stats['stages'].items():
+            totals[role][stage] += summary['total'] - before.get(stage, {'total': 0.0})['total']
+    return dict((role, dict(stages)) for role, stages in totals.items())
+
+
+def limiting_stage(role, totals):
+    """
+    :return: the work stage the workers of a role spent the most time in, None if unknown
+    """
+    stages = dict((stage, seconds) for stage, seconds in totals.get(role, dict()).items()
+                  if stage in WORK_STAGES[role] and seconds > 0)
+    if not stages:
+        return None
+    return max(stages, key=stages.get)
+
+
+def classify(in_fill, out_fill, occupancy, totals=None):
+    """
+    Reads the pipeline from the consumer backwards. A full consumer queue means the
+    consumer is slow. Read batches piling up in the in_queue mean the readers are behind,
+    short of memory if the buckets are used up or they mostly wait for one. With both
+    queues empty the fillers are behind.
+
+    :param in_fill: the mean fraction of the in_queue's capacity in use
+    :param out_fill: the mean fraction of the capacity of the queue the generators read in use
+    :param occupancy: the mean fraction of the active readers' buckets in use
+    :param totals: stage_totals over the same window, optional
+    :return: (bound, limiting stage)
+    """
+    totals = totals or dict()
+
+    stage = None
+    if out_fill >= FULL:
+        bound = CONSUMER_BOUND
+    elif in_fill >= FULL:
+        stage = limiting_stage('reader', totals)
+        if occupancy >= EXHAUSTED or stage == 'bucket_seek':
+            bound, stage = MEMORY_BOUND, 'bucket_seek'
+        else:
+            bound = READER_BOUND
+    elif out_fill <= EMPTY and in_fill <= EMPTY:
+        bound = FILLER_BOUND
+        stage = limiting_stage('filler', totals)
+    else:
+        bound = BALANCED
+
+    if stage is None:
+        stage = DEFAULT_STAGES[bound]
+    return bound, stage
+
+
+def diagnose(samples, queue_capacity, totals=None):
+    """
+    :param samples: (in_queue depth, depth of the queue the generators read, bucket occupancy)
+    tuples sampled over a window
+    :param queue_capacity: (in_queue capacity, capacity of the queue the generators read)
+    :param totals: stage_totals over the same window, optional
+    :return: a report dictionary, bound, stage and knob say what limits the run and what to turn
+    """
+    if not samples:
+        raise ValueError("cannot diagnose without samples")
+
+    in_depth, out_depth, occupancy = [sum(signal) / float(len(samples)) for signal in zip(*samples)]
+    in_fill = in_depth / max(1, queue_capacity[0])
+    out_fill = out_depth / max(1, queue_capacity[1])
+
+    bound, stage = classify(in_fill, out_fill, occupancy, totals)
+
+    return {
+        'bound'    : bound,
+        'stage'    : stage,
+        'knob'     : KNOBS[stage],
+        'in_fill'  : in_fill,
+        'out_fill' : out_fill,
+        'occupancy': occupancy,
+        'n_samples': len(samples),
+        'totals'   : totals or dict()
+    }
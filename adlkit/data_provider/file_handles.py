@@ -0,0 +1,90 @@
+import collections
+import logging as lg
+
+from .lazy import h5py
+
+file_handle_logger = lg.getLogger('data_provider.workers.file_handles')
+
+
+class FileHandleCache(object):
+    """
+    A least recently used pool of open h5 files, one per worker.
+
+    At most max_open_files stay open, opening another one closes the least recently
+    used. max_chunk_cache_bytes is split evenly between the open files and handed to
+    HDF5 as each file's chunk cache size, so a worker's cache memory is bounded too. It
+    can only be bounded with max_open_files.
+    """
+
+    def __init__(self, max_open_files=None, max_chunk_cache_bytes=None, opener=None):
+        if max_open_files is not None and max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1, got {0}".format(max_open_files))
+        if max_chunk_cache_bytes is not None and max_open_files is None:
+            raise ValueError("max_chunk_cache_bytes is split between the max_open_files open files, "
+                             "set max_open_files too or max_chunk_cache_bytes=None")
+
+        self.max_open_files = max_open_files
+        self.max_chunk_cache_bytes = max_chunk_cache_bytes
+        self.opener = opener or self.open_h5_file
+
+        self.handles = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def open_h5_file(self, file_path):
+        if self.max_chunk_cache_bytes is None:
+            return h5py.File(file_path, 'r')
+
+        return h5py.File(file_path, 'r', rdcc_nbytes=self.chunk_cache_bytes_per_file())
+
+    def chunk_cache_bytes_per_file(self):
+        if self.max_chunk_cache_bytes is None:
+            return None
+        return self.max_chunk_cache_bytes // self.max_open_files
+
+    def open(self, file_path):
+        try:
+            file_handle = self.handles.pop(file_path)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            while self.max_open_files is not None and len(self.handles) >= self.max_open_files:
+                self.evict()
+            file_handle = self.opener(file_path)
+
+        # (re)inserting marks the handle as the most recently used
+        self.handles[file_path] = file_handle
+        return file_handle
+
+    def evict(self):
+        file_path, file_handle = self.handles.popitem(last=False)
+        self.evictions += 1
+        self.close_handle(file_path, file_handle)
+
+    def close_all(self):
+        while self.handles:
+            file_path, file_handle = self.handles.popitem(last=False)
+            self.close_handle(file_path, file_handle)
+
+    @staticmethod
+    def close_handle(file_path, file_handle):
+        try:
+            file_handle.close()
+        except Exception as e:
+            file_handle_logger.debug("could not close {0} {1}".format(file_path, e))
+
+    def stats(self):
+        return {
+            'open_files': len(self.handles),
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'evictions' : self.evictions
+        }
+
+    def __contains__(self, file_path):
+        return file_path in self.handles
+
+    def __len__(self):
+        return len(self.handles)
@@ -3,14 +3,10 @@ import copy
 import logging as lg
 import time
 
-import h5py
-from numpy import random
-
-from .config import FILLER_OFFSET
+from .config import FILLER_OFFSET, RESET_EPOCH_MESSAGE, SET_CLASS_PROB_MESSAGE
+from .lazy import h5py
 from .workers import Worker
 
-RANDOM = random.random
-
 filler_logger = lg.getLogger('data_provider.workers.fillers')
 
 
@@ -24,6 +20,8 @@ class BaseFiller(Worker):
 
         self.max_batches = max_batches
         self.read_batches_per_epoch = read_batches_per_epoch
+        # the batch_count the current epoch started at
+        self.epoch_start = 0
         self.data_set_tracker = dict()
 
     def debug(self, message):
@@ -45,6 +43,16 @@ class BaseFiller(Worker):
     def reset(self):
         return
 
+    def handle_command(self, command):
+        if isinstance(command, tuple) and command[0] == RESET_EPOCH_MESSAGE:
+            if command[1] is not None:
+                self.read_batches_per_epoch = command[1]
+            self.debug("starting a new epoch at batch_count={0}".format(self.batch_count))
+            self.reset()
+            self.epoch_start = self.batch_count
+        else:
+            super(BaseFiller, self).handle_command(command)
+
     def run(self, **kwargs):
         self.fill()
 
@@ -57,33 +65,33 @@ class BaseFiller(Worker):
 
         while not self.should_stop() and (self.max_batches is None or self.batch_count < self.max_batches):
 
-            if self.read_batches_per_epoch is not None and self.batch_count % self.read_batches_per_epoch == 0:
+            if self.read_batches_per_epoch is not None and \
+                    (self.batch_count - self.epoch_start) % self.read_batches_per_epoch == 0:
                 self.reset()
 
             start_time = time.time()
             self.debug("start build_batch")
             batch = self.build_batch()
-            self.debug("build_batch_time={0}".format(time.time() - start_time))
+            self.metrics.observe('build_batch', time.time() - start_time, self.batch_count)
 
             if batch is None:
                 return False
 
-            # put cannot be trusted, must poll manually
-
+            # blocking on the queue wakes us as soon as a reader frees a slot, the
+            # timeout only exists so that stop commands are still noticed.
             in_queue_put_wait_time = time.time()
             self.debug("start in_queue.put")
             while not self.should_stop():
                 try:
-                    self.in_queue.put(batch, block=False)
+                    self.in_queue.put(batch, timeout=self.block_timeout)
                     self.debug("successfully put data in in_queue")
                     break
                 except Queue.Full:
-                    self.debug("in_queue is full, sleeping")
-                    self.sleep()
+                    self.debug("in_queue is full, waiting")
+                    self.metrics.increment('queue_full')
 
-            self.debug(
-                    "batch_fill_time={0} in_queue_put_wait_time={1}".format(time.time() - start_time,
-                                                                            time.time() - in_queue_put_wait_time))
+            self.metrics.observe('in_queue_put_wait', time.time() - in_queue_put_wait_time, self.batch_count)
+            self.metrics.increment('batches')
             self.batch_count += 1
 
         self.debug("exiting...")
@@ -111,7 +119,8 @@ class H5Filler(BaseFiller):
                                        worker_id=worker_id,
                                        max_batches=max_batches,
                                        malloc_queue=malloc_queue,
-                                       read_batches_per_epoch=read_batches_per_epoch)
+                                       read_batches_per_epoch=read_batches_per_epoch,
+                                       **kwargs)
         self.skip = skip
         self.read_size = read_size
 
@@ -139,26 +148,37 @@ class H5Filler(BaseFiller):
         self.report = True
         self.cache_handles = cache_handles
 
+        # imported before the worker forks, not once per worker
+        h5py.load()
+
+    def handle_command(self, command):
+        if isinstance(command, tuple) and command[0] == SET_CLASS_PROB_MESSAGE:
+            # the original classes too, or the next epoch would bring the old ones back
+            for class_name, class_prob in command[1].items():
+                self.classes[class_name]['class_prob'] = class_prob
+                self.original_classes[class_name]['class_prob'] = class_prob
+            self.debug("class_probs={0}".format(command[1]))
+        else:
+            super(H5Filler, self).handle_command(command)
+
     def inform_data_provider(self, data_sets, batch):
         malloc_requests = list()
         if self.shape_reader is None:
             for data_set in data_sets:
                 file_name = self.file_index_list[batch[0][0]]
-                if file_name in self.file_handle_holder:
-                    h5_file_handle = self.file_handle_holder[file_name]
-                else:
-                    h5_file_handle = self.file_handle_holder[file_name] = h5py.File(file_name, 'r')
+                h5_file_handle = self.file_handle_holder.open(file_name)
 
-                shape = h5_file_handle[data_set][0].shape
+                shape = h5_file_handle[data_set].shape[1:]
+                dtype = h5_file_handle[data_set].dtype.name
 
-                malloc_requests.append((data_set, shape))
+                malloc_requests.append((data_set, shape, dtype))
 
         else:
             payloads = self.shape_reader.process_batch(batch, store_in_shared=False)
             for item_index, item in enumerate(payloads):
                 shape = item.shape[1:]
                 name = 'inferred_{}'.format(item_index)
-                malloc_requests.append((name, shape))
+                malloc_requests.append((name, shape, item.dtype.name))
 
         while True:
             try:
@@ -172,20 +192,16 @@ class H5Filler(BaseFiller):
     def compute_probability(self):
         """
         # Here we determine how many of each class we want for this batch
+        Drawing each of the read_size examples from class_prob independently is the
+        same as a single multinomial draw of the per-class counts.
         :return:
         """
-        use_class = str()
-        for _ in range(self.read_size):
-            my_number = RANDOM()
-            running_sum = 0
-            for class_name in self.classes:
-                if (running_sum + self.classes[class_name]['class_prob']) > my_number > running_sum:
-                    use_class = class_name
-                    break
-                else:
-                    running_sum += self.classes[class_name]['class_prob']
+        class_names = list(self.classes)
+        class_counts = self.random_state.multinomial(self.read_size, [self.classes[class_name]['class_prob']
+                                                                      for class_name in class_names])
 
-            self.classes[use_class]['n_examples'] += 1
+        for class_name, class_count in zip(class_names, class_counts):
+            self.classes[class_name]['n_examples'] += int(class_count)
 
         for class_name in self.classes:
             self.debug(
@@ -217,11 +233,8 @@ class H5Filler(BaseFiller):
                     self.debug(['Opening:', class_name, str(tmp_class_holder['file_index']),
                                 file_name])
 
-                    # TODO make a switch that can either use `with` or self.file_handle_holder
-                    if self.cache_handles and file_name in self.file_handle_holder:
-                        h5_file_handle = self.file_handle_holder[file_name]
-                    elif self.cache_handles:
-                        h5_file_handle = self.file_handle_holder[file_name] = h5py.File(file_name, 'r')
+                    if self.cache_handles:
+                        h5_file_handle = self.file_handle_holder.open(file_name)
                     else:
                         h5_file_handle = h5py.File(file_name, 'r')
 
@@ -243,10 +256,13 @@ class H5Filler(BaseFiller):
                         tmp_filter_index_list = range(
                                 h5_file_handle[tmp_class_holder["data_set_names"][0]].shape[0])
 
-                    self.debug("filter_function_time={0}".format(time.time() - filter_time))
+                    self.metrics.observe('filter_function', time.time() - filter_time, self.batch_count)
 
                     tmp_class_holder['current_file_indices'] = sorted(tmp_filter_index_list)
 
+                    if not self.cache_handles:
+                        h5_file_handle.close()
+
                 start_index = tmp_class_holder['example_index']
 
                 possible_end_index = tmp_class_holder['example_index'] \
@@ -2,7 +2,9 @@ import Queue
 import logging as lg
 import time
 
+from .buckets import drop_references
 from .config import GENERATOR_OFFSET
+from .metrics import batch_id_of
 from .workers import Worker
 
 generator_logger = lg.getLogger('data_provider.workers.generators')
@@ -20,6 +22,7 @@ class BaseGenerator(Worker):
                  max_batches=None,
                  delivery_function=None,
                  watched=False,
+                 free_buckets=None,
                  **kwargs):
         super(BaseGenerator, self).__init__(worker_id + GENERATOR_OFFSET, **kwargs)
 
@@ -31,11 +34,21 @@ class BaseGenerator(Worker):
         self.delivery_function = delivery_function
         self.max_batches = max_batches
         self.watched = watched
+        self.free_buckets = free_buckets
         self.translate_col_to_file_name = translate_col_to_file_name
         self.generator_id = self.worker_id - GENERATOR_OFFSET
         self.last_reader_index = None
         self.last_bucket_index = None
 
+    def reset(self):
+        """
+        Forgets the bucket it last read from and its batch count, the buckets were reset
+        under it, e.g. by FileDataProvider.restart.
+        """
+        self.last_reader_index = None
+        self.last_bucket_index = None
+        self.batch_count = 0
+
     def debug(self, message):
         if isinstance(message, list):
             message = " ".join(message)
@@ -54,14 +67,17 @@ class BaseGenerator(Worker):
             if self.last_reader_index is not None and self.last_bucket_index is not None:
                 self.debug("attempting to get lock to release buckets")
                 if self.watched:
-                    with self.shared_memory_pointer[self.last_reader_index][self.last_bucket_index][3].get_lock():
-                        # self.debug("setting bucket3 to {}".format(
-                        #         self.shared_memory_pointer[self.last_reader_index][self.last_bucket_index][
-                        #             3].value + 1))
-                        self.shared_memory_pointer[self.last_reader_index][self.last_bucket_index][3].value += 1
+                    # the watcher handed the bucket to every generator, the last one out releases it
+                    free_buckets = None
+                    if self.free_buckets is not None:
+                        free_buckets = self.free_buckets[self.last_reader_index]
+                    drop_references(self.shared_memory_pointer[self.last_reader_index][self.last_bucket_index],
+                                    self.last_bucket_index, free_buckets=free_buckets)
                 else:
                     with self.shared_memory_pointer[self.last_reader_index][self.last_bucket_index][0].get_lock():
                         self.shared_memory_pointer[self.last_reader_index][self.last_bucket_index][0].value = 0
+                    if self.free_buckets is not None:
+                        self.free_buckets[self.last_reader_index].put(self.last_bucket_index)
 
                 self.debug(
                         "successfully got lock and released buckets last_reader_index={0} "
@@ -75,29 +91,18 @@ class BaseGenerator(Worker):
             self.debug("attempting to get read_batch from out_queue")
             start_time = time.time()
             try:
-                read_batch = self.out_queue.get(timeout=1)
+                read_batch = self.out_queue.get(timeout=self.block_timeout)
             except Queue.Empty:
-                # self.debug("out_queue empty, sleeping")
-                self.sleep()
+                self.metrics.increment('queue_empty')
             finally:
                 if read_batch is not None:
-                    self.debug(
-                            "multi_or_out_queue_get_wait_time={0}".format(time.time() - start_time))
-                    # self.debug("multi_or_out_queue_get_wait_time={0} queue_size={1}".format(
-                    # time.time() - start_time, self.out_queue.qsize()))
+                    self.metrics.observe('out_queue_get_wait', time.time() - start_time, batch_id_of(read_batch))
                     self.debug("successfully got a read_batch from the out_queue")
                     try:
                         reader_id, bucket_index, data_sets, batch_id = read_batch
                     except ValueError:
                         yield None
 
-                    if self.watched:
-                        with self.shared_memory_pointer[reader_id][bucket_index][2].get_lock():
-                            self.debug("writing ahead reader_id={} bucket_index={}".format(reader_id, bucket_index))
-                            # self.debug("setting bucket2 to {}".format(
-                            #         self.shared_memory_pointer[reader_id][bucket_index][2].value + 1))
-                            self.shared_memory_pointer[reader_id][bucket_index][2].value += 1
-
                     payload = self.shared_memory_pointer[reader_id][bucket_index][1]
 
                     self.last_bucket_index = bucket_index
@@ -130,7 +135,9 @@ class BaseGenerator(Worker):
 
                         self.debug(
                                 "successfully delivered a batch, continuing from generator yield")
-                        self.debug("yield_wait_time={0}".format(time.time() - yield_wait_time))
+                        self.metrics.observe('yield_wait', time.time() - yield_wait_time, batch_id)
+                        self.metrics.increment('batches')
+                        self.metrics.increment('examples', len(batch[0]))
                         self.batch_count += 1
 
         self.debug("exiting...")
@@ -0,0 +1,35 @@
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stands in for a module that is slow to import, e.g. h5py, and imports it the first
+    time one of its attributes is used.
+
+        h5py = LazyModule('h5py')
+        h5py.File(file_path, 'r')
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def load(self):
+        """
+        Imports the module now, workers call this before they fork so that every child
+        does not import it again.
+        :return: the module
+        """
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return self.module
+
+    def is_loaded(self):
+        return self.module is not None
+
+    def __getattr__(self, attribute):
+        # only called for what the instance itself does not have
+        return getattr(self.load(), attribute)
+
+
+h5py = LazyModule('h5py')
@@ -0,0 +1,205 @@
+import bisect
+import multiprocessing
+
+import numpy as np
+
+# Every timed step of the pipeline. Fillers plan and queue read batches, readers wait on
+# the in_queue, claim a bucket, read, concatenate, process and store, generators and the
+# watcher wait on the out_queue and the consumer holds every yielded batch.
+STAGES = (
+    'build_batch',
+    'filter_function',
+    'in_queue_put_wait',
+    'in_queue_get_wait',
+    'bucket_seek',
+    'h5_read',
+    'concat',
+    'process_function',
+    'shared_store',
+    'process_batch',
+    'out_queue_put_wait',
+    'out_queue_get_wait',
+    'multicast_put_wait',
+    'yield_wait'
+)
+
+COUNTERS = (
+    'batches',
+    'examples',
+    'queue_full',
+    'queue_empty'
+)
+
+STAGE_INDEX = dict((stage, index) for index, stage in enumerate(STAGES))
+COUNTER_INDEX = dict((counter, index) for index, counter in enumerate(COUNTERS))
+
+# Upper bounds of the latency histogram bins in seconds, powers of two from 1us to ~16s.
+# One more bin collects everything slower.
+BIN_BOUNDS = tuple(1e-6 * 2 ** power for power in range(25))
+
+
+def shared_array(shape, dtype):
+    dtype = np.dtype(dtype)
+    base = multiprocessing.RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+    return np.frombuffer(base, dtype=dtype).reshape(shape)
+
+
+def batch_id_of(data_pointer):
+    """
+    :return: the batch_id of a (reader_id, bucket_index, data_sets, batch_id) data pointer,
+    None for anything else
+    """
+    if isinstance(data_pointer, tuple) and len(data_pointer) == 4:
+        return data_pointer[3]
+    return None
+
+
+class SlotRegistry(object):
+    """
+    Hands every worker a slot of its own in shared memory, so that it is the only one
+    writing to it.
+    """
+
+    def __init__(self, n_slots):
+        self.n_slots = n_slots
+
+        # only ever changed by the process that created the registry, before forking
+        self.slot_names = dict()
+
+    def slot(self, name):
+        """
+        :param name: e.g. reader_3, asking for the same name again returns the same slot
+        """
+        slots = dict((slot_name, slot) for slot, slot_name in self.slot_names.items())
+        if name in slots:
+            return slots[name]
+
+        if len(self.slot_names) == self.n_slots:
+            raise ValueError("all {0} slots are taken, cannot add {1}".format(self.n_slots, name))
+
+        slot = len(self.slot_names)
+        self.slot_names[slot] = name
+        return slot
+
+
+class MetricsRegistry(SlotRegistry):
+    """
+    Counters and latency histograms for every worker, kept in shared memory so that
+    workers in other processes can record into them without a queue or a lock.
+    """
+
+    def __init__(self, n_slots):
+        super(MetricsRegistry, self).__init__(n_slots)
+
+        self.stage_counts = shared_array((n_slots, len(STAGES)), 'int64')
+        self.stage_totals = shared_array((n_slots, len(STAGES)), 'float64')
+        self.histograms = shared_array((n_slots, len(STAGES), len(BIN_BOUNDS) + 1), 'int64')
+        self.counters = shared_array((n_slots, len(COUNTERS)), 'int64')
+
+    def worker(self, name):
+        """
+        :return: the WorkerMetrics of the worker's slot
+        """
+        return WorkerMetrics(self, self.slot(name))
+
+    def stats(self):
+        """
+        :return: {worker_name: {'counters': {...}, 'stages': {stage: summary}}}, only stages that
+        were observed are listed
+        """
+        out = dict()
+        for slot, name in sorted(self.slot_names.items()):
+            stages = dict()
+            for stage, stage_index in STAGE_INDEX.items():
+                count = int(self.stage_counts[slot, stage_index])
+                if count == 0:
+                    continue
+
+                histogram = self.histograms[slot, stage_index]
+                total = float(self.stage_totals[slot, stage_index])
+                stages[stage] = {
+                    'count'    : count,
+                    'total'    : total,
+                    'mean'     : total / count,
+                    'p50'      : self.percentile(histogram, 50),
+                    'p99'      : self.percentile(histogram, 99),
+                    'histogram': histogram.tolist()
+                }
+
+            out[name] = {
+                'counters': dict((counter, int(self.counters[slot, counter_index]))
+                                 for counter, counter_index in COUNTER_INDEX.items()),
+                'stages'  : stages
+            }
+        return out
+
+    @staticmethod
+    def percentile(histogram, q):
+        """
+        :return: the upper bound of the bin holding the q-th percentile, inf for the last bin
+        """
+        cumulative = np.cumsum(histogram)
+        bin_index = int(np.searchsorted(cumulative, cumulative[-1] * q / 100.0))
+        if bin_index >= len(BIN_BOUNDS):
+            return float('inf')
+        return BIN_BOUNDS[bin_index]
+
+    def reset(self):
+        self.stage_counts[...] = 0
+        self.stage_totals[...] = 0
+        self.histograms[...] = 0
+        self.counters[...] = 0
+
+
+class WorkerMetrics(object):
+    """
+    A worker's view of its slot in a MetricsRegistry.
+    """
+
+    def __init__(self, registry, slot):
+        self.slot = slot
+        self.stage_counts = registry.stage_counts[slot]
+        self.stage_totals = registry.stage_totals[slot]
+        self.histograms = registry.histograms[slot]
+        self.counters = registry.counters[slot]
+
+    def observe(self, stage, seconds, batch_id=None, end=None):
+        stage_index = STAGE_INDEX[stage]
+        self.stage_counts[stage_index] += 1
+        self.stage_totals[stage_index] += seconds
+        self.histograms[stage_index, bisect.bisect_left(BIN_BOUNDS, seconds)] += 1
+
+    def increment(self, counter, amount=1):
+        self.counters[COUNTER_INDEX[counter]] += amount
+
+
+class NullMetrics(object):
+    """
+    Stands in for WorkerMetrics when metrics are disabled.
+    """
+
+    def observe(self, stage, seconds, batch_id=None, end=None):
+        pass
+
+    def increment(self, counter, amount=1):
+        pass
+
+
+class MetricsGroup(object):
+    """
+    Hands every observation to several recorders, e.g. a WorkerMetrics and a WorkerTracer.
+    """
+
+    def __init__(self, members):
+        self.members = members
+
+    def observe(self, stage, seconds, batch_id=None, end=None):
+        for member in self.members:
+            member.observe(stage, seconds, batch_id, end)
+
+    def increment(self, counter, amount=1):
+        for member in self.members:
+            member.increment(counter, amount)
+
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,261 @@
+import Queue
+import logging as lg
+import multiprocessing
+import time
+
+from .config import POOL_OFFSET, PROCESS_BACKEND, THREAD_BACKEND
+from .readers import EXIT
+from .workers import Worker
+
+pool_logger = lg.getLogger('data_provider.workers.pool')
+
+
+class PooledQueue(object):
+    """
+    Stands in for the in_queue of a data provider served by a ReaderPool. Every put also
+    signals the pool, so that its readers wait on one semaphore for the read batches of
+    all the data providers instead of on each queue in turn.
+    """
+
+    def __init__(self, queue, work):
+        self.queue = queue
+        self.work = work
+
+    def put(self, batch, block=True, timeout=None):
+        self.queue.put(batch, block, timeout)
+        self.work.release()
+
+    def get(self, block=True, timeout=None):
+        return self.queue.get(block, timeout)
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def close(self):
+        # thread backend queues have nothing to close
+        if hasattr(self.queue, 'close'):
+            self.queue.close()
+
+
+class ReaderPool(object):
+    """
+    Readers shared by several FileDataProviders, e.g. the train and the validation split.
+    Each data provider keeps its own fillers, buckets and generators but starts no
+    readers, the pool's readers read for all of them. They take read batches round robin
+    across the data providers, and only from one with a free bucket, so a split no one is
+    drawing from cannot hold on to the readers while the others starve.
+
+    The readers inherit the data providers' queues and buckets when they fork, so every
+    data provider is registered and started before the pool is:
+
+        pool = ReaderPool(n_readers=20)
+        pool.register(train)
+        pool.register(validation)
+        train.start()
+        validation.start()
+        pool.start()
+    """
+
+    def __init__(self, n_readers=10, block_timeout=1, stop_timeout=None, backend=PROCESS_BACKEND):
+        if n_readers < 1:
+            raise ValueError("a reader pool needs at least one reader, got {0}".format(n_readers))
+
+        self.n_readers = n_readers
+        self.block_timeout = block_timeout
+        self.stop_timeout = stop_timeout
+        self.backend = backend
+
+        # released once per read batch put into any of the data providers' in_queues and
+        # once per bucket freed
+        self.work = multiprocessing.Semaphore(0)
+
+        self.data_providers = list()
+        self.readers = list()
+
+    def register(self, data_provider):
+        if self.readers:
+            raise ValueError("register every data provider before the reader pool starts")
+        if data_provider.is_started:
+            raise ValueError("register a data provider before it starts")
+
+        data_provider.reader_pool = self
+        self.data_providers.append(data_provider)
+
+    def start(self, **kwargs):
+        if self.readers:
+            raise ValueError("the reader pool is already started, stop() it first")
+        for data_provider in self.data_providers:
+            if not data_provider.is_started:
+                raise ValueError("start every registered data provider before the reader pool")
+            if data_provider.config.backend != self.backend:
+                raise ValueError("the reader pool runs on the {0} backend, a data provider on {1}".format(
+                        self.backend, data_provider.config.backend))
+
+        for pool_reader_id in range(self.n_readers):
+            reader = PoolReader(worker_id=pool_reader_id,
+                                data_providers=self.data_providers,
+                                work=self.work,
+                                block_timeout=self.block_timeout,
+                                backend=self.backend,
+                                **kwargs)
+            reader.daemon = True
+            reader.start()
+            self.readers.append(reader)
+
+    def stop(self, timeout=None):
+        """
+        Stops the readers, the data providers keep running and the pool can be started again.
+        :param timeout: seconds to wait for the readers before terminating them, None
+        uses stop_timeout or else twice block_timeout, long enough for any blocked reader
+        to notice
+        :return: True if every reader stopped by itself
+        """
+        if timeout is None:
+            timeout = self.stop_timeout
+        if timeout is None:
+            timeout = self.block_timeout * 2
+
+        for reader in self.readers:
+            reader.request_stop()
+
+        deadline = time.time() + timeout
+        alive = [reader for reader in self.readers if reader.is_alive()]
+        while alive and time.time() < deadline:
+            for _ in alive:
+                self.work.release()
+            time.sleep(0.002)
+            alive = [reader for reader in alive if reader.is_alive()]
+
+        stopped = True
+        for reader in alive:
+            if reader.backend == THREAD_BACKEND:
+                # cannot be terminated, it notices the stop within block_timeout
+                reader.join(self.block_timeout * 2)
+                stopped = stopped and not reader.is_alive()
+            else:
+                reader.terminate()
+                reader.join()
+                stopped = False
+
+        for reader in self.readers:
+            if not reader.is_alive():
+                reader.close()
+
+        # drops the wake ups no reader took, the read batches still queued are signalled
+        # again for the next readers
+        while self.work.acquire(False):
+            pass
+        for data_provider in self.data_providers:
+            if data_provider.in_queue is not None:
+                for _ in range(data_provider.in_queue.qsize()):
+                    self.work.release()
+
+        self.readers = list()
+        return stopped
+
+    def hard_stop(self):
+        """
+        Stops the readers and then every registered data provider.
+        """
+        self.stop()
+        for data_provider in self.data_providers:
+            data_provider.hard_stop()
+
+
+class PoolReader(Worker):
+    """
+    One of a ReaderPool's readers. It builds a reader of every data provider, a lane, and
+    hands each read batch it takes to the lane of the data provider it came from.
+    """
+
+    def __init__(self, worker_id, data_providers, work, **kwargs):
+        super(PoolReader, self).__init__(worker_id=worker_id + POOL_OFFSET, **kwargs)
+        self.pool_reader_id = worker_id
+        self.data_providers = data_providers
+        self.work = work
+
+    def run(self, **kwargs):
+        lanes = [data_provider.make_lane(self.pool_reader_id) for data_provider in self.data_providers]
+        for lane in lanes:
+            # a lane blocked on its data provider stops with the pool reader
+            lane.stop_flag = self.stop_flag
+
+        self.serve(lanes)
+
+        for lane in lanes:
+            lane.seppuku()
+        self.seppuku()
+
+    def serve(self, lanes):
+        # the readers start at different lanes, so that they do not all favour the first
+        next_lane = self.pool_reader_id % len(lanes)
+        wait_time = time.time()
+        # since when the read batches have been waiting for buckets
+        short_since = None
+
+        while not self.should_stop():
+            # a read batch or a free bucket, whichever came last may make a lane servable
+            if not self.work.acquire(True, self.block_timeout):
+                continue
+
+            claim_time = time.time()
+            lane_index, batch = self.take(lanes, next_lane)
+            if lane_index is None:
+                # the next bucket freed signals again
+                if any(lane.in_queue.qsize() for lane in lanes):
+                    short_since = short_since or claim_time
+                else:
+                    short_since = None
+                continue
+
+            next_lane = (lane_index + 1) % len(lanes)
+            if batch is None:
+                # a wake up, the lane's bucket went back
+                continue
+
+            lane = lanes[lane_index]
+            lane.claim_wait = time.time() - (short_since or claim_time)
+            short_since = None
+
+            data_pointer = lane.serve(batch, time.time() - wait_time)
+            if data_pointer is EXIT:
+                return
+            elif data_pointer is None:
+                pool_logger.error(" pool_reader_id={0} dropped a read batch of data provider {1}".format(
+                        self.pool_reader_id, lane_index))
+            self.batch_count += 1
+            wait_time = time.time()
+
+    def take(self, lanes, first):
+        """
+        Takes a read batch from the first lane, from first on, that has one and a free
+        bucket to read it into. The bucket is claimed for the lane.
+        :return: (lane_index, batch), (None, None) if no lane has both
+        """
+        for offset in range(len(lanes)):
+            lane_index = (first + offset) % len(lanes)
+            lane = lanes[lane_index]
+
+            if not lane.in_queue.qsize():
+                continue
+
+            bucket_index = lane.free_buckets.get(timeout=0)
+            if bucket_index is None:
+                continue
+
+            try:
+                batch = lane.in_queue.get(block=False)
+            except Queue.Empty:
+                # another reader took it, or it is still in the pipe, in which case no one
+                # else may be signalled for it
+                lane.free_buckets.put(bucket_index, notify=False)
+                self.work.release()
+                continue
+
+            if batch is None:
+                lane.free_buckets.put(bucket_index, notify=False)
+            else:
+                lane.claimed_bucket = bucket_index
+            return lane_index, batch
+
+        return None, None
@@ -3,12 +3,12 @@ import collections
 import logging as lg
 import time
 
-import h5py
-import keras
 import numpy as np
 from six import raise_from
 
 from .config import READER_OFFSET
+from .lazy import h5py
+from .metrics import batch_id_of
 from .workers import Worker
 
 # lg.basicConfig(level=lg.INFO)
@@ -18,18 +18,37 @@ reader_logger = lg.getLogger('data_provider.workers.readers')
 EXIT = object()
 
 
+def coalesce_read_descriptor(read_descriptor, gap_threshold):
+    """
+    Splits a sorted list of row indices into contiguous slabs. Neighbouring runs are
+    merged when at most gap_threshold rows separate them, since reading a few unused
+    rows is cheaper than another seek.
+    :param read_descriptor: sorted row indices
+    :param gap_threshold: the largest number of skipped rows that is read over
+    :return: (slab_starts, slab_ends) as numpy arrays, ends are exclusive
+    """
+    indices = np.asarray(read_descriptor)
+    breaks = np.flatnonzero(np.diff(indices) > gap_threshold + 1) + 1
+
+    slab_starts = indices[np.concatenate(([0], breaks))]
+    slab_ends = indices[np.concatenate((breaks - 1, [len(indices) - 1]))] + 1
+    return slab_starts, slab_ends
+
+
 class BaseReader(Worker):
     """
 
     """
 
     def __init__(self, worker_id, in_queue, out_queue, shared_memory_pointer,
-                 read_size, max_batches=None, **kwargs):
+                 read_size, max_batches=None, free_buckets=None, **kwargs):
         """
         :param worker_index:
         :param in_queue:
         :param out_queue:
         :param shared_memory_pointer:
+        :param free_buckets: a BucketFreeList of the buckets in shared_memory_pointer, pushed
+        to by whoever frees a bucket. Without it the reader falls back to scanning.
         """
 
         # TODO not sure if this is the correct syntax
@@ -41,7 +60,12 @@ class BaseReader(Worker):
         self.shared_memory_pointer = shared_memory_pointer
         self.max_batches = max_batches
         self.read_size = read_size
+        self.free_buckets = free_buckets
         self.reader_id = self.worker_id - READER_OFFSET
+        # a bucket taken off free_buckets by whoever handed over the next batch, e.g. a pool
+        # reader, and how long it waited for one
+        self.claimed_bucket = None
+        self.claim_wait = 0.0
 
     def debug(self, message):
         if isinstance(message, list):
@@ -89,53 +113,75 @@ class BaseReader(Worker):
         while not self.should_stop() and (self.max_batches is None or self.batch_count < self.max_batches):
             batch = self.get_batch()
             if batch is not None:
-                # self.info("in_queue_get_wait_time={0} in_queue_size={1}".format(time.time() - in_queue_time,
-                # self.in_queue.qsize()))
-                self.debug("in_queue_get_wait_time={0}".format(time.time() - in_queue_time))
-                start_time = time.time()
-                self.debug("starting to prepare batch")
-                data_pointer = self.process_batch(batch)
-                self.debug("process_batch_time={0}".format(time.time() - start_time))
+                data_pointer = self.serve(batch, time.time() - in_queue_time)
 
                 if data_pointer is None:
-                    self.critical(
-                            "process_batch returned None, exiting... {0}".format(
-                                    batch))
                     return False
 
                 elif data_pointer is EXIT:
                     break
 
-                self.debug("starting out_queue.put")
-                wait_time = time.time()
-                while not self.should_stop():
-                    try:
-                        self.out_queue.put(data_pointer, timeout=0)
-                        self.debug("successfully put data in out_queue")
-                        break
-                    except Queue.Full:
-                        # self.debug("out_queue is full, sleeping")
-                        self.sleep()
-
-                self.debug("batch_read_time={0} out_queue_put_wait_time={1}".format(time.time() - start_time,
-                                                                                    time.time() - wait_time))
-                # self.info("batch_read_time={0} out_queue_put_wait_time={1} out_queue_size={2}".format(time.time() -
-                #  start_time, time.time() - wait_time, self.out_queue.qsize()))
-
-                self.batch_count += 1
                 in_queue_time = time.time()
-            else:
-                self.sleep()
-                # time.sleep(self.sleep_duration)
-                pass
 
         self.debug("exiting...")
         self.seppuku()
 
+    def serve(self, batch, in_queue_get_wait=0.0):
+        """
+        Reads one read batch into a bucket and puts its data pointer in the out_queue.
+        :param in_queue_get_wait: how long the batch was waited for
+        :return: the data pointer, None if process_batch failed or EXIT if stopped meanwhile
+        """
+        start_time = time.time()
+        self.debug("starting to prepare batch")
+        data_pointer = self.process_batch(batch)
+        batch_id = batch_id_of(data_pointer)
+        # the wait ended when the batch was taken, not now
+        self.metrics.observe('in_queue_get_wait', in_queue_get_wait, batch_id, end=start_time)
+        self.metrics.observe('process_batch', time.time() - start_time, batch_id)
+
+        if data_pointer is None:
+            self.critical(
+                    "process_batch returned None, exiting... {0}".format(
+                            batch))
+            return None
+
+        elif data_pointer is EXIT:
+            return EXIT
+
+        self.debug("starting out_queue.put")
+        wait_time = time.time()
+        delivered = False
+        while not self.should_stop():
+            try:
+                self.out_queue.put(data_pointer, timeout=self.block_timeout)
+                self.debug("successfully put data in out_queue")
+                delivered = True
+                break
+            except Queue.Full:
+                self.metrics.increment('queue_full')
+
+        if not delivered and self.free_buckets is not None:
+            # stopped before anyone saw the bucket, hand it back to whoever
+            # takes over this reader's buckets
+            self.release_bucket(data_pointer[1])
+
+        self.metrics.observe('out_queue_put_wait', time.time() - wait_time, batch_id)
+        self.metrics.increment('batches')
+        self.metrics.increment('examples', self.read_size)
+
+        self.batch_count += 1
+        return data_pointer
+
+    def release_bucket(self, bucket_index):
+        self.shared_memory_pointer[bucket_index][0].value = 0
+        self.free_buckets.put(bucket_index)
+
     def get_batch(self):
         try:
-            return self.in_queue.get(timeout=1)
+            return self.in_queue.get(timeout=self.block_timeout)
         except Queue.Empty:
+            self.metrics.increment('queue_empty')
             return None
 
     def process_batch(self, batch, **kwargs):
@@ -145,13 +191,27 @@ class BaseReader(Worker):
         self.debug("attempting to find a bucket")
         start_time = time.time()
         try:
+            if self.claimed_bucket is not None:
+                bucket_index, self.claimed_bucket = self.claimed_bucket, None
+                self.shared_memory_pointer[bucket_index][0].value = 1
+                self.metrics.observe('bucket_seek', self.claim_wait + time.time() - start_time)
+                return bucket_index
+
+            if self.free_buckets is not None:
+                while not self.should_stop():
+                    bucket_index = self.free_buckets.get(timeout=self.block_timeout)
+                    if bucket_index is not None:
+                        self.shared_memory_pointer[bucket_index][0].value = 1
+                        self.metrics.observe('bucket_seek', time.time() - start_time)
+                        return bucket_index
+                return None
+
             while not self.should_stop():
                 for bucket_index, bucket in enumerate(self.shared_memory_pointer):
                     with bucket[0].get_lock():
                         if bucket[0].value == 0:
                             bucket[0].value = 1
-                            self.debug("bucket_seek_time={0} bucket_index={1}".format(time.time() - start_time,
-                                                                                      bucket_index))
+                            self.metrics.observe('bucket_seek', time.time() - start_time)
                             assert bucket_index is not None
                             return bucket_index
                 self.sleep()
@@ -172,6 +232,8 @@ class H5Reader(BaseReader):
                  make_file_index=False,
                  shuffle=True,
                  cache_handles=False,
+                 read_direct=True,
+                 coalesce_gap=32,
                  **kwargs):
         super(self.__class__, self).__init__(worker_id=worker_id,
                                              in_queue=in_queue,
@@ -191,6 +253,11 @@ class H5Reader(BaseReader):
         self.make_file_index = make_file_index
         self.shuffle = shuffle
         self.cache_handles = cache_handles
+        self.read_direct = read_direct
+        self.coalesce_gap = coalesce_gap
+
+        # imported before the worker forks, not once per worker
+        h5py.load()
 
     def process_batch(self, batch, store_in_shared=True):
         batch_id = 0
@@ -205,6 +272,18 @@ class H5Reader(BaseReader):
             bucket_index = 0
         data_sets = list()
 
+        # Without a process_function the bucket layout is known up front, so every
+        # read_request is read straight into its offset in the bucket.
+        direct = store_in_shared and self.read_direct and self.process_function is None
+        if direct:
+            bucket = self.shared_memory_pointer[bucket_index][1]
+            data_set_slots = collections.OrderedDict()
+
+            # the label tensors follow the data sets in the bucket, they are written in place
+            labels = self.make_labels(bucket)
+        else:
+            labels = self.make_labels()
+
         # saving memory address of shared_memory_pointer for check later
         # tmp = hex(id(self.shared_memory_pointer[0][0][1][0]))
 
@@ -213,28 +292,40 @@ class H5Reader(BaseReader):
 
         # file_list = list()
         # file_struct = collections.OrderedDict()
-        tmp_file_struct = list()
-
-        tmp_index_payload = None
         start = 0
         n_read_requests = len(batch)
 
-        payloads_build_time = time.time()
         for read_index, read_request in enumerate(batch):
             file_path_index, data_sets, class_name, read_descriptor, batch_id = read_request
 
             file_path = self.file_index_list[file_path_index]
 
             if self.cache_handles:
-                if file_path in self.file_handle_holder:
-                    h5_file_handle = self.file_handle_holder[file_path]
-                else:
-                    h5_file_handle = self.file_handle_holder[file_path] = h5py.File(file_path, 'r')
+                h5_file_handle = self.file_handle_holder.open(file_path)
             else:
                 h5_file_handle = h5py.File(file_path, 'r')
 
+            if isinstance(read_descriptor, tuple):
+                n_examples = read_descriptor[1] - read_descriptor[0]
+            else:
+                n_examples = len(read_descriptor)
+
             h5_to_payloads_time = time.time()
             for data_set in data_sets:
+                if direct:
+                    if data_set not in data_set_slots:
+                        data_set_slots[data_set] = len(data_set_slots)
+                    destination = bucket[data_set_slots[data_set]]
+
+                    if isinstance(read_descriptor, tuple):
+                        h5_file_handle[data_set].read_direct(destination,
+                                                             source_sel=np.s_[read_descriptor[0]:read_descriptor[1]],
+                                                             dest_sel=np.s_[start:start + n_examples])
+                    else:
+                        self.read_indices(h5_file_handle[data_set], read_descriptor,
+                                          destination[start:start + n_examples])
+                    continue
+
                 # if len(payloads) < data_set_index + 1:
                 #     payloads.append(range(n_read_requests))
                 # payload = payloads[data_set_index]
@@ -244,8 +335,6 @@ class H5Reader(BaseReader):
                     payloads[data_set] = range(n_read_requests)
 
                 if isinstance(read_descriptor, tuple):
-                    # TODO use read_direct function instead
-                    # http://docs.h5py.org/en/latest/high/dataset.html
                     payloads[data_set][read_index] = np.array(
                             h5_file_handle[data_set][read_descriptor[0]:read_descriptor[1]])
 
@@ -253,35 +342,18 @@ class H5Reader(BaseReader):
                     # 0]:read_descriptor[1]]
 
                 elif isinstance(read_descriptor, list) or isinstance(read_descriptor, np.ndarray):
-                    # TODO there is potentially a faster way
-                    # https://stackoverflow.com/questions/21766145/h5py-correct-way-to-slice-array-datasets
-                    # payloads[data_set][read_index] = np.take(h5_file_handle[data_set], read_descriptor, axis=0)
-                    payloads[data_set][read_index] = h5_file_handle[data_set][read_descriptor]
+                    payloads[data_set][read_index] = self.read_indices(h5_file_handle[data_set],
+                                                                       read_descriptor)
 
-            self.debug("h5_to_payloads_time={0} read_index={1} batch_id={2}".format(time.time() - h5_to_payloads_time,
-                                                                                    read_index,
-                                                                                    batch_id))
+            self.metrics.observe('h5_read', time.time() - h5_to_payloads_time, batch_id)
 
-            if tmp_index_payload is None:
-                tmp_index_payload = np.zeros(self.read_size)
-
-            if isinstance(read_descriptor, tuple):
-                n_examples = read_descriptor[1] - read_descriptor[0]
-                for index in range(read_descriptor[0], read_descriptor[1]):
-                    tmp_file_struct.append((file_path_index, index))
-
-            elif isinstance(read_descriptor, list) or isinstance(read_descriptor, np.ndarray):
-                n_examples = len(read_descriptor)
-                for index in read_descriptor:
-                    tmp_file_struct.append((file_path_index, index))
-
-            tmp_class_index = np.full(n_examples, self.class_index_map[class_name])
             try:
-                tmp_index_payload[start:start + n_examples] = tmp_class_index
+                self.write_labels(labels, start, n_examples, self.class_index_map[class_name],
+                                  file_path_index, read_descriptor)
             except ValueError as e:
-                lg.critical("n_examples={} start={} len(tmp_class_index)={}".format(n_examples,
-                                                                                    start,
-                                                                                    len(tmp_class_index)))
+                lg.critical("n_examples={} start={} read_size={}".format(n_examples,
+                                                                         start,
+                                                                         self.read_size))
                 raise_from(ValueError(), e)
 
             # tmp_file_index = np.full(n_examples, self.class_index_map[class_name])
@@ -292,9 +364,6 @@ class H5Reader(BaseReader):
             if not self.cache_handles:
                 h5_file_handle.close()
 
-        self.debug("payloads_build_time={0} batch_id={1}".format(time.time() - payloads_build_time,
-                                                                 batch_id))
-
         concat_time = time.time()
         for data_set in payloads:
             try:
@@ -304,38 +373,28 @@ class H5Reader(BaseReader):
                 print(payloads[data_set])
                 raise ValueError(e)
 
-        self.debug(
-                "concat_time={0} batch_id={1}".format(time.time() - concat_time,
-                                                      batch_id))
+        self.metrics.observe('concat', time.time() - concat_time, batch_id)
 
-        if self.make_class_index:
-            payloads['class_index'] = tmp_index_payload
+        if direct:
+            # the data sets and the labels are already in the bucket
+            store_in_shared_time = time.time()
+            if self.shuffle:
+                self.shuffle_in_unison_in_place(bucket[:len(data_set_slots)] + labels.values(),
+                                                self.random_state)
 
-        if self.make_one_hot:
-            tmp_one_hot = keras.utils.np_utils.to_categorical(tmp_index_payload,
-                                                              len(self.class_index_map))
-            payloads['one_hot'] = tmp_one_hot
+            self.metrics.observe('shared_store', time.time() - store_in_shared_time, batch_id)
+            return self.worker_id - READER_OFFSET, bucket_index, data_sets, batch_id
 
-        if self.make_file_index:
-            payloads['file_struct'] = np.array(tmp_file_struct)
+        payloads.update(labels)
 
         process_time = time.time()
         if self.process_function is not None:
             # print('using process function')
             payloads = self.process_function(payloads)
-            self.debug("process_function_time={0} batch_id={1}".format(time.time() - process_time,
-                                                                       batch_id))
+            self.metrics.observe('process_function', time.time() - process_time, batch_id)
         else:
             payloads = payloads.values()
 
-        # if self.make_class_index:
-        #     payloads.append(tmp_index_payload)
-
-        # if self.make_one_hot:
-        #     tmp_one_hot = keras.utils.np_utils.to_categorical(tmp_index_payload,
-        #                                                       len(self.class_index_map))
-        #     payloads.append(tmp_one_hot)
-
         if self.shuffle:
             payloads = self.shuffle_in_unison_inplace(payloads)
 
@@ -343,7 +402,7 @@ class H5Reader(BaseReader):
             store_in_shared_time = time.time()
             for data_set_index, payload in enumerate(payloads):
                 try:
-                    self.shared_memory_pointer[bucket_index][1][data_set_index][...] = np.copy(payload)
+                    self.shared_memory_pointer[bucket_index][1][data_set_index][...] = payload
                 except TypeError as e:
                     self.critical(e.message)
                     self.critical(
@@ -355,14 +414,93 @@ class H5Reader(BaseReader):
 
                     # sys.exit(1)
 
-            self.debug("store_in_shared_time={0} batch_id={1}".format(time.time() - store_in_shared_time,
-                                                                      batch_id))
+            self.metrics.observe('shared_store', time.time() - store_in_shared_time, batch_id)
             return self.worker_id - READER_OFFSET, bucket_index, data_sets, batch_id
         else:
             return payloads
 
+    def make_labels(self, bucket=None):
+        """
+        :param bucket: the data sets of a bucket, the labels are its last slots. Without one
+        new arrays are made.
+        :return: OrderedDict of the enabled label tensors, in the order they sit in a bucket
+        """
+        label_shapes = list()
+        if self.make_class_index:
+            label_shapes.append(('class_index', (self.read_size,), np.int64))
+        if self.make_one_hot:
+            label_shapes.append(('one_hot', (self.read_size, len(self.class_index_map)), np.float32))
+        if self.make_file_index:
+            label_shapes.append(('file_struct', (self.read_size, 2), np.int64))
+
+        labels = collections.OrderedDict()
+        for label_index, (label, shape, dtype) in enumerate(label_shapes):
+            if bucket is None:
+                labels[label] = np.empty(shape, dtype=dtype)
+            else:
+                labels[label] = bucket[len(bucket) - len(label_shapes) + label_index]
+
+        if self.make_one_hot:
+            labels['one_hot'][...] = 0
+        return labels
+
+    @staticmethod
+    def write_labels(labels, start, n_examples, class_index, file_path_index, read_descriptor):
+        """
+        Fills the rows start to start + n_examples of every label tensor for one read_request.
+        """
+        stop = start + n_examples
+        if 'class_index' in labels:
+            labels['class_index'][start:stop] = class_index
+
+        if 'one_hot' in labels:
+            labels['one_hot'][start:stop, class_index] = 1
+
+        if 'file_struct' in labels:
+            labels['file_struct'][start:stop, 0] = file_path_index
+            if isinstance(read_descriptor, tuple):
+                labels['file_struct'][start:stop, 1] = np.arange(read_descriptor[0], read_descriptor[1])
+            else:
+                labels['file_struct'][start:stop, 1] = read_descriptor
+
+    def read_indices(self, h5_data_set, read_descriptor, destination=None):
+        """
+        h5py point selections are slow for long index lists, so the sorted indices are
+        read as a few contiguous slabs and the wanted rows are gathered in memory.
+        :param h5_data_set:
+        :param read_descriptor: sorted row indices
+        :param destination: optional array to gather the rows into
+        :return: the gathered rows
+        """
+        if self.coalesce_gap is None or len(read_descriptor) == 0:
+            if destination is None:
+                return h5_data_set[read_descriptor]
+            destination[...] = h5_data_set[read_descriptor]
+            return destination
+
+        indices = np.asarray(read_descriptor)
+        slab_starts, slab_ends = coalesce_read_descriptor(indices, self.coalesce_gap)
+        slab_offsets = np.concatenate(([0], np.cumsum(slab_ends - slab_starts)))
+
+        scratch = np.empty((slab_offsets[-1],) + h5_data_set.shape[1:], dtype=h5_data_set.dtype)
+        for slab_start, slab_end, slab_offset in zip(slab_starts, slab_ends, slab_offsets):
+            h5_data_set.read_direct(scratch,
+                                    source_sel=np.s_[slab_start:slab_end],
+                                    dest_sel=np.s_[slab_offset:slab_offset + slab_end - slab_start])
+
+        slab_index = np.searchsorted(slab_starts, indices, side='right') - 1
+        gather_index = indices - slab_starts[slab_index] + slab_offsets[slab_index]
+
+        if destination is None:
+            return scratch.take(gather_index, axis=0)
+        elif destination.dtype == scratch.dtype:
+            scratch.take(gather_index, axis=0, out=destination)
+        else:
+            destination[...] = scratch.take(gather_index, axis=0)
+        return destination
+
     def shuffle_in_unison_inplace(self, payloads):
-        shuffle_list = np.random.permutation(self.read_size)
+        shuffle_list = self.random_state.permutation(self.read_size)
 
         out = []
         for payload in payloads:
@@ -370,3 +508,16 @@ class H5Reader(BaseReader):
             out.append(payload[shuffle_list])
 
         return out
+
+    @staticmethod
+    def shuffle_in_unison_in_place(arrays, random_state=np.random):
+        """
+        Applies the same row permutation to every array without allocating a copy of it.
+        :param arrays:
+        :param random_state: a RandomState that no other thread draws from
+        :return:
+        """
+        rng_state = random_state.get_state()
+        for array in arrays:
+            random_state.set_state(rng_state)
+            random_state.shuffle(array)
@@ -0,0 +1,279 @@
+import Queue
+import cPickle
+import multiprocessing
+import struct
+import time
+
+import billiard
+import numpy as np
+
+from .metrics import shared_array
+
+# tags of the encoded values, every value starts with one
+NONE, FALSE, TRUE, INT, FLOAT, STRING, TEXT, TUPLE, LIST, INTS, ARRAY, PICKLED = range(12)
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+# bytes per word
+WORD = 8
+
+# the length word of a slot whose message did not fit, it went through the overflow queue
+OVERFLOW = -1
+
+
+def pack_bytes(data):
+    """
+    :return: the bytes as an int64 array, zero padded to a whole number of words
+    """
+    return np.frombuffer(data + '\0' * (-len(data) % WORD), dtype=np.int64)
+
+
+def unpack_bytes(words, n_bytes):
+    return np.array(words, dtype=np.int64).tostring()[:n_bytes]
+
+
+class DescriptorCodec(object):
+    """
+    Turns the messages passed between the stages, read plans of (file_index, data_sets,
+    class_name, read_descriptor, batch_id) tuples and (reader_id, bucket_index, data_sets,
+    batch_id) data pointers, into int64 words and back. Strings in the table, e.g. the data
+    set and class names, take one word, index lists are copied as one block. Anything else
+    round-trips too, pickled, so every message comes out as it went in.
+    """
+
+    def __init__(self, strings=()):
+        self.strings = list()
+        self.string_ids = dict()
+        for string in strings:
+            if isinstance(string, str) and string not in self.string_ids:
+                self.string_ids[string] = len(self.strings)
+                self.strings.append(string)
+
+    def encode(self, message):
+        """
+        :return: the words of the message, a list of ints and int64 arrays
+        """
+        words = list()
+        self.encode_value(message, words)
+        return words
+
+    def encode_value(self, value, words):
+        value_type = type(value)
+
+        if value is None:
+            words.append(NONE)
+        elif value_type is bool:
+            words.append(TRUE if value else FALSE)
+        elif value_type in (int, long) and INT64_MIN <= value <= INT64_MAX:
+            words.extend((INT, value))
+        elif value_type is float:
+            words.extend((FLOAT, struct.unpack('<q', struct.pack('<d', value))[0]))
+        elif value_type is str:
+            if value in self.string_ids:
+                words.extend((STRING, self.string_ids[value]))
+            else:
+                words.extend((TEXT, len(value)))
+                words.append(pack_bytes(value))
+        elif value_type is tuple:
+            words.extend((TUPLE, len(value)))
+            for item in value:
+                self.encode_value(item, words)
+        elif value_type is list:
+            # index lists are the bulk of a read plan
+            if value and type(value[0]) is not str:
+                array = np.asarray(value)
+                if array.ndim == 1 and array.dtype.kind in 'iu' and array.dtype.itemsize <= WORD:
+                    words.extend((INTS, len(value)))
+                    words.append(array.astype(np.int64))
+                    return
+            words.extend((LIST, len(value)))
+            for item in value:
+                self.encode_value(item, words)
+        elif value_type is np.ndarray and value.ndim == 1 and value.dtype.kind in 'iub' \
+                and value.dtype.itemsize <= WORD:
+            words.extend((ARRAY, ord(value.dtype.char), len(value)))
+            words.append(value.astype(np.int64))
+        else:
+            data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+            words.extend((PICKLED, len(data)))
+            words.append(pack_bytes(data))
+
+    def decode(self, words):
+        """
+        :param words: a list of ints as written by encode
+        """
+        value, _ = self.decode_value(words, 0)
+        return value
+
+    def decode_value(self, words, position):
+        tag = words[position]
+        position += 1
+
+        if tag == NONE:
+            return None, position
+        elif tag == FALSE:
+            return False, position
+        elif tag == TRUE:
+            return True, position
+        elif tag == INT:
+            return words[position], position + 1
+        elif tag == FLOAT:
+            return struct.unpack('<d', struct.pack('<q', words[position]))[0], position + 1
+        elif tag == STRING:
+            return self.strings[words[position]], position + 1
+        elif tag in (TEXT, PICKLED):
+            n_bytes = words[position]
+            end = position + 1 + -(-n_bytes // WORD)
+            data = unpack_bytes(words[position + 1:end], n_bytes)
+            if tag == PICKLED:
+                data = cPickle.loads(data)
+            return data, end
+        elif tag in (TUPLE, LIST):
+            items = list()
+            position += 1
+            for _ in range(words[position - 1]):
+                item, position = self.decode_value(words, position)
+                items.append(item)
+            if tag == TUPLE:
+                return tuple(items), position
+            return items, position
+        elif tag == INTS:
+            end = position + 1 + words[position]
+            return words[position + 1:end], end
+        elif tag == ARRAY:
+            dtype = np.dtype(chr(words[position]))
+            end = position + 2 + words[position + 1]
+            return np.array(words[position + 2:end], dtype=dtype), end
+
+        raise ValueError("unknown tag {0} at word {1}".format(tag, position - 1))
+
+
+class DescriptorRing(object):
+    """
+    A fixed capacity FIFO of encoded messages in shared memory that stands in for a
+    billiard.Queue between two stages. A put copies the message's words into a slot and a
+    get copies them out, there is no pickling through a pipe and no feeder thread. It
+    blocks on semaphores like the BucketFreeList and raises Queue.Full and Queue.Empty like
+    a queue. A message larger than a slot is pickled through an overflow queue instead, its
+    slot only keeps its place in line.
+    """
+
+    def __init__(self, maxsize, slot_words, codec=None):
+        if maxsize < 1:
+            raise ValueError("a descriptor ring needs a maxsize of at least 1, got {0}".format(maxsize))
+
+        self.maxsize = maxsize
+        self.slot_words = slot_words
+        self.codec = codec or DescriptorCodec()
+
+        # the first word of a slot is the number of words of its message
+        self.slots = shared_array((maxsize, slot_words + 1), 'int64')
+        self.head = multiprocessing.RawValue('l', 0)
+        self.tail = multiprocessing.RawValue('l', 0)
+        # overflow slots taken by a get that gave up waiting for the message, the next get
+        # waits for it instead, they keep their item and their space until then
+        self.owed = multiprocessing.RawValue('l', 0)
+
+        # like a billiard.Queue, closing only stops the process that closed it from putting
+        self.closed = False
+
+        self.lock = multiprocessing.Lock()
+        self.items = multiprocessing.Semaphore(0)
+        self.spaces = multiprocessing.Semaphore(maxsize)
+
+        # never holds more than the ring has slots, put takes a slot first
+        self.overflow = billiard.Queue()
+
+    def put(self, message, block=True, timeout=None):
+        if self.closed:
+            raise ValueError("descriptor ring is closed")
+
+        words = self.codec.encode(message)
+        n_words = sum(len(word) if isinstance(word, np.ndarray) else 1 for word in words)
+
+        if not self.spaces.acquire(block, timeout):
+            raise Queue.Full
+
+        if n_words > self.slot_words:
+            # in the overflow queue before its slot is, so whoever gets the slot finds it there
+            self.overflow.put(message)
+            with self.lock:
+                self.slots[self.tail.value % self.maxsize][0] = OVERFLOW
+                self.tail.value += 1
+            self.items.release()
+            return
+
+        with self.lock:
+            slot = self.slots[self.tail.value % self.maxsize]
+            slot[0] = n_words
+
+            position = 1
+            run = list()
+            for word in words:
+                if isinstance(word, np.ndarray):
+                    slot[position:position + len(run)] = run
+                    position += len(run)
+                    run = list()
+                    slot[position:position + len(word)] = word
+                    position += len(word)
+                else:
+                    run.append(word)
+            slot[position:position + len(run)] = run
+
+            self.tail.value += 1
+        self.items.release()
+
+    def get(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        if not self.items.acquire(block, timeout):
+            raise Queue.Empty
+
+        with self.lock:
+            if self.owed.value:
+                self.owed.value -= 1
+                n_words = OVERFLOW
+            else:
+                slot = self.slots[self.head.value % self.maxsize]
+                n_words = slot[0]
+                words = slot[1:n_words + 1].tolist() if n_words != OVERFLOW else None
+                self.head.value += 1
+
+        if n_words != OVERFLOW:
+            self.spaces.release()
+            return self.codec.decode(words)
+
+        # any overflowed message will do, they are all on their way, but the producer's
+        # feeder thread may not have pushed this one through the pipe yet
+        try:
+            if block and deadline is not None:
+                message = self.overflow.get(True, max(deadline - time.time(), 0))
+            else:
+                message = self.overflow.get(block)
+        except Queue.Empty:
+            # the message is still owed, hand it on to the next get instead of losing it
+            with self.lock:
+                self.owed.value += 1
+            self.items.release()
+            raise
+        self.spaces.release()
+        return message
+
+    def put_nowait(self, message):
+        return self.put(message, block=False)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return self.tail.value - self.head.value + self.owed.value
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.maxsize
+
+    def close(self):
+        self.closed = True
+        self.overflow.close()
@@ -0,0 +1,99 @@
+import Queue
+import time
+
+from .config import PROCESS_BACKEND
+from .workers import make_queue
+
+
+class FileAffinityScheduler(object):
+    """
+    Stands in for the in_queue and routes each read batch to a reader group by the
+    file it mostly reads from, so that a file's handles and chunk cache stay with
+    the same few readers. Readers pull from their group through `group()`, which
+    steals from the other groups when their own is empty.
+    """
+
+    def __init__(self, n_groups, maxsize=0, steal_timeout=0.01, backend=PROCESS_BACKEND):
+        self.n_groups = n_groups
+        self.steal_timeout = steal_timeout
+        self.queues = [make_queue(maxsize, backend) for _ in range(n_groups)]
+
+    def route(self, batch):
+        """
+        :param batch: a list of read_requests
+        :return: the group of the file with the largest read_request
+        """
+        largest_n_examples = -1
+        file_path_index = 0
+        for read_request in batch:
+            read_descriptor = read_request[3]
+            if isinstance(read_descriptor, tuple):
+                n_examples = read_descriptor[1] - read_descriptor[0]
+            else:
+                n_examples = len(read_descriptor)
+
+            if n_examples > largest_n_examples:
+                largest_n_examples = n_examples
+                file_path_index = read_request[0]
+
+        return file_path_index % self.n_groups
+
+    def put(self, batch, block=True, timeout=None):
+        self.queues[self.route(batch)].put(batch, block, timeout)
+
+    def get(self, block=True, timeout=None):
+        return self.group(0).get(block, timeout)
+
+    def group(self, group_index):
+        return AffinityQueue(self, group_index)
+
+    def qsize(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    def close(self):
+        for queue in self.queues:
+            # thread backend queues have nothing to close
+            if hasattr(queue, 'close'):
+                queue.close()
+
+
+class AffinityQueue(object):
+    """
+    A reader group's view of a FileAffinityScheduler.
+    """
+
+    def __init__(self, scheduler, group_index):
+        self.scheduler = scheduler
+        self.group_index = group_index
+
+        queues = scheduler.queues
+        self.own_queue = queues[group_index]
+        self.other_queues = queues[group_index + 1:] + queues[:group_index]
+
+    def get(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            wait = self.scheduler.steal_timeout
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.time(), 0))
+
+            try:
+                return self.own_queue.get(block, wait)
+            except Queue.Empty:
+                pass
+
+            for queue in self.other_queues:
+                try:
+                    return queue.get(block=False)
+                except Queue.Empty:
+                    pass
+
+            if not block or (deadline is not None and time.time() >= deadline):
+                raise Queue.Empty
+
+    def put(self, batch, block=True, timeout=None):
+        self.scheduler.put(batch, block, timeout)
+
+    def qsize(self):
+        return self.own_queue.qsize()
@@ -12,15 +12,15 @@ mock_sample_specification = [
 
 expected_class_count = 3
 
-mock_expected_malloc_requests = [('tensor_1', (5,)),
-                                 ('tensor_2', (5,))]
+mock_expected_malloc_requests = [('tensor_1', (5,), 'float64'),
+                                 ('tensor_2', (5,), 'float64')]
 
-mock_one_hot = [('class_index', tuple()),
-                ('one_hot', (3,))]
+mock_one_hot = [('class_index', tuple(), 'int64'),
+                ('one_hot', (3,), 'float32')]
 
-mock_file_index_malloc = [('class_index', tuple()),
-                          ('one_hot', (3,)),
-                          ('file_struct', (2,))]
+mock_file_index_malloc = [('class_index', tuple(), 'int64'),
+                          ('one_hot', (3,), 'float32'),
+                          ('file_struct', (2,), 'int64')]
 
 mock_class_index_map = {
     'class_1': 0,
@@ -0,0 +1,78 @@
+import copy
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from adlkit.data_provider.bin.autotune import autotune, estimate_memory, load_tuned_config, malloc_requests, \
+    save_tuned_config, trial
+from adlkit.data_provider.data_providers import H5FileDataProvider
+
+
+class TestAutotune(TestCase):
+    def test_malloc_requests(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        self.assertEqual(malloc_requests(mock_sample_specification),
+                         [('tensor_1', (5,), 'float64'), ('tensor_2', (5,), 'float64')])
+
+    def test_estimate_memory(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        # 30 rows of 40 bytes make 1200 bytes, padded to 1216, the one_hot 360 bytes to 384
+        config = {'n_readers': 4, 'n_buckets': 2, 'read_multiplier': 3, 'make_one_hot': True}
+        memory_bytes = estimate_memory(mock_sample_specification, config, 10, malloc_requests(mock_sample_specification))
+        self.assertEqual(memory_bytes, 4 * 2 * (1216 + 1216 + 384))
+
+        data_provider = H5FileDataProvider(mock_sample_specification, batch_size=10, sleep_duration=0.05, **config)
+        data_provider.start()
+        try:
+            self.assertEqual(data_provider.memory_report()['allocated'], memory_bytes)
+        finally:
+            data_provider.hard_stop()
+
+    def test_trial(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        samples_per_second = trial(mock_sample_specification, {'n_readers': 2, 'n_buckets': 20, 'sleep_duration': 0.05},
+                                   batch_size=50, trial_batches=5, warmup_batches=1)
+        self.assertGreater(samples_per_second, 0)
+
+    def test_autotune_within_budget(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        batch_size = 50
+        search_space = {'n_readers': [1, 2, 4], 'n_buckets': [2]}
+        # enough for two readers with two buckets
+        memory_budget = estimate_memory(mock_sample_specification, {'n_readers': 2, 'n_buckets': 2},
+                                        batch_size, malloc_requests(mock_sample_specification))
+
+        tuned_config, tuned_rate, trials = autotune(mock_sample_specification, memory_budget,
+                                                    batch_size=batch_size,
+                                                    trial_batches=5,
+                                                    warmup_batches=1,
+                                                    search_space=search_space,
+                                                    start_config={'n_readers': 1, 'n_buckets': 2},
+                                                    n_rounds=1,
+                                                    sleep_duration=0.05)
+
+        self.assertIn(tuned_config['n_readers'], (1, 2))
+        self.assertGreater(tuned_rate, 0)
+        for config, samples_per_second, memory_bytes in trials:
+            self.assertLessEqual(memory_bytes, memory_budget)
+            self.assertNotEqual(config['n_readers'], 4)
+
+    def test_save_and_load(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'tuned.json')
+            config = {'n_readers': 2, 'read_multiplier': 4, 'n_buckets': 10, 'q_multipler': 2}
+            save_tuned_config(path, config, 1000.0, batch_size=64, memory_budget=1024)
+
+            self.assertEqual(load_tuned_config(path), config)
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -60,3 +60,38 @@ class TestBaseWatcher(TestCase):
 
             # tmp_watcher = BaseWatcher(worker_id=1000, shared_memory_pointer=shared_memory_pointer, )
             # TODO complete or throw away, test is already in file_data_provider
+
+    def test_stop_while_generator_not_drawing(self):
+        from adlkit.data_provider.buckets import BucketFreeList
+        from adlkit.data_provider.config import THREAD_BACKEND
+        from adlkit.data_provider.watchers import BaseWatcher
+
+        state = multiprocessing.Value('i', 1)
+        bucket = [state, [np.zeros(4)], multiprocessing.Value('i', 0), multiprocessing.Value('i', 0)]
+        free_buckets = BucketFreeList(1)
+        free_buckets.get(timeout=0)
+
+        out_queue = Queue.Queue()
+        out_queue.put((0, 0, ['tensor_1'], 0))
+
+        # the first generator is fine, the second never draws and its queue is full
+        multicast_queues = [Queue.Queue(maxsize=1), Queue.Queue(maxsize=1)]
+        multicast_queues[1].put('stuck')
+
+        watcher = BaseWatcher(worker_id=0,
+                              shared_memory_pointer=[[bucket]],
+                              multicast_queues=multicast_queues,
+                              out_queue=out_queue,
+                              free_buckets=[free_buckets],
+                              block_timeout=0.05,
+                              backend=THREAD_BACKEND)
+        watcher.start()
+
+        self.assertEqual(multicast_queues[0].get(timeout=1), (0, 0, ['tensor_1'], 0))
+        watcher.request_stop()
+        watcher.join(1)
+        self.assertFalse(watcher.is_alive())
+
+        # the stuck generator's reference was dropped, the first one still holds its own
+        self.assertEqual(bucket[2].value, 1)
+        self.assertEqual(free_buckets.qsize(), 0)
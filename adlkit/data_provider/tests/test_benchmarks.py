@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import h5py
+
+from adlkit.data_provider.bin.benchmarks import compare_results, load_results, make_sample_specification, \
+    queue_hops, result_rows, startup, write_results
+
+
+class TestBenchmarks(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_make_sample_specification(self):
+        sample_specification = make_sample_specification(self.tmp_dir, 2, 10, row_shape=(3, 4), dtype='uint8',
+                                                         compression='gzip')
+
+        self.assertEqual(len(sample_specification), 2)
+        with h5py.File(sample_specification[1][0], 'r') as h5_file_handle:
+            self.assertEqual(h5_file_handle['tensor_1'].shape, (10, 3, 4))
+            self.assertEqual(h5_file_handle['tensor_1'].dtype.name, 'uint8')
+            self.assertEqual(h5_file_handle['tensor_1'].compression, 'gzip')
+            self.assertGreater(h5_file_handle['tensor_2'][...].max(), 0)
+
+    def test_write_and_load(self):
+        rows = result_rows('reader_bandwidth', {'batch_size': 64, 'coalesce_gap': None},
+                           [('bandwidth', 100.0, 'MB/s')])
+        rows += result_rows('batch_latency', {'batch_size': 64}, [('p99_latency', 0.5, 's')])
+
+        for name in ('results.json', 'results.csv'):
+            path = os.path.join(self.tmp_dir, name)
+            write_results(path, rows)
+            loaded = load_results(path)
+
+            self.assertEqual([row['value'] for row in loaded], [100.0, 0.5])
+            # csv and json runs can be compared with each other
+            self.assertEqual(compare_results(rows, loaded), [])
+
+    def test_compare_results(self):
+        baseline = result_rows('reader_bandwidth', {'batch_size': 64}, [('bandwidth', 100.0, 'MB/s')])
+        baseline += result_rows('batch_latency', {'batch_size': 64}, [('p99_latency', 1.0, 's')])
+
+        faster = result_rows('reader_bandwidth', {'batch_size': 64}, [('bandwidth', 150.0, 'MB/s')])
+        faster += result_rows('batch_latency', {'batch_size': 64}, [('p99_latency', 0.5, 's')])
+        self.assertEqual(compare_results(baseline, faster), [])
+
+        slower = result_rows('reader_bandwidth', {'batch_size': 64}, [('bandwidth', 80.0, 'MB/s')])
+        slower += result_rows('batch_latency', {'batch_size': 64}, [('p99_latency', 1.05, 's')])
+        regressions = compare_results(baseline, slower, threshold=0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(regressions[0][1:3], (100.0, 80.0))
+
+        # a different batch_size is a different benchmark
+        other = result_rows('reader_bandwidth', {'batch_size': 128}, [('bandwidth', 1.0, 'MB/s')])
+        self.assertEqual(compare_results(baseline, other), [])
+
+    def test_startup(self):
+        rows = startup(n_readers=1, n_repeats=1)
+
+        self.assertEqual([row['metric'] for row in rows], ['import_time', 'start_delta', 'first_batch_delta'])
+        self.assertGreaterEqual(rows[2]['value'], rows[1]['value'])
+
+    def test_queue_hops(self):
+        rows = queue_hops(batch_size=64, n_messages=50)
+
+        self.assertEqual(len(rows), 6)
+        self.assertTrue(all(row['unit'] == 'messages/s' and row['value'] > 0 for row in rows))
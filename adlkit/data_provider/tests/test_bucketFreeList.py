@@ -0,0 +1,67 @@
+import multiprocessing
+from unittest import TestCase
+
+from adlkit.data_provider.buckets import BucketFreeList
+
+
+def release_later(free_list, bucket_index):
+    free_list.put(bucket_index)
+
+
+class TestBucketFreeList(TestCase):
+    def test_starts_full(self):
+        n_buckets = 4
+        free_list = BucketFreeList(n_buckets)
+
+        self.assertEqual(free_list.qsize(), n_buckets)
+        self.assertEqual([free_list.get(timeout=0) for _ in range(n_buckets)], range(n_buckets))
+        self.assertIsNone(free_list.get(timeout=0.01))
+
+    def test_release_order(self):
+        free_list = BucketFreeList(3)
+        for _ in range(3):
+            free_list.get()
+
+        free_list.put(2)
+        free_list.put(0)
+
+        self.assertEqual(free_list.get(timeout=0), 2)
+        self.assertEqual(free_list.get(timeout=0), 0)
+        self.assertIsNone(free_list.get(timeout=0))
+
+    def test_release_from_other_process(self):
+        free_list = BucketFreeList(1)
+        free_list.get()
+
+        process = multiprocessing.Process(target=release_later, args=(free_list, 0))
+        process.start()
+
+        self.assertEqual(free_list.get(timeout=5), 0)
+        process.join()
+
+    def test_reset(self):
+        free_list = BucketFreeList(3)
+        free_list.get()
+        free_list.get()
+
+        free_list.reset()
+
+        self.assertEqual(free_list.qsize(), 3)
+        self.assertEqual([free_list.get(timeout=0) for _ in range(3)], [0, 1, 2])
+        self.assertIsNone(free_list.get(timeout=0))
+
+    def test_signal(self):
+        signal = multiprocessing.Semaphore(0)
+        free_list = BucketFreeList(2, signal=signal)
+
+        # the initial buckets are no news
+        self.assertFalse(signal.acquire(False))
+
+        free_list.get()
+        free_list.put(0)
+        self.assertTrue(signal.acquire(False))
+        self.assertFalse(signal.acquire(False))
+
+        free_list.get()
+        free_list.put(0, notify=False)
+        self.assertFalse(signal.acquire(False))
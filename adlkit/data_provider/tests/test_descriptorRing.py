@@ -0,0 +1,123 @@
+import Queue
+import copy
+import multiprocessing
+import time
+from unittest import TestCase
+
+import numpy as np
+
+from adlkit.data_provider.rings import DescriptorCodec, DescriptorRing, OVERFLOW
+
+
+def put_all(ring, messages):
+    for message in messages:
+        ring.put(message)
+
+
+def put_overflow_later(ring, message, delay):
+    time.sleep(delay)
+    ring.overflow.put(message)
+
+
+def put_overflow_slot(ring):
+    # what put does for a message larger than a slot, without the message itself
+    ring.spaces.acquire()
+    with ring.lock:
+        ring.slots[ring.tail.value % ring.maxsize][0] = OVERFLOW
+        ring.tail.value += 1
+    ring.items.release()
+
+
+class TestDescriptorRing(TestCase):
+    def setUp(self):
+        from adlkit.data_provider.tests.mock_config import mock_batches, mock_filtered_batches, \
+            mock_read_batches, mock_data_sets
+
+        self.messages = copy.deepcopy(mock_batches[:3] + mock_filtered_batches[:3] + mock_read_batches)
+        self.codec = DescriptorCodec(mock_data_sets + ['class_1', 'class_2', 'class_10'])
+
+    def test_round_trip(self):
+        odd = (None, True, False, -3, 2 ** 70, 1.5, 'not_in_table', u'unicode', {'a': 1},
+               [], [1, 'a'], np.arange(4, dtype='int32'), (0, 0, ['tensor_1'], 7))
+        for message in self.messages + [odd]:
+            decoded = self.codec.decode(np.concatenate(
+                    [np.atleast_1d(word) for word in self.codec.encode(message)]).tolist())
+            self.assertEqual(repr(decoded), repr(message))
+
+    def test_table_strings(self):
+        words = self.codec.encode((0, 0, ['tensor_1', 'tensor_2'], 3))
+        # tuple, 2 ints, list of 2 table strings and an int
+        self.assertEqual(len(words), 2 + 2 * 2 + 2 + 2 * 2 + 2)
+
+    def test_full_and_empty(self):
+        ring = DescriptorRing(2, 64, self.codec)
+        ring.put((0, 1, ['tensor_1'], 0))
+        ring.put((0, 2, ['tensor_1'], 1))
+
+        self.assertEqual(ring.qsize(), 2)
+        self.assertTrue(ring.full())
+        self.assertRaises(Queue.Full, ring.put, (0, 3, ['tensor_1'], 2), True, 0.01)
+
+        self.assertEqual(ring.get(), (0, 1, ['tensor_1'], 0))
+        self.assertEqual(ring.get(timeout=0.01), (0, 2, ['tensor_1'], 1))
+        self.assertTrue(ring.empty())
+        self.assertRaises(Queue.Empty, ring.get, True, 0.01)
+        self.assertRaises(Queue.Empty, ring.get_nowait)
+
+    def test_message_too_large(self):
+        ring = DescriptorRing(2, 16, self.codec)
+        ring.put(range(100))
+        ring.put((0, 1, ['tensor_1'], 0))
+
+        self.assertEqual(ring.qsize(), 2)
+        self.assertEqual(ring.get(), range(100))
+        self.assertEqual(ring.get_nowait(), (0, 1, ['tensor_1'], 0))
+
+    def test_closed(self):
+        ring = DescriptorRing(1, 16, self.codec)
+        ring.close()
+        self.assertRaises(ValueError, ring.put, None)
+
+    def test_across_processes(self):
+        ring = DescriptorRing(2, 4096, self.codec)
+
+        producer = multiprocessing.Process(target=put_all, args=(ring, self.messages))
+        producer.start()
+
+        received = [ring.get(timeout=5) for _ in self.messages]
+        producer.join()
+
+        self.assertEqual(received, self.messages)
+
+    def test_overflow_across_processes(self):
+        # every read plan is larger than a slot
+        ring = DescriptorRing(2, 8, self.codec)
+
+        producer = multiprocessing.Process(target=put_all, args=(ring, self.messages))
+        producer.start()
+
+        received = [ring.get(timeout=5) for _ in self.messages]
+        producer.join()
+
+        self.assertEqual(sorted(received), sorted(self.messages))
+
+    def test_overflow_after_slot(self):
+        ring = DescriptorRing(1, 8, self.codec)
+        put_overflow_slot(ring)
+
+        # the slot is there but the message is not, neither get loses the slot
+        self.assertRaises(Queue.Empty, ring.get, True, 0.05)
+        start_time = time.time()
+        self.assertRaises(Queue.Empty, ring.get_nowait)
+        self.assertLess(time.time() - start_time, 0.5)
+        self.assertEqual(ring.qsize(), 1)
+        self.assertRaises(Queue.Full, ring.put, None, True, 0.01)
+
+        producer = multiprocessing.Process(target=put_overflow_later, args=(ring, range(100), 0.2))
+        producer.start()
+        self.assertEqual(ring.get(timeout=5), range(100))
+        producer.join()
+
+        self.assertEqual(ring.qsize(), 0)
+        ring.put((0, 1, ['tensor_1'], 0))
+        self.assertEqual(ring.get(timeout=1), (0, 1, ['tensor_1'], 0))
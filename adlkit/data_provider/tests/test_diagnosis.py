@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from adlkit.data_provider.diagnosis import (BALANCED, CONSUMER_BOUND, FILLER_BOUND, KNOBS, MEMORY_BOUND,
+                                            READER_BOUND, classify, diagnose, stage_totals)
+
+
+def worker_stats(**stage_totals):
+    return {'counters': dict(), 'stages': dict((stage, {'total': total}) for stage, total in stage_totals.items())}
+
+
+class TestDiagnosis(TestCase):
+    def test_classify(self):
+        self.assertEqual(classify(1.0, 0.9, 0.5), (CONSUMER_BOUND, 'yield_wait'))
+        self.assertEqual(classify(1.0, 0.0, 0.2), (READER_BOUND, 'h5_read'))
+        self.assertEqual(classify(1.0, 0.0, 1.0), (MEMORY_BOUND, 'bucket_seek'))
+        self.assertEqual(classify(0.0, 0.0, 0.1), (FILLER_BOUND, 'build_batch'))
+        self.assertEqual(classify(0.3, 0.3, 0.5), (BALANCED, None))
+
+    def test_classify_with_stage_totals(self):
+        totals = {'reader': {'h5_read': 1.0, 'process_function': 3.0, 'out_queue_put_wait': 9.0},
+                  'filler': {'build_batch': 1.0, 'filter_function': 2.0}}
+        self.assertEqual(classify(1.0, 0.0, 0.2, totals), (READER_BOUND, 'process_function'))
+        self.assertEqual(classify(0.0, 0.0, 0.2, totals), (FILLER_BOUND, 'filter_function'))
+
+        # readers mostly waiting for a free bucket are short of memory
+        totals['reader']['bucket_seek'] = 5.0
+        self.assertEqual(classify(1.0, 0.0, 0.5, totals), (MEMORY_BOUND, 'bucket_seek'))
+
+    def test_stage_totals(self):
+        before = {'reader_0': worker_stats(h5_read=1.0)}
+        after = {'reader_0': worker_stats(h5_read=3.0),
+                 'reader_1': worker_stats(h5_read=0.5),
+                 'filler_0': worker_stats(build_batch=1.0)}
+
+        self.assertEqual(stage_totals(before, after), {'reader': {'h5_read': 2.5}, 'filler': {'build_batch': 1.0}})
+
+    def test_diagnose(self):
+        report = diagnose([(4, 0, 0.2), (2, 0, 0.4)], (4, 4))
+
+        self.assertEqual(report['bound'], READER_BOUND)
+        self.assertEqual(report['knob'], KNOBS['h5_read'])
+        self.assertAlmostEqual(report['in_fill'], 0.75)
+        self.assertAlmostEqual(report['occupancy'], 0.3)
+
+        with self.assertRaises(ValueError):
+            diagnose([], (4, 4))
@@ -0,0 +1,39 @@
+import Queue
+import copy
+from unittest import TestCase
+
+from adlkit.data_provider.schedulers import FileAffinityScheduler
+
+
+class TestFileAffinityScheduler(TestCase):
+    def test_route(self):
+        from mock_config import mock_batches, mock_filtered_batches
+        mock_batches = copy.deepcopy(mock_batches)
+        mock_filtered_batches = copy.deepcopy(mock_filtered_batches)
+
+        scheduler = FileAffinityScheduler(2)
+
+        # class_10 lives in file 2 and dominates every mock batch
+        for batch in mock_batches + mock_filtered_batches:
+            self.assertEqual(scheduler.route(batch), 0)
+
+        scheduler = FileAffinityScheduler(3)
+        self.assertEqual(scheduler.route(mock_batches[0]), 2)
+        self.assertEqual(scheduler.route([(1, ['tensor_1'], 'class_2', (0, 10), 0),
+                                          (4, ['tensor_1'], 'class_1', [1, 2, 3], 0)]), 1)
+
+    def test_group_steals_when_idle(self):
+        from mock_config import mock_batches
+        mock_batches = copy.deepcopy(mock_batches)
+
+        scheduler = FileAffinityScheduler(3, maxsize=10)
+        for batch in mock_batches[:2]:
+            scheduler.put(batch)
+
+        own_group = scheduler.group(2)
+        idle_group = scheduler.group(0)
+
+        self.assertEqual(own_group.get(timeout=1), mock_batches[0])
+        self.assertEqual(idle_group.get(timeout=1), mock_batches[1])
+        self.assertRaises(Queue.Empty, idle_group.get, True, 0.05)
+        self.assertRaises(Queue.Empty, own_group.get, False)
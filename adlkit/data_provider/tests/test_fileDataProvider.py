@@ -95,6 +95,92 @@ class TestFileDataProvider(TestCase):
                     data_set].shape, (100, 5),
                 "shared memory shape doesn't match")
 
+    def test_make_shared_malloc_dtypes(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=100,
+                                             make_class_index=True,
+                                             make_one_hot=True,
+                                             make_file_index=True,
+                                             n_buckets=2)
+
+        tmp_data_provider.malloc_requests = [('tensor_1', (5,), 'float32'),
+                                             ('tensor_2', (3, 4), 'uint8')]
+
+        tmp_data_provider.make_shared_malloc(0)
+
+        data_sets = tmp_data_provider.shared_memory[0][0][1]
+        self.assertEqual([data_set.dtype.name for data_set in data_sets],
+                         ['float32', 'uint8', 'int64', 'float32', 'int64'])
+        self.assertEqual(data_sets[1].shape, (100, 3, 4))
+        self.assertEqual(data_sets[4].shape, (100, 2))
+
+    def test_memory_report(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=100,
+                                             make_one_hot=True,
+                                             n_readers=3,
+                                             n_buckets=2)
+
+        tmp_data_provider.malloc_requests = [('tensor_1', (5,), 'float32'),
+                                             ('tensor_2', (3, 4), 'uint8')]
+
+        memory_report = tmp_data_provider.memory_report()
+        self.assertEqual(memory_report['data_sets'].items(),
+                         [('tensor_1', 2000), ('tensor_2', 1200), ('one_hot', 1200)])
+        # every data set starts on a 64 byte boundary
+        self.assertEqual(memory_report['bucket'], 2048 + 1216 + 1216)
+        self.assertEqual(memory_report['reader'], 2 * memory_report['bucket'])
+        self.assertEqual(memory_report['total'], 3 * memory_report['reader'])
+        self.assertEqual(memory_report['allocated'], 0)
+
+        tmp_data_provider.make_shared_malloc([0, 1, 2])
+        self.assertEqual(len(tmp_data_provider.arenas), 1)
+        self.assertEqual(tmp_data_provider.memory_report()['allocated'], memory_report['total'])
+
+    def test_start_allocates_once(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=3,
+                                             sleep_duration=sleep_duration)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+        tmp_data_provider.generators[0].generate().next()
+        memory_report = tmp_data_provider.memory_report()
+        n_arenas = len(tmp_data_provider.arenas)
+        tmp_data_provider.hard_stop()
+
+        self.assertEqual(n_arenas, 1)
+        self.assertEqual(memory_report['allocated'], memory_report['total'])
+
+    def test_memory_budget(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=3,
+                                             memory_budget=1024,
+                                             sleep_duration=sleep_duration)
+
+        with self.assertRaises(ValueError):
+            tmp_data_provider.start(filler_class=H5Filler,
+                                    reader_class=H5Reader,
+                                    generator_class=BaseGenerator)
+
+        self.assertFalse(tmp_data_provider.arenas)
+        self.assertFalse(any(reader for reader in tmp_data_provider.readers))
+
     def test_filler_to_malloc(self):
         from adlkit.data_provider.tests.mock_config import mock_sample_specification, \
             mock_expected_malloc_requests
@@ -189,6 +275,78 @@ class TestFileDataProvider(TestCase):
                           "test consumed {0} of {1} expected batches from the in_queue".format(
                                   len(out), max_batches))
 
+    def test_shard_classes(self):
+        classes = {
+            'class_1': {'file_names': [0, 1, 2, 3, 4], 'class_prob': 0.25},
+            'class_2': {'file_names': [5], 'class_prob': 0.75}
+        }
+
+        shards = FileDataProvider.shard_classes(classes, 2)
+
+        self.assertEqual(len(shards), 2)
+        self.assertEqual(shards[0]['class_1']['file_names'], [0, 2, 4])
+        self.assertEqual(shards[1]['class_1']['file_names'], [1, 3])
+        # too few files to split, they are handed out round robin
+        self.assertEqual(shards[0]['class_2']['file_names'], [5])
+        self.assertEqual(shards[1]['class_2']['file_names'], [5])
+
+        for shard in shards:
+            self.assertEqual(shard['class_1']['class_prob'], 0.25)
+            self.assertEqual(shard['class_2']['class_prob'], 0.75)
+
+        # the original classes are left alone
+        self.assertEqual(classes['class_1']['file_names'], [0, 1, 2, 3, 4])
+
+    def test_split_count(self):
+        self.assertEqual([FileDataProvider.split_count(10, 3, index) for index in range(3)], [4, 3, 3])
+        self.assertEqual([FileDataProvider.split_count(1, 3, index) for index in range(3)], [1, 0, 0])
+        self.assertEqual(FileDataProvider.split_count(1, 3, 2, minimum=1), 1)
+        self.assertIsNone(FileDataProvider.split_count(None, 3, 0))
+
+    def test_start_multiple_fillers(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification, \
+            mock_expected_malloc_requests
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        max_batches = 7
+        n_fillers = 3
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=100,
+                                             n_fillers=n_fillers,
+                                             n_readers=10,
+                                             max_batches=max_batches,
+                                             wrap_examples=True,
+                                             sleep_duration=sleep_duration)
+
+        tmp_data_provider.start_queues()
+        for _ in range(n_fillers):
+            tmp_data_provider.start_filler(H5Filler)
+
+        self.assertEqual(len(tmp_data_provider.fillers), n_fillers)
+        self.assertIs(tmp_data_provider.filler, tmp_data_provider.fillers[0])
+
+        # only the first filler reports its shapes
+        tmp_data_provider.process_malloc_requests()
+        self.assertEqual(tmp_data_provider.malloc_requests, mock_expected_malloc_requests)
+        with self.assertRaises(Queue.Empty):
+            tmp_data_provider.malloc_queue.get(timeout=1)
+
+        out = list()
+        while True:
+            try:
+                out.append(tmp_data_provider.in_queue.get(timeout=1))
+            except Queue.Empty:
+                break
+
+        # together the fillers still stop at max_batches
+        self.assertEqual(len(out), max_batches)
+        for batch in out:
+            self.assertEqual(sum(item[3][1] - item[3][0] for item in batch),
+                             tmp_data_provider.config.read_size)
+
+        tmp_data_provider.hard_stop()
+
     def test_start_reader(self):
         from adlkit.data_provider.tests.mock_config import mock_sample_specification, \
             mock_batches, mock_expected_malloc_requests
@@ -486,6 +644,555 @@ class TestFileDataProvider(TestCase):
             this = tmp_data_provider.generators[generator_id].generate().next()
             self.assertEqual(len(this), 4)
 
+    def test_start_reader_groups(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             read_multiplier=2,
+                                             make_class_index=True,
+                                             n_readers=4,
+                                             reader_groups=2,
+                                             wrap_examples=True,
+                                             sleep_duration=sleep_duration)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+
+        generator = tmp_data_provider.generators[0].generate()
+        for _ in range(50):
+            this = generator.next()
+            self.assertEqual(len(this), 3)
+            self.assertEqual(this[0].shape, (50, 5))
+
+        tmp_data_provider.hard_stop()
+
+    def test_start_thread_backend(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             read_multiplier=2,
+                                             make_one_hot=True,
+                                             make_class_index=True,
+                                             n_readers=3,
+                                             n_generators=2,
+                                             wrap_examples=True,
+                                             block_timeout=0.1,
+                                             sleep_duration=sleep_duration)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator,
+                                watcher_class=BaseWatcher,
+                                backend='thread')
+
+        self.assertEqual(tmp_data_provider.config.backend, 'thread')
+        self.assertIsInstance(tmp_data_provider.in_queue, Queue.Queue)
+        for reader in tmp_data_provider.readers:
+            self.assertTrue(reader.is_alive())
+            self.assertIsNone(reader.pid)
+
+        for _ in range(20):
+            for generator in tmp_data_provider.generators:
+                this = generator.generate().next()
+                self.assertEqual(len(this), 4)
+                self.assertEqual(this[0].shape, (50, 5))
+                self.assertEqual(this[3].shape, (50, 3))
+
+        tmp_data_provider.hard_stop()
+
+        self.assertFalse(tmp_data_provider.filler.is_alive())
+        self.assertFalse(tmp_data_provider.watcher.is_alive())
+        for reader in tmp_data_provider.readers:
+            self.assertFalse(reader.is_alive())
+
+    def test_start_unknown_backend(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification, n_readers=1)
+
+        with self.assertRaises(ValueError):
+            tmp_data_provider.start(filler_class=H5Filler,
+                                    reader_class=H5Reader,
+                                    generator_class=BaseGenerator,
+                                    backend='fiber')
+
+    def test_add_and_retire_readers(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             make_class_index=True,
+                                             n_readers=2,
+                                             n_buckets=2,
+                                             wrap_examples=True,
+                                             block_timeout=0.1,
+                                             sleep_duration=sleep_duration)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+        generator = tmp_data_provider.generators[0].generate()
+
+        self.assertEqual(tmp_data_provider.retire_reader(), 1)
+        self.assertEqual(tmp_data_provider.n_active_readers(), 1)
+        for _ in range(10):
+            self.assertEqual(generator.next()[0].shape, (50, 5))
+
+        # the retired slot and its buckets are reused
+        self.assertEqual(tmp_data_provider.add_reader(), 1)
+        self.assertEqual(tmp_data_provider.add_reader(), 2)
+        self.assertEqual(tmp_data_provider.n_active_readers(), 3)
+        self.assertEqual(len(tmp_data_provider.shared_memory), 3)
+        for _ in range(10):
+            self.assertEqual(generator.next()[0].shape, (50, 5))
+
+        in_depth, out_depth, occupancy = tmp_data_provider.sample_load()
+        self.assertTrue(0.0 <= occupancy <= 1.0)
+
+        tmp_data_provider.hard_stop()
+
+    def test_autoscale(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=1,
+                                             autoscale=True,
+                                             max_readers=3,
+                                             autoscale_interval=0.01,
+                                             autoscale_patience=1,
+                                             wrap_examples=True,
+                                             block_timeout=0.1,
+                                             sleep_duration=sleep_duration)
+
+        with self.assertRaises(ValueError):
+            tmp_data_provider.start(filler_class=H5Filler,
+                                    reader_class=H5Reader,
+                                    generator_class=BaseGenerator,
+                                    watcher_class=BaseWatcher)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+        self.assertTrue(tmp_data_provider.autoscaler.is_alive())
+
+        generator = tmp_data_provider.generators[0].generate()
+        for _ in range(50):
+            self.assertEqual(generator.next()[0].shape, (50, 5))
+            self.assertTrue(1 <= tmp_data_provider.n_active_readers() <= 3)
+
+        tmp_data_provider.hard_stop()
+        self.assertIsNone(tmp_data_provider.autoscaler)
+
+    def test_stats(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=2,
+                                             collect_metrics=True,
+                                             wrap_examples=True,
+                                             sleep_duration=sleep_duration)
+
+        self.assertEqual(tmp_data_provider.stats(), dict())
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+
+        generator = tmp_data_provider.generators[0].generate()
+        for _ in range(20):
+            generator.next()
+
+        stats = tmp_data_provider.stats()
+        tmp_data_provider.hard_stop()
+
+        self.assertEqual(sorted(stats.keys()), ['filler_0', 'generator_0', 'reader_0', 'reader_1'])
+        self.assertGreater(stats['filler_0']['stages']['build_batch']['count'], 0)
+        self.assertGreaterEqual(stats['generator_0']['counters']['batches'], 19)
+        self.assertGreater(stats['generator_0']['stages']['out_queue_get_wait']['count'], 0)
+
+        reader_batches = stats['reader_0']['counters']['batches'] + stats['reader_1']['counters']['batches']
+        self.assertGreater(reader_batches, 0)
+        for stage in ('in_queue_get_wait', 'bucket_seek', 'h5_read', 'shared_store', 'out_queue_put_wait'):
+            self.assertGreater(stats['reader_0']['stages'][stage]['count'] +
+                               stats['reader_1']['stages'][stage]['count'], 0, stage)
+
+    def test_pause_resume(self):
+        import time
+
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=2,
+                                             collect_metrics=True,
+                                             wrap_examples=True,
+                                             block_timeout=0.1,
+                                             sleep_duration=sleep_duration)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+
+        generator = tmp_data_provider.generators[0].generate()
+        for _ in range(5):
+            generator.next()
+
+        tmp_data_provider.pause()
+        # every worker reaches a check well within this
+        time.sleep(0.5)
+        before = tmp_data_provider.stats()
+        time.sleep(0.5)
+        after = tmp_data_provider.stats()
+
+        for name in ('filler_0', 'reader_0', 'reader_1'):
+            self.assertEqual(before[name]['counters'], after[name]['counters'], name)
+
+        tmp_data_provider.resume()
+        for _ in range(20):
+            generator.next()
+
+        stats = tmp_data_provider.stats()
+        tmp_data_provider.hard_stop()
+        self.assertGreater(stats['filler_0']['counters']['batches'], after['filler_0']['counters']['batches'])
+
+    def test_set_class_prob(self):
+        import time
+
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=1,
+                                             wrap_examples=True,
+                                             block_timeout=0.1,
+                                             sleep_duration=sleep_duration)
+
+        self.assertRaises(ValueError, tmp_data_provider.set_class_prob, {'class_0': 1.0})
+        self.assertRaises(ValueError, tmp_data_provider.set_class_prob, {'class_1': -1.0})
+        self.assertRaises(ValueError, tmp_data_provider.set_class_prob,
+                          {'class_1': 0.0, 'class_2': 0.0, 'class_10': 0.0})
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator,
+                                backend='thread')
+
+        class_probs = tmp_data_provider.set_class_prob({'class_1': 1.0, 'class_2': 0.0, 'class_10': 0.0})
+        self.assertEqual(class_probs, {'class_1': 1.0, 'class_2': 0.0, 'class_10': 0.0})
+        tmp_data_provider.reset_epoch(read_batches_per_epoch=7)
+
+        # the thread backend lets us look at the filler itself
+        filler = tmp_data_provider.filler
+        for _ in range(100):
+            if filler.read_batches_per_epoch == 7:
+                break
+            time.sleep(0.01)
+
+        tmp_data_provider.hard_stop()
+        self.assertEqual(filler.read_batches_per_epoch, 7)
+        self.assertEqual(filler.original_classes['class_1']['class_prob'], 1.0)
+        self.assertEqual(filler.classes['class_10']['class_prob'], 0.0)
+        self.assertEqual(tmp_data_provider.config.classes['class_2']['class_prob'], 0.0)
+
+    def test_restart(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=2,
+                                             wrap_examples=True,
+                                             sleep_duration=sleep_duration)
+
+        self.assertRaises(ValueError, tmp_data_provider.restart)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+
+        for _ in range(5):
+            tmp_data_provider.first().generate().next()
+
+        arenas = list(tmp_data_provider.arenas)
+        data_set = tmp_data_provider.shared_memory[0][0][1][0]
+        generator = tmp_data_provider.first()
+        old_readers = list(tmp_data_provider.readers)
+
+        tmp_data_provider.restart()
+
+        self.assertEqual(tmp_data_provider.arenas, arenas)
+        self.assertIs(tmp_data_provider.shared_memory[0][0][1][0], data_set)
+        self.assertIs(tmp_data_provider.first(), generator)
+        for old_reader, reader in zip(old_readers, tmp_data_provider.readers):
+            self.assertFalse(old_reader.is_alive())
+            self.assertTrue(reader.is_alive())
+
+        for _ in range(10):
+            this = tmp_data_provider.first().generate().next()
+            self.assertEqual(this[0].shape, (50, 5))
+
+        tmp_data_provider.hard_stop()
+
+    def test_restart_after_terminate(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        # no grace at all, every worker still running is terminated
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=2,
+                                             stop_timeout=0,
+                                             wrap_examples=True,
+                                             sleep_duration=sleep_duration)
+        self.assertEqual(tmp_data_provider.stop_grace(), 0)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+        try:
+            for _ in range(5):
+                tmp_data_provider.first().generate().next()
+
+            bucket = tmp_data_provider.shared_memory[0][0]
+            free_buckets = tmp_data_provider.free_buckets[0]
+            # as if a terminated reader had died holding them
+            bucket[0].get_lock().acquire()
+            free_buckets.lock.acquire()
+
+            tmp_data_provider.restart()
+
+            renewed = tmp_data_provider.shared_memory[0][0]
+            self.assertIsNot(renewed[0], bucket[0])
+            self.assertIs(renewed[1], bucket[1])
+            self.assertIsNot(tmp_data_provider.free_buckets[0], free_buckets)
+
+            for _ in range(10):
+                this = tmp_data_provider.first().generate().next()
+                self.assertEqual(this[0].shape, (50, 5))
+        finally:
+            tmp_data_provider.hard_stop()
+
+        default = FileDataProvider(copy.deepcopy(mock_sample_specification), block_timeout=0.5)
+        self.assertEqual(default.stop_grace(), 1.0)
+
+    def test_hard_stop_while_iterating(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=2,
+                                             read_multiplier=2,
+                                             wrap_examples=True,
+                                             sleep_duration=sleep_duration)
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+
+        # halfway through a read batch, the next batch is still in the bucket
+        generator = tmp_data_provider.first().generate()
+        generator.next()
+        tmp_data_provider.hard_stop()
+
+        self.assertRaises(StopIteration, generator.next)
+        self.assertRaises(StopIteration, tmp_data_provider.first().generate().next)
+
+    def test_start_stop_cycles(self):
+        import gc
+        import multiprocessing.heap
+        import os
+        import time
+
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=2,
+                                             wrap_examples=True,
+                                             sleep_duration=sleep_duration)
+
+        def footprint():
+            gc.collect()
+            shared_heap = multiprocessing.heap.BufferWrapper._heap
+            return (len(os.listdir('/proc/self/fd')), len(shared_heap._allocated_blocks),
+                    sum(arena.size for arena in shared_heap._arenas))
+
+        footprints = list()
+        stop_deltas = list()
+        for _ in range(10):
+            tmp_data_provider.start(filler_class=H5Filler,
+                                    reader_class=H5Reader,
+                                    generator_class=BaseGenerator)
+            tmp_data_provider.first().generate().next()
+
+            start_time = time.time()
+            tmp_data_provider.hard_stop()
+            stop_deltas.append(time.time() - start_time)
+
+            self.assertEqual(tmp_data_provider.shared_memory, list())
+            footprints.append(footprint())
+
+        test_logger.info("hard_stop took {0:.3f}s at most".format(max(stop_deltas)))
+        # the first cycles size the shared heap, after that nothing may pile up
+        self.assertEqual(footprints[2], footprints[-1])
+        self.assertLess(sorted(stop_deltas)[len(stop_deltas) // 2], 0.1)
+
+    def test_many_small_files(self):
+        import shutil
+        import tempfile
+
+        from adlkit.data_provider.bin.gen_rand_data import gen_rand_data
+
+        def every_other_row(h5_file_handle, data_set_names):
+            return range(0, h5_file_handle[data_set_names[0]].shape[0], 2)
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            gen_rand_data(tmp_dir, 40, 100)
+            sample_specification = [[os.path.join(tmp_dir, 'test_file_{0}.h5'.format(file_index)),
+                                     ['tensor_1', 'tensor_2'], 'class_1', 1] for file_index in range(40)]
+
+            # the default slots fit a read plan through all 40 files, the small ones overflow
+            for ring_slot_words in (None, 64):
+                tmp_data_provider = FileDataProvider(copy.deepcopy(sample_specification),
+                                                     batch_size=1024,
+                                                     n_readers=2,
+                                                     filter_function=every_other_row,
+                                                     ring_slot_words=ring_slot_words,
+                                                     wrap_examples=True,
+                                                     sleep_duration=sleep_duration)
+                tmp_data_provider.start(filler_class=H5Filler,
+                                        reader_class=H5Reader,
+                                        generator_class=BaseGenerator)
+                try:
+                    for _ in range(3):
+                        this = tmp_data_provider.first().generate().next()
+                        self.assertEqual(this[0].shape, (1024, 5))
+                    self.assertTrue(tmp_data_provider.fillers[0].is_alive())
+                    self.assertLess(tmp_data_provider.pointer_slot_words(),
+                                    tmp_data_provider.ring_slot_words())
+                finally:
+                    tmp_data_provider.hard_stop()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_write_trace(self):
+        import json
+        import shutil
+        import tempfile
+
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=2,
+                                             trace=True,
+                                             wrap_examples=True,
+                                             sleep_duration=sleep_duration)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+
+        generator = tmp_data_provider.generators[0].generate()
+        for _ in range(20):
+            generator.next()
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'trace.json')
+            tmp_data_provider.write_trace(path)
+            tmp_data_provider.hard_stop()
+
+            with open(path) as trace_file:
+                events = json.load(trace_file)['traceEvents']
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        # tracing alone leaves stats empty
+        self.assertEqual(tmp_data_provider.stats(), dict())
+
+        stages = set(event['name'] for event in events if event['ph'] == 'X')
+        for stage in ('build_batch', 'in_queue_put_wait', 'h5_read', 'shared_store', 'out_queue_get_wait'):
+            self.assertIn(stage, stages)
+
+        # the first batch is followed from the filler through a reader to the generator
+        thread_names = dict((event['tid'], event['args']['name'])
+                            for event in events if event['name'] == 'thread_name')
+        first_batch = [thread_names[event['tid']] for event in events
+                       if event.get('cat') == 'batch' and event['id'] == 0]
+        self.assertEqual(first_batch[0], 'filler_0')
+        self.assertTrue(any(name.startswith('reader') for name in first_batch))
+        self.assertEqual(first_batch[-1], 'generator_0')
+
+        # a reader's wait for a batch ends before it starts processing it
+        spans = dict(((event['tid'], event['name'], event['args']['batch_id']), event) for event in events
+                     if event['ph'] == 'X' and 'batch_id' in event.get('args', dict()))
+        for (tid, name, batch_id), wait in spans.items():
+            if name == 'in_queue_get_wait':
+                process = spans[(tid, 'process_batch', batch_id)]
+                self.assertLessEqual(wait['ts'] + wait['dur'], process['ts'] + 1)
+
+    def test_write_trace_off(self):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification, batch_size=50)
+        with self.assertRaises(ValueError):
+            tmp_data_provider.write_trace('trace.json')
+
+    def test_diagnose(self):
+        import threading
+        import time
+
+        from adlkit.data_provider.diagnosis import CONSUMER_BOUND
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=50,
+                                             n_readers=2,
+                                             collect_metrics=True,
+                                             wrap_examples=True,
+                                             sleep_duration=sleep_duration)
+
+        tmp_data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+
+        generator = tmp_data_provider.generators[0].generate()
+        for _ in range(5):
+            generator.next()
+
+        reports = list()
+        diagnosis_thread = threading.Thread(target=lambda: reports.append(tmp_data_provider.diagnose(1.0)))
+        diagnosis_thread.start()
+        # a consumer slower than the readers
+        while diagnosis_thread.is_alive():
+            generator.next()
+            time.sleep(0.05)
+        tmp_data_provider.hard_stop()
+
+        report = reports[0]
+        self.assertEqual(report['bound'], CONSUMER_BOUND)
+        self.assertEqual(report['stage'], 'yield_wait')
+        self.assertGreater(report['n_samples'], 1)
+        self.assertIn('h5_read', report['totals']['reader'])
+
     def test_start_then_stop(self):
         """
         if this fails, it's most likely due to a lack of allowed file descriptors
@@ -632,6 +1339,51 @@ class TestFileDataProvider(TestCase):
         for gen_count in gen_counter:
             self.assertEqual(gen_count, max_batches)
 
+    def test_watcher_release(self):
+        from adlkit.data_provider.buckets import drop_references
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification, \
+            mock_expected_malloc_requests
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+        mock_expected_malloc_requests = copy.deepcopy(mock_expected_malloc_requests)
+
+        n_generators = 3
+        tmp_data_provider = FileDataProvider(mock_sample_specification,
+                                             batch_size=100,
+                                             n_readers=1,
+                                             n_generators=n_generators,
+                                             n_buckets=2,
+                                             sleep_duration=sleep_duration)
+
+        tmp_data_provider.start_queues()
+        tmp_data_provider.malloc_requests = mock_expected_malloc_requests
+        tmp_data_provider.make_shared_malloc(0)
+
+        free_buckets = tmp_data_provider.free_buckets[0]
+        bucket_index = free_buckets.get(timeout=0)
+        free_buckets.get(timeout=0)
+
+        bucket = tmp_data_provider.shared_memory[0][bucket_index]
+        bucket[0].value = 1
+
+        tmp_watcher = BaseWatcher(worker_id=0,
+                                  shared_memory_pointer=tmp_data_provider.shared_memory,
+                                  multicast_queues=tmp_data_provider.multicast_queues,
+                                  out_queue=tmp_data_provider.out_queue,
+                                  free_buckets=tmp_data_provider.free_buckets)
+        tmp_watcher.multicast((0, bucket_index, ['data_set'], 7))
+        self.assertEqual(bucket[2].value, n_generators)
+
+        # every generator but the last leaves the bucket alone
+        for _ in range(n_generators - 1):
+            self.assertFalse(drop_references(bucket, bucket_index, free_buckets))
+        self.assertEqual(bucket[0].value, 1)
+        self.assertIsNone(free_buckets.get(timeout=0))
+
+        self.assertTrue(drop_references(bucket, bucket_index, free_buckets))
+        self.assertEqual(bucket[0].value, 0)
+        self.assertEqual(bucket[3].value, 1)
+        self.assertEqual(free_buckets.get(timeout=0), bucket_index)
+
             # def test_watcher_free(self):
             #     import logging as lg
             #
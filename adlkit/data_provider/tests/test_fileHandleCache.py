@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+from adlkit.data_provider.file_handles import FileHandleCache
+
+
+class MockFileHandle(object):
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestFileHandleCache(TestCase):
+    def test_lru_eviction(self):
+        cache = FileHandleCache(max_open_files=2, opener=MockFileHandle)
+
+        file_a = cache.open('a')
+        file_b = cache.open('b')
+        self.assertIs(cache.open('a'), file_a)
+
+        # b is now the least recently used
+        cache.open('c')
+        self.assertTrue(file_b.closed)
+        self.assertFalse(file_a.closed)
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 2)
+
+        self.assertEqual(cache.stats(), {'open_files': 2, 'hits': 1, 'misses': 3, 'evictions': 1})
+
+        cache.close_all()
+        self.assertTrue(file_a.closed)
+        self.assertEqual(len(cache), 0)
+
+    def test_unbounded(self):
+        cache = FileHandleCache(opener=MockFileHandle)
+        for file_path in range(100):
+            cache.open(file_path)
+        self.assertEqual(cache.stats()['evictions'], 0)
+        self.assertEqual(len(cache), 100)
+
+    def test_h5_chunk_cache_budget(self):
+        from mock_config import mock_file_index_list
+
+        cache = FileHandleCache(max_open_files=2, max_chunk_cache_bytes=4 * 1024 ** 2)
+        self.assertEqual(cache.chunk_cache_bytes_per_file(), 2 * 1024 ** 2)
+
+        for file_path in mock_file_index_list:
+            h5_file_handle = cache.open(file_path)
+            self.assertEqual(h5_file_handle['tensor_1'].shape[1:], (5,))
+            self.assertEqual(h5_file_handle.id.get_access_plist().get_cache()[2], 2 * 1024 ** 2)
+
+        self.assertEqual(cache.stats()['evictions'], 1)
+        cache.close_all()
+
+    def test_bad_max_open_files(self):
+        self.assertRaises(ValueError, FileHandleCache, 0)
+
+    def test_chunk_cache_needs_max_open_files(self):
+        # the budget is split between the open files, without a bound on them it would not hold
+        self.assertRaises(ValueError, FileHandleCache, max_chunk_cache_bytes=4 * 1024 ** 2)
+
+        cache = FileHandleCache(max_open_files=None, max_chunk_cache_bytes=None, opener=MockFileHandle)
+        self.assertIsNone(cache.chunk_cache_bytes_per_file())
@@ -4,6 +4,8 @@ import logging as lg
 import multiprocessing
 from unittest import TestCase
 
+import numpy as np
+
 from adlkit.data_provider.fillers import H5Filler
 
 lg.basicConfig(level=lg.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s ')
@@ -254,3 +256,53 @@ class TestH5Filler(TestCase):
         self.assertEquals(out, max_batches,
                           "test consumed {0} of {1} expected batches from the in_queue".format(
                               out, max_batches))
+
+    def test_compute_probability(self):
+        from mock_config import mock_classes, mock_class_index_map, \
+            mock_data_sets, mock_file_index_list
+        mock_classes = copy.deepcopy(mock_classes)
+
+        read_size = 1000
+        n_draws = 200
+        filler = H5Filler(classes=mock_classes,
+                          class_index_map=mock_class_index_map,
+                          in_queue=None, worker_id=1, read_size=read_size,
+                          malloc_queue=None,
+                          data_sets=mock_data_sets,
+                          file_index_list=mock_file_index_list)
+
+        totals = dict((class_name, 0) for class_name in mock_classes)
+        for _ in range(n_draws):
+            filler.compute_probability()
+
+            self.assertEqual(sum(filler.classes[class_name]['n_examples'] for class_name in mock_classes),
+                             read_size)
+
+            for class_name in mock_classes:
+                totals[class_name] += filler.classes[class_name]['n_examples']
+                filler.classes[class_name]['n_examples'] = 0
+
+        for class_name in mock_classes:
+            self.assertAlmostEqual(totals[class_name] / float(read_size * n_draws),
+                                   mock_classes[class_name]['class_prob'],
+                                   places=2)
+
+    def test_compute_probability_random_state(self):
+        from mock_config import mock_classes, mock_class_index_map, \
+            mock_data_sets, mock_file_index_list
+
+        draws = list()
+        for _ in range(2):
+            filler = H5Filler(classes=copy.deepcopy(mock_classes),
+                              class_index_map=mock_class_index_map,
+                              in_queue=None, worker_id=1, read_size=100,
+                              malloc_queue=None,
+                              data_sets=mock_data_sets,
+                              file_index_list=mock_file_index_list)
+            # the counts come from the filler's own RandomState, not the global one
+            filler.random_state.seed(1234)
+            np.random.seed()
+            filler.compute_probability()
+            draws.append([filler.classes[class_name]['n_examples'] for class_name in sorted(mock_classes)])
+
+        self.assertEqual(draws[0], draws[1])
@@ -374,3 +374,172 @@ class TestH5Reader(TestCase):
                           "test consumed {0} of {1} expected batches from the in_queue".format(
                               len(out),
                               max_batches))
+
+    def test_read_direct_matches_copy(self):
+        from mock_config import mock_batches, mock_expected_malloc_requests, \
+            mock_class_index_map, mock_file_index_malloc, mock_file_index_list
+
+        mock_batches = copy.deepcopy(mock_batches)
+        mock_expected_malloc_requests = copy.deepcopy(mock_expected_malloc_requests)
+        mock_expected_malloc_requests.extend(copy.deepcopy(mock_file_index_malloc))
+
+        read_size = 1000
+        out = list()
+        for read_direct in (True, False):
+            shared_data_pointer = make_buckets(mock_expected_malloc_requests, read_size, 1)
+            reader = H5Reader(worker_id=0, in_queue=None, out_queue=None,
+                              shared_memory_pointer=shared_data_pointer,
+                              read_size=read_size,
+                              class_index_map=mock_class_index_map,
+                              file_index_list=mock_file_index_list,
+                              make_one_hot=True,
+                              make_class_index=True,
+                              make_file_index=True,
+                              shuffle=False,
+                              read_direct=read_direct)
+
+            reader.process_batch(mock_batches[0])
+            out.append(shared_data_pointer[0][1])
+
+        for direct_payload, copy_payload in zip(*out):
+            np.testing.assert_array_equal(direct_payload, copy_payload)
+
+    def test_read_direct_shuffle_keeps_rows_aligned(self):
+        import h5py
+        from mock_config import mock_batches, mock_expected_malloc_requests, \
+            mock_class_index_map, mock_file_index_malloc, mock_file_index_list
+
+        mock_batches = copy.deepcopy(mock_batches)
+        mock_expected_malloc_requests = copy.deepcopy(mock_expected_malloc_requests)
+        mock_expected_malloc_requests.extend(copy.deepcopy(mock_file_index_malloc))
+
+        read_size = 1000
+        shared_data_pointer = make_buckets(mock_expected_malloc_requests, read_size, 1)
+        reader = H5Reader(worker_id=0, in_queue=None, out_queue=None,
+                          shared_memory_pointer=shared_data_pointer,
+                          read_size=read_size,
+                          class_index_map=mock_class_index_map,
+                          file_index_list=mock_file_index_list,
+                          make_one_hot=True,
+                          make_class_index=True,
+                          make_file_index=True,
+                          shuffle=True)
+
+        reader.process_batch(mock_batches[0])
+        tensor_1, tensor_2, class_index, one_hot, file_struct = shared_data_pointer[0][1]
+
+        np.testing.assert_array_equal(np.argmax(one_hot, axis=1), class_index)
+        for file_index, file_name in enumerate(mock_file_index_list):
+            rows = file_struct[:, 0] == file_index
+            with h5py.File(file_name, 'r') as h5_file_handle:
+                np.testing.assert_array_equal(tensor_1[rows],
+                                              h5_file_handle['tensor_1'][...][file_struct[rows, 1]])
+                np.testing.assert_array_equal(tensor_2[rows],
+                                              h5_file_handle['tensor_2'][...][file_struct[rows, 1]])
+
+    def test_coalesce_read_descriptor(self):
+        from adlkit.data_provider.readers import coalesce_read_descriptor
+
+        read_descriptor = [3, 4, 5, 8, 10, 40, 41, 100]
+
+        slab_starts, slab_ends = coalesce_read_descriptor(read_descriptor, 0)
+        self.assertEqual(zip(slab_starts, slab_ends), [(3, 6), (8, 9), (10, 11), (40, 42), (100, 101)])
+
+        slab_starts, slab_ends = coalesce_read_descriptor(read_descriptor, 2)
+        self.assertEqual(zip(slab_starts, slab_ends), [(3, 11), (40, 42), (100, 101)])
+
+        slab_starts, slab_ends = coalesce_read_descriptor(read_descriptor, 100)
+        self.assertEqual(zip(slab_starts, slab_ends), [(3, 101)])
+
+    def test_coalesced_reads_match_point_selection(self):
+        from mock_config import mock_filtered_batches, mock_expected_malloc_requests, \
+            mock_class_index_map, mock_file_index_list
+
+        mock_filtered_batches = copy.deepcopy(mock_filtered_batches)
+        mock_expected_malloc_requests = copy.deepcopy(mock_expected_malloc_requests)
+
+        read_size = 200
+        out = list()
+        for read_direct, coalesce_gap in ((False, None), (True, None), (True, 0), (True, 32), (False, 32)):
+            shared_data_pointer = make_buckets(mock_expected_malloc_requests, read_size, 1)
+            reader = H5Reader(worker_id=0, in_queue=None, out_queue=None,
+                              shared_memory_pointer=shared_data_pointer,
+                              read_size=read_size,
+                              class_index_map=mock_class_index_map,
+                              file_index_list=mock_file_index_list,
+                              shuffle=False,
+                              read_direct=read_direct,
+                              coalesce_gap=coalesce_gap)
+
+            reader.process_batch(mock_filtered_batches[0])
+            out.append(shared_data_pointer[0][1])
+
+        for payloads in out[1:]:
+            for payload, expected_payload in zip(payloads, out[0]):
+                np.testing.assert_array_equal(payload, expected_payload)
+
+
+def make_buckets(malloc_requests, read_size, bucket_length):
+    shared_data_pointer = range(bucket_length)
+
+    for bucket in shared_data_pointer:
+        data_sets = []
+        for request in malloc_requests:
+            shape = (read_size,) + request[1]
+            data_sets.append(np.zeros(shape, dtype=request[2]))
+
+        state = multiprocessing.Value('i', 0)
+        generator_start_counter = multiprocessing.Value('i', 0)
+        generator_end_counter = multiprocessing.Value('i', 0)
+        shared_data_pointer[bucket] = [state, data_sets, generator_start_counter,
+                                       generator_end_counter]
+
+    return shared_data_pointer
+
+    def test_labels(self):
+        import h5py
+
+        from adlkit.data_provider.arenas import BucketLayout, SharedArena
+        from mock_config import mock_batches, mock_expected_malloc_requests, mock_file_index_malloc, \
+            mock_class_index_map, mock_file_index_list
+
+        batch = copy.deepcopy(mock_batches[0])
+        read_size = 1000
+        layout = BucketLayout(mock_expected_malloc_requests + mock_file_index_malloc, read_size)
+
+        expected_class_index = np.concatenate([np.full(163, 1), np.full(73, 0), np.full(764, 2)])
+        expected_rows = np.concatenate([np.arange(0, 163), np.arange(0, 73), np.arange(0, 764)])
+        # the class index of the examples of each file of mock_file_index_list
+        file_classes = [0, 1, 2]
+
+        for read_direct in (True, False):
+            for shuffle in (False, True):
+                arena = SharedArena(layout.bucket_bytes)
+                shared_data_pointer = [[multiprocessing.Value('i', 0), arena.buckets(layout, 1)[0],
+                                        multiprocessing.Value('i', 0), multiprocessing.Value('i', 0)]]
+
+                reader = H5Reader(worker_id=0, in_queue=None, out_queue=None,
+                                  shared_memory_pointer=shared_data_pointer,
+                                  read_size=read_size,
+                                  class_index_map=mock_class_index_map,
+                                  file_index_list=mock_file_index_list,
+                                  make_class_index=True, make_one_hot=True, make_file_index=True,
+                                  read_direct=read_direct, shuffle=shuffle)
+                reader.process_batch(batch)
+
+                tensor_1, _, class_index, one_hot, file_struct = shared_data_pointer[0][1]
+
+                self.assertTrue((one_hot.sum(axis=1) == 1).all())
+                self.assertTrue((one_hot.argmax(axis=1) == class_index).all())
+
+                if not shuffle:
+                    self.assertTrue((class_index == expected_class_index).all())
+                    self.assertTrue((file_struct[:, 1] == expected_rows).all())
+
+                # every row still carries the labels of the example it was read from
+                for file_path_index in range(len(mock_file_index_list)):
+                    rows = file_struct[:, 0] == file_path_index
+                    with h5py.File(mock_file_index_list[file_path_index], 'r') as h5_file_handle:
+                        expected_tensor_1 = h5_file_handle['tensor_1'][...][file_struct[rows, 1]]
+                    self.assertTrue((tensor_1[rows] == expected_tensor_1).all())
+                    self.assertTrue((class_index[rows] == file_classes[file_path_index]).all())
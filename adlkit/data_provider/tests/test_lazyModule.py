@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+import adlkit
+from adlkit.data_provider.lazy import LazyModule
+
+
+class TestLazyModule(TestCase):
+    def test_load_on_first_use(self):
+        lazy_json = LazyModule('json')
+        self.assertFalse(lazy_json.is_loaded())
+
+        self.assertEqual(lazy_json.dumps([1]), '[1]')
+        self.assertTrue(lazy_json.is_loaded())
+        self.assertIs(lazy_json.load(), sys.modules['json'])
+
+    def test_missing_attribute(self):
+        with self.assertRaises(AttributeError):
+            LazyModule('json').not_an_attribute
+
+    def test_package_import_skips_h5py(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(adlkit.__file__))
+        output = subprocess.check_output([sys.executable, '-c',
+                                          "import sys, adlkit.data_provider; print('h5py' in sys.modules)"],
+                                         env=env)
+        self.assertEqual(output.strip(), 'False')
+
+    def test_package_import_skips_optional_modules(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(adlkit.__file__))
+        modules = ['adlkit.data_provider.{0}'.format(name)
+                   for name in ('autoscalers', 'diagnosis', 'pools', 'schedulers', 'tracing')]
+        output = subprocess.check_output([sys.executable, '-c',
+                                          "import sys, adlkit.data_provider; "
+                                          "print([name for name in {0} if name in sys.modules])".format(modules)],
+                                         env=env)
+        self.assertEqual(output.strip(), '[]')
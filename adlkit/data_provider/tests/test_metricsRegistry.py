@@ -0,0 +1,66 @@
+from unittest import TestCase
+
+from adlkit.data_provider.metrics import BIN_BOUNDS, MetricsRegistry, NULL_METRICS
+
+
+def record_in_child(worker_metrics):
+    worker_metrics.observe('h5_read', 0.002)
+    worker_metrics.increment('batches')
+
+
+class TestMetricsRegistry(TestCase):
+    def test_observe(self):
+        registry = MetricsRegistry(2)
+        reader_metrics = registry.worker('reader_0')
+
+        for seconds in (0.001, 0.001, 0.001, 0.5):
+            reader_metrics.observe('h5_read', seconds)
+        reader_metrics.increment('examples', 100)
+
+        stats = registry.stats()
+        self.assertEqual(stats.keys(), ['reader_0'])
+
+        h5_read = stats['reader_0']['stages']['h5_read']
+        self.assertEqual(h5_read['count'], 4)
+        self.assertAlmostEqual(h5_read['total'], 0.503)
+        self.assertEqual(sum(h5_read['histogram']), 4)
+        # p50 falls in the bin of 1ms, p99 in the bin of 0.5s
+        self.assertTrue(0.001 <= h5_read['p50'] < 0.002)
+        self.assertTrue(0.5 <= h5_read['p99'] < 1.0)
+
+        # unobserved stages are left out
+        self.assertEqual(stats['reader_0']['stages'].keys(), ['h5_read'])
+        self.assertEqual(stats['reader_0']['counters']['examples'], 100)
+
+    def test_slowest_bin(self):
+        registry = MetricsRegistry(1)
+        registry.worker('generator_0').observe('yield_wait', BIN_BOUNDS[-1] * 2)
+
+        self.assertEqual(registry.stats()['generator_0']['stages']['yield_wait']['p99'], float('inf'))
+
+    def test_slots(self):
+        registry = MetricsRegistry(2)
+
+        self.assertEqual(registry.worker('reader_0').slot, 0)
+        self.assertEqual(registry.worker('reader_1').slot, 1)
+        # a restarted worker gets its old slot back
+        self.assertEqual(registry.worker('reader_0').slot, 0)
+
+        with self.assertRaises(ValueError):
+            registry.worker('reader_2')
+
+    def test_shared_across_processes(self):
+        import billiard
+
+        registry = MetricsRegistry(1)
+        process = billiard.Process(target=record_in_child, args=(registry.worker('reader_0'),))
+        process.start()
+        process.join()
+
+        stats = registry.stats()['reader_0']
+        self.assertEqual(stats['stages']['h5_read']['count'], 1)
+        self.assertEqual(stats['counters']['batches'], 1)
+
+    def test_null_metrics(self):
+        NULL_METRICS.observe('h5_read', 1.0)
+        NULL_METRICS.increment('batches')
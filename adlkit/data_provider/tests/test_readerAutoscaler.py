@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from adlkit.data_provider.autoscalers import HOLD, ReaderAutoscaler, SCALE_DOWN, SCALE_UP
+
+
+class MockDataProvider(object):
+    def __init__(self, n_readers, load):
+        self.paused = False
+        self.n_readers = n_readers
+        self.load = load
+
+    def n_active_readers(self):
+        return self.n_readers
+
+    def sample_load(self):
+        return self.load
+
+    def add_reader(self):
+        self.n_readers += 1
+        return self.n_readers - 1
+
+    def retire_reader(self):
+        self.n_readers -= 1
+        return self.n_readers
+
+
+class TestReaderAutoscaler(TestCase):
+    def test_decide(self):
+        autoscaler = ReaderAutoscaler(None, min_readers=1, max_readers=4)
+
+        # the filler is ahead and the generators are waiting
+        self.assertEqual(autoscaler.decide(in_depth=3, out_depth=0, occupancy=0.2), SCALE_UP)
+        # nothing to read and the buckets are mostly free
+        self.assertEqual(autoscaler.decide(in_depth=0, out_depth=0, occupancy=0.1), SCALE_DOWN)
+        # the generators are the bottleneck
+        self.assertEqual(autoscaler.decide(in_depth=3, out_depth=3, occupancy=1.0), HOLD)
+        self.assertEqual(autoscaler.decide(in_depth=0, out_depth=3, occupancy=0.9), HOLD)
+
+    def test_patience_and_bounds(self):
+        data_provider = MockDataProvider(2, (3, 0, 0.2))
+        autoscaler = ReaderAutoscaler(data_provider, min_readers=1, max_readers=3, patience=2)
+
+        self.assertEqual(autoscaler.step(), HOLD)
+        self.assertEqual(autoscaler.step(), SCALE_UP)
+        self.assertEqual(data_provider.n_readers, 3)
+
+        # at max_readers
+        autoscaler.step()
+        self.assertEqual(autoscaler.step(), HOLD)
+        self.assertEqual(data_provider.n_readers, 3)
+
+        data_provider.load = (0, 0, 0.0)
+        for _ in range(10):
+            autoscaler.step()
+        self.assertEqual(data_provider.n_readers, 1)
+
+    def test_bad_bounds(self):
+        with self.assertRaises(ValueError):
+            ReaderAutoscaler(None, min_readers=0, max_readers=4)
+
+        with self.assertRaises(ValueError):
+            ReaderAutoscaler(None, min_readers=5, max_readers=4)
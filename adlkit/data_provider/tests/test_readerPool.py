@@ -0,0 +1,156 @@
+"""
+__author__ = 'W. Grayson Hilliard'
+"""
+from __future__ import absolute_import
+
+import copy
+import logging as lg
+from unittest import TestCase
+
+from adlkit.data_provider.config import THREAD_BACKEND
+from adlkit.data_provider.data_providers import FileDataProvider
+from adlkit.data_provider.fillers import H5Filler
+from adlkit.data_provider.generators import BaseGenerator
+from adlkit.data_provider.pools import PooledQueue, ReaderPool
+from adlkit.data_provider.readers import H5Reader
+
+lg.basicConfig(level=lg.DEBUG, format='%(asctime)s %(levelname)s %(name)s %(message)s ')
+test_logger = lg.getLogger('data_provider.tests')
+
+sleep_duration = 0.05
+
+
+class TestReaderPool(TestCase):
+    def make_data_provider(self, batch_size, **kwargs):
+        from adlkit.data_provider.tests.mock_config import mock_sample_specification
+        mock_sample_specification = copy.deepcopy(mock_sample_specification)
+
+        return FileDataProvider(mock_sample_specification,
+                                batch_size=batch_size,
+                                n_readers=2,
+                                n_buckets=2,
+                                wrap_examples=True,
+                                sleep_duration=sleep_duration,
+                                **kwargs)
+
+    def start_all(self, pool, data_providers):
+        for data_provider in data_providers:
+            pool.register(data_provider)
+        for data_provider in data_providers:
+            data_provider.start(filler_class=H5Filler,
+                                reader_class=H5Reader,
+                                generator_class=BaseGenerator)
+        pool.start()
+
+    def test_shared_readers(self):
+        pool = ReaderPool(n_readers=2)
+        train = self.make_data_provider(50)
+        validation = self.make_data_provider(20)
+        self.start_all(pool, [train, validation])
+
+        try:
+            self.assertEqual(len(pool.readers), 2)
+            for data_provider in (train, validation):
+                self.assertEqual(data_provider.readers, list())
+                self.assertIsInstance(data_provider.in_queue, PooledQueue)
+                self.assertEqual(len(data_provider.shared_memory), 1)
+                self.assertEqual(len(data_provider.shared_memory[0]), 2 * pool.n_readers)
+
+            for _ in range(10):
+                self.assertEqual(train.first().generate().next()[0].shape, (50, 5))
+                self.assertEqual(validation.first().generate().next()[0].shape, (20, 5))
+        finally:
+            pool.hard_stop()
+
+        self.assertEqual(pool.readers, list())
+        self.assertFalse(train.is_started)
+        self.assertFalse(validation.is_started)
+
+    def test_idle_data_provider(self):
+        # no one draws from validation, its buckets fill up and the reader has to keep reading for train
+        pool = ReaderPool(n_readers=1)
+        train = self.make_data_provider(50)
+        validation = self.make_data_provider(20)
+        self.start_all(pool, [train, validation])
+
+        try:
+            for _ in range(20):
+                self.assertEqual(train.first().generate().next()[0].shape, (50, 5))
+
+            self.assertEqual(validation.free_buckets[0].qsize(), 0)
+            for _ in range(5):
+                self.assertEqual(validation.first().generate().next()[0].shape, (20, 5))
+        finally:
+            pool.hard_stop()
+
+    def test_bucket_seek(self):
+        pool = ReaderPool(n_readers=1)
+        train = self.make_data_provider(50, collect_metrics=True)
+        self.start_all(pool, [train])
+
+        try:
+            for _ in range(10):
+                train.first().generate().next()
+            stages = train.stats()['reader_0']['stages']
+            self.assertGreaterEqual(stages['bucket_seek']['count'], 10)
+        finally:
+            pool.hard_stop()
+
+    def test_thread_backend(self):
+        pool = ReaderPool(n_readers=2, backend=THREAD_BACKEND)
+        train = self.make_data_provider(50, backend=THREAD_BACKEND)
+        validation = self.make_data_provider(20, backend=THREAD_BACKEND)
+        self.start_all(pool, [train, validation])
+
+        try:
+            for _ in range(5):
+                self.assertEqual(train.first().generate().next()[0].shape, (50, 5))
+                self.assertEqual(validation.first().generate().next()[0].shape, (20, 5))
+        finally:
+            pool.hard_stop()
+
+    def test_restart_pool(self):
+        pool = ReaderPool(n_readers=1)
+        train = self.make_data_provider(50)
+        self.start_all(pool, [train])
+
+        try:
+            self.assertRaises(ValueError, pool.start)
+            self.assertRaises(ValueError, train.restart)
+
+            train.first().generate().next()
+            old_reader = pool.readers[0]
+            self.assertTrue(pool.stop())
+            self.assertFalse(old_reader.is_alive())
+
+            pool.start()
+            for _ in range(5):
+                self.assertEqual(train.first().generate().next()[0].shape, (50, 5))
+        finally:
+            pool.hard_stop()
+
+    def test_register(self):
+        pool = ReaderPool(n_readers=1)
+        train = self.make_data_provider(50)
+        validation = self.make_data_provider(20)
+
+        pool.register(train)
+        self.assertIs(train.reader_pool, pool)
+
+        # not started yet
+        self.assertRaises(ValueError, pool.start)
+
+        validation.start(filler_class=H5Filler,
+                         reader_class=H5Reader,
+                         generator_class=BaseGenerator)
+        try:
+            self.assertRaises(ValueError, pool.register, validation)
+        finally:
+            validation.hard_stop()
+
+        self.assertRaises(ValueError, ReaderPool, n_readers=0)
+
+        autoscaled = self.make_data_provider(50, autoscale=True)
+        pool.register(autoscaled)
+        self.assertRaises(ValueError, autoscaled.start,
+                          filler_class=H5Filler, reader_class=H5Reader, generator_class=BaseGenerator)
@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+import numpy as np
+
+from adlkit.data_provider.arenas import ALIGNMENT, BucketLayout, SharedArena
+from adlkit.data_provider.config import THREAD_BACKEND
+
+
+def fill_in_child(data_set):
+    data_set[...] = 7
+
+
+class TestSharedArena(TestCase):
+    def setUp(self):
+        self.layout = BucketLayout([('tensor_1', (5,), 'float32'),
+                                    ('tensor_2', (3,), 'uint8'),
+                                    ('one_hot', (2,))], read_size=10)
+
+    def test_layout(self):
+        offsets = [offset for _, _, _, offset, _ in self.layout.data_sets]
+        self.assertEqual(offsets, [0, 256, 320])
+        self.assertEqual(self.layout.bucket_bytes, 512)
+        self.assertEqual(self.layout.data_set_bytes().items(),
+                         [('tensor_1', 200), ('tensor_2', 30), ('one_hot', 160)])
+
+    def test_buckets(self):
+        arena = SharedArena(self.layout.bucket_bytes * 3)
+        buckets = arena.buckets(self.layout, 3)
+
+        self.assertEqual(len(buckets), 3)
+        self.assertEqual([data_set.dtype.name for data_set in buckets[0]], ['float32', 'uint8', 'float64'])
+        self.assertEqual(buckets[2][0].shape, (10, 5))
+
+        for bucket in buckets:
+            for data_set in bucket:
+                self.assertEqual(data_set.ctypes.data % ALIGNMENT, 0)
+                self.assertFalse(data_set.any())
+
+        # views do not overlap
+        for bucket_index, bucket in enumerate(buckets):
+            for data_set in bucket:
+                data_set[...] = bucket_index + 1
+        for bucket_index, bucket in enumerate(buckets):
+            for data_set in bucket:
+                self.assertTrue((data_set == bucket_index + 1).all())
+
+    def test_offset(self):
+        arena = SharedArena(self.layout.bucket_bytes * 4)
+        arena.buckets(self.layout, 2, offset=2 * self.layout.bucket_bytes)[0][0][...] = 1
+
+        self.assertEqual(arena.buckets(self.layout, 4)[2][0].sum(), 50)
+
+    def test_shared_across_processes(self):
+        import billiard
+
+        arena = SharedArena(self.layout.bucket_bytes)
+        data_set = arena.buckets(self.layout, 1)[0][1]
+
+        process = billiard.Process(target=fill_in_child, args=(data_set,))
+        process.start()
+        process.join()
+
+        self.assertTrue((data_set == 7).all())
+
+    def test_thread_backend(self):
+        arena = SharedArena(self.layout.bucket_bytes, backend=THREAD_BACKEND)
+
+        self.assertIsInstance(arena.base, np.ndarray)
+        self.assertEqual(arena.buckets(self.layout, 1)[0][0].ctypes.data % ALIGNMENT, 0)
@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from adlkit.data_provider.metrics import MetricsGroup, MetricsRegistry
+from adlkit.data_provider.tracing import TraceRecorder
+
+
+def record_in_child(worker_tracer):
+    worker_tracer.observe('h5_read', 0.002, 7)
+
+
+class TestTraceRecorder(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_events(self):
+        recorder = TraceRecorder(2)
+        filler_tracer = recorder.worker('filler_0')
+        reader_tracer = recorder.worker('reader_0')
+
+        filler_tracer.observe('build_batch', 0.01, 0)
+        reader_tracer.observe('in_queue_get_wait', 0.002)
+        reader_tracer.observe('h5_read', 0.003, 0)
+
+        events = recorder.events()
+        spans = [event for event in events if event['ph'] == 'X']
+        self.assertEqual([span['name'] for span in spans], ['build_batch', 'in_queue_get_wait', 'h5_read'])
+        self.assertEqual([span['tid'] for span in spans], [0, 1, 1])
+        self.assertAlmostEqual(spans[2]['dur'], 3000)
+        self.assertEqual(spans[2]['args'], {'batch_id': 0})
+        self.assertNotIn('args', spans[1])
+        self.assertEqual(min(span['ts'] for span in spans), 0)
+
+        thread_names = dict((event['tid'], event['args']['name'])
+                            for event in events if event['name'] == 'thread_name')
+        self.assertEqual(thread_names, {0: 'filler_0', 1: 'reader_0'})
+
+        # batch 0 is followed from the filler to the reader
+        flows = [event for event in events if event.get('cat') == 'batch']
+        self.assertEqual([(flow['ph'], flow['tid'], flow['id']) for flow in flows], [('s', 0, 0), ('f', 1, 0)])
+
+    def test_explicit_end(self):
+        recorder = TraceRecorder(1)
+        reader_tracer = recorder.worker('reader_0')
+        reader_tracer.observe('in_queue_get_wait', 0.5, 3, end=100.0)
+
+        span = recorder.slot_spans(0)[0]
+        self.assertEqual(span[2], 99.5)
+        self.assertEqual(span[3], 0.5)
+
+    def test_no_flows_with_several_fillers(self):
+        recorder = TraceRecorder(2)
+        recorder.worker('filler_0').observe('build_batch', 0.001, 0)
+        recorder.worker('filler_1').observe('build_batch', 0.001, 0)
+
+        self.assertFalse([event for event in recorder.events() if event.get('cat') == 'batch'])
+
+    def test_ring_buffer(self):
+        recorder = TraceRecorder(1, capacity=3)
+        reader_tracer = recorder.worker('reader_0')
+        for batch_id in range(5):
+            reader_tracer.observe('h5_read', 0.001, batch_id)
+
+        spans = recorder.slot_spans(0)
+        self.assertEqual(spans[:, 1].tolist(), [2, 3, 4])
+
+    def test_shared_across_processes(self):
+        import billiard
+
+        recorder = TraceRecorder(1)
+        process = billiard.Process(target=record_in_child, args=(recorder.worker('reader_0'),))
+        process.start()
+        process.join()
+
+        self.assertEqual(recorder.slot_spans(0)[:, 1].tolist(), [7])
+
+    def test_write(self):
+        recorder = TraceRecorder(1)
+        recorder.worker('generator_0').observe('yield_wait', 0.01, 3)
+
+        path = os.path.join(self.tmp_dir, 'trace.json')
+        n_events = recorder.write(path)
+
+        with open(path) as trace_file:
+            trace = json.load(trace_file)
+        self.assertEqual(len(trace['traceEvents']), n_events)
+
+    def test_metrics_group(self):
+        registry = MetricsRegistry(1)
+        recorder = TraceRecorder(1)
+        group = MetricsGroup([registry.worker('reader_0'), recorder.worker('reader_0')])
+
+        group.observe('concat', 0.001, 1)
+        group.increment('batches')
+
+        self.assertEqual(registry.stats()['reader_0']['stages']['concat']['count'], 1)
+        self.assertEqual(registry.stats()['reader_0']['counters']['batches'], 1)
+        self.assertEqual(len(recorder.slot_spans(0)), 1)
@@ -0,0 +1,91 @@
+import time
+from unittest import TestCase
+
+from adlkit.data_provider.config import PAUSE_MESSAGE, RESUME_MESSAGE, STOP_MESSAGE, THREAD_BACKEND
+from adlkit.data_provider.workers import Worker
+
+
+class LoopingWorker(Worker):
+    def run(self, **kwargs):
+        while not self.should_stop():
+            self.batch_count += 1
+            time.sleep(0.001)
+
+
+class TestWorker(TestCase):
+    def test_stop_flag(self):
+        worker = Worker(0)
+        self.assertFalse(worker.should_stop())
+
+        self.assertTrue(worker.send_command(STOP_MESSAGE, block=False))
+        self.assertTrue(worker.should_stop())
+        # the stop never went through the control queue
+        self.assertEqual(worker.command_generation.value, 0)
+
+    def test_send_command_timeout(self):
+        worker = Worker(0, control_queue_depth=1, backend=THREAD_BACKEND)
+        self.assertTrue(worker.send_command('some_command'))
+
+        # no one takes the first command
+        start_time = time.time()
+        self.assertFalse(worker.send_command('another_command', timeout=0.05))
+        self.assertLess(time.time() - start_time, 1)
+        self.assertFalse(worker.send_command('another_command', block=False))
+        self.assertEqual(worker.command_generation.value, 1)
+
+    def test_command_generation(self):
+        worker = Worker(0)
+        self.assertTrue(worker.send_command('some_command'))
+        self.assertEqual(worker.command_generation.value, 1)
+
+        # the command may take a moment to come through the pipe
+        for _ in range(100):
+            self.assertFalse(worker.should_stop())
+            if worker.seen_generation == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(worker.seen_generation, 1)
+        self.assertIsNone(worker.get_command(block=False))
+
+    def test_stop_message_on_control_queue(self):
+        worker = Worker(0)
+        worker.control_queue.put(STOP_MESSAGE)
+        with worker.command_lock:
+            worker.command_generation.value += 1
+
+        for _ in range(100):
+            if worker.should_stop():
+                break
+            time.sleep(0.01)
+        self.assertTrue(worker.should_stop())
+
+    def test_stop_other_process(self):
+        for backend in ('process', THREAD_BACKEND):
+            worker = LoopingWorker(0, backend=backend)
+            worker.daemon = True
+            worker.start()
+
+            worker.send_command(STOP_MESSAGE)
+            worker.join(5)
+            self.assertFalse(worker.is_alive())
+
+    def test_pause(self):
+        worker = LoopingWorker(0, backend=THREAD_BACKEND)
+        worker.daemon = True
+        worker.start()
+
+        worker.send_command(PAUSE_MESSAGE)
+        time.sleep(0.1)
+        paused_count = worker.batch_count
+        time.sleep(0.1)
+        self.assertEqual(worker.batch_count, paused_count)
+
+        worker.send_command(RESUME_MESSAGE)
+        time.sleep(0.1)
+        self.assertGreater(worker.batch_count, paused_count)
+
+        # a stop ends a pause too
+        worker.send_command(PAUSE_MESSAGE)
+        worker.send_command(STOP_MESSAGE)
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
@@ -0,0 +1,165 @@
+import collections
+import json
+import time
+
+import numpy as np
+
+from .metrics import STAGES, STAGE_INDEX, SlotRegistry, shared_array
+
+# columns of a recorded span
+STAGE, BATCH_ID, START, DURATION = range(4)
+
+# spans without a batch, e.g. a reader waiting on the in_queue
+NO_BATCH = -1
+
+
+class TraceRecorder(SlotRegistry):
+    """
+    Records a span for every timed stage of every worker into a ring buffer in shared
+    memory, the newest `capacity` spans per worker are kept. The spans of all workers are
+    merged into one Chrome trace event timeline, which chrome://tracing and Perfetto open.
+    Spans of the same batch are joined by flow arrows, from the filler's plan through the
+    reader to the generators.
+    """
+
+    def __init__(self, n_slots, capacity=10000):
+        super(TraceRecorder, self).__init__(n_slots)
+
+        self.capacity = capacity
+        self.spans = shared_array((n_slots, capacity, 4), 'float64')
+        self.n_spans = shared_array((n_slots,), 'int64')
+
+    def worker(self, name):
+        """
+        :return: the WorkerTracer of the worker's slot
+        """
+        return WorkerTracer(self, self.slot(name))
+
+    def slot_spans(self, slot):
+        """
+        :return: the spans of a slot still in its ring buffer, oldest first
+        """
+        n_spans = int(self.n_spans[slot])
+        if n_spans <= self.capacity:
+            return self.spans[slot, :n_spans].copy()
+
+        head = n_spans % self.capacity
+        return np.concatenate([self.spans[slot, head:], self.spans[slot, :head]])
+
+    def events(self):
+        """
+        :return: the trace events, timestamps in microseconds since the first span
+        """
+        spans = dict((slot, self.slot_spans(slot)) for slot in self.slot_names)
+
+        starts = [slot_spans[:, START].min() for slot_spans in spans.values() if len(slot_spans)]
+        origin = min(starts) if starts else 0.0
+
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': 0, 'args': {'name': 'data_provider'}}]
+        batches = collections.defaultdict(list)
+
+        for slot, name in sorted(self.slot_names.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': slot, 'args': {'name': name}})
+            events.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': 0, 'tid': slot, 'args': {'sort_index': slot}})
+
+            for stage_index, batch_id, start, duration in spans[slot]:
+                event = {
+                    'name': STAGES[int(stage_index)],
+                    'cat' : 'stage',
+                    'ph'  : 'X',
+                    'pid' : 0,
+                    'tid' : slot,
+                    'ts'  : (start - origin) * 1e6,
+                    'dur' : duration * 1e6
+                }
+                if batch_id != NO_BATCH:
+                    event['args'] = {'batch_id': int(batch_id)}
+                    batches[int(batch_id)].append(event)
+                events.append(event)
+
+        # every filler numbers its own batches, so the ids only identify a batch with one filler
+        n_fillers = sum(1 for slot, name in self.slot_names.items()
+                        if name.startswith('filler') and len(spans[slot]))
+        if n_fillers <= 1:
+            for batch_id, batch_events in sorted(batches.items()):
+                events.extend(self.flow_events(batch_id, batch_events))
+
+        return events
+
+    @staticmethod
+    def flow_events(batch_id, batch_events):
+        """
+        :return: flow events binding the spans of one batch in the order they started
+        """
+        batch_events = sorted(batch_events, key=lambda event: event['ts'])
+        if len(batch_events) < 2:
+            return list()
+
+        flows = list()
+        for index, event in enumerate(batch_events):
+            if index == 0:
+                phase = 's'
+            elif index == len(batch_events) - 1:
+                phase = 'f'
+            else:
+                phase = 't'
+
+            flow = {
+                'name': 'batch',
+                'cat' : 'batch',
+                'ph'  : phase,
+                'id'  : batch_id,
+                'pid' : event['pid'],
+                'tid' : event['tid'],
+                'ts'  : event['ts']
+            }
+            if phase == 'f':
+                # bind to the span that encloses ts, not the next one
+                flow['bp'] = 'e'
+            flows.append(flow)
+        return flows
+
+    def write(self, path):
+        """
+        Writes the timeline as a Chrome trace event JSON file.
+        :return: the number of events written
+        """
+        events = self.events()
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+        return len(events)
+
+    def reset(self):
+        self.n_spans[...] = 0
+
+
+class WorkerTracer(object):
+    """
+    A worker's view of its slot in a TraceRecorder, it takes the same observations as a
+    WorkerMetrics.
+    """
+
+    def __init__(self, recorder, slot):
+        self.slot = slot
+        self.capacity = recorder.capacity
+        self.spans = recorder.spans[slot]
+        self.n_spans = recorder.n_spans[slot:slot + 1]
+
+    def observe(self, stage, seconds, batch_id=None, end=None):
+        """
+        :param end: when the stage ended, None is now. Given when a stage is recorded after
+        the fact, e.g. once the batch_id of a wait is known.
+        """
+        if end is None:
+            end = time.time()
+
+        span = self.spans[int(self.n_spans[0]) % self.capacity]
+        span[STAGE] = STAGE_INDEX[stage]
+        span[BATCH_ID] = NO_BATCH if batch_id is None else batch_id
+        span[START] = end - seconds
+        span[DURATION] = seconds
+
+        self.n_spans[0] += 1
+
+    def increment(self, counter, amount=1):
+        pass
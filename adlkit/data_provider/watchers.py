@@ -2,7 +2,9 @@ import Queue
 import logging as lg
 import time
 
+from .buckets import drop_references
 from .config import WATCHER_OFFSET
+from .metrics import batch_id_of
 from .workers import Worker
 
 watcher_logger = lg.getLogger('data_provider.workers.watcher')
@@ -10,12 +12,14 @@ watcher_logger = lg.getLogger('data_provider.workers.watcher')
 
 class BaseWatcher(Worker):
     def __init__(self, worker_id, shared_memory_pointer,
-                 multicast_queues, out_queue, max_batches=None, **kwargs):
+                 multicast_queues, out_queue, max_batches=None, free_buckets=None,
+                 **kwargs):
         super(BaseWatcher, self).__init__(worker_id + WATCHER_OFFSET, **kwargs)
         self.shared_memory_pointer = shared_memory_pointer
         self.multicast_queues = multicast_queues
         self.out_queue = out_queue
         self.max_batches = max_batches
+        self.free_buckets = free_buckets
         self.n_generators = len(multicast_queues)
         self.watcher_id = self.worker_id - WATCHER_OFFSET
 
@@ -36,49 +40,70 @@ class BaseWatcher(Worker):
     def watch(self):
         # TODO - wghilliard - when pruning generators, batch dropping may occur
         # TODO - wghilliard - keep pace switch
-        # TODO - wghilliard - time out for locks
 
         out_queue_get_wait_time = time.time()
         self.debug("watcher starting")
         while not self.should_stop() and (self.max_batches is None or self.batch_count < self.max_batches):
-            # while not self.should_stop() or (
-            #                 self.max_batches is not None and self.batch_count < self.max_batches):
             try:
-                read_batch = self.out_queue.get(timeout=1)
-                if read_batch is not None:
-                    self.debug("out_queue_get_wait_time={0}".format(time.time()
-                                                                    - out_queue_get_wait_time))
-                    start_time = time.time()
-                    try:
-                        for generator_queue in self.multicast_queues:
-                            generator_queue.put(read_batch)
-
-                    except ValueError:
-                        pass
-                    self.debug("multicast_put_wait_time={0} ".format(time.time() - start_time))
-                    self.batch_count += 1
-                    out_queue_get_wait_time = time.time()
-
+                read_batch = self.out_queue.get(timeout=self.block_timeout)
             except Queue.Empty:
-                pass
+                self.metrics.increment('queue_empty')
+                continue
 
+            if read_batch is None:
+                continue
+
+            self.metrics.observe('out_queue_get_wait', time.time() - out_queue_get_wait_time,
+                                 batch_id_of(read_batch))
             start_time = time.time()
-            for reader_index, reader_slot in enumerate(self.shared_memory_pointer):
-                for bucket_index, bucket in enumerate(reader_slot):
-                    with bucket[0].get_lock() and bucket[2].get_lock() and bucket[3].get_lock():
-                        self.debug('does {}={}={} (reader_id={}, bucket_index={})'.format(bucket[2].value,
-                                                                                          bucket[3].value,
-                                                                                          self.n_generators,
-                                                                                          reader_index,
-                                                                                          bucket_index))
-                        if bucket[2].value == bucket[3].value == self.n_generators:
-                            self.debug(
-                                    "resetting bucket reader_id={0} bucket_id={1}".format(reader_index,
-                                                                                          bucket_index))
-                            bucket[0].value = 0
-                            bucket[2].value = 0
-                            bucket[3].value = 0
-            self.debug(" bucket_watch_time={0} ".format(time.time() - start_time))
+            self.multicast(read_batch)
+            self.metrics.observe('multicast_put_wait', time.time() - start_time, batch_id_of(read_batch))
+            self.metrics.increment('batches')
+            self.batch_count += 1
+            out_queue_get_wait_time = time.time()
+
+    def multicast(self, read_batch):
+        """
+        Hands a read batch to every generator. The bucket holds one reference per generator
+        and the last generator to finish with it releases it, so the watcher never has to
+        look at the buckets again.
+        """
+        bucket = None
+        if batch_id_of(read_batch) is not None:
+            reader_id, bucket_index = read_batch[:2]
+            bucket = self.shared_memory_pointer[reader_id][bucket_index]
+            # the generators cannot see the bucket before the put below
+            with bucket[2].get_lock():
+                bucket[2].value = self.n_generators
 
-            # self.sleep()
-            # time.sleep(self.sleep_duration)
+        n_delivered = 0
+        for generator_queue in self.multicast_queues:
+            if not self.deliver(generator_queue, read_batch):
+                break
+            n_delivered += 1
+
+        if bucket is not None and n_delivered < self.n_generators:
+            self.debug("dropping {0} undelivered references reader_id={1} bucket_index={2}".format(
+                    self.n_generators - n_delivered, reader_id, bucket_index))
+            free_buckets = None
+            if self.free_buckets is not None:
+                free_buckets = self.free_buckets[reader_id]
+            drop_references(bucket, bucket_index, free_buckets=free_buckets,
+                            n_references=self.n_generators - n_delivered)
+
+    def deliver(self, generator_queue, read_batch):
+        """
+        Puts a read batch into a generator's queue, blocking no longer than block_timeout at
+        a time so that a stop is noticed while a generator is not drawing.
+        :return: True once delivered, False if stopped first or the queue is closed
+        """
+        while not self.should_stop():
+            try:
+                generator_queue.put(read_batch, timeout=self.block_timeout)
+                return True
+            except Queue.Full:
+                self.metrics.increment('queue_full')
+            except (ValueError, AssertionError):
+                # a closed queue, its generator will not drop its reference
+                return False
+        return False
@@ -1,15 +1,21 @@
 import Queue
 import logging as lg
 import multiprocessing
+import threading
 import time
 
 import billiard
 import numpy as np
 
-from .config import STOP_MESSAGE
+from .config import PAUSE_MESSAGE, PROCESS_BACKEND, RESUME_MESSAGE, STOP_MESSAGE, THREAD_BACKEND
+from .file_handles import FileHandleCache
+from .metrics import NULL_METRICS
 
 worker_log = lg.getLogger('data_provider.workers.worker')
 
+# how often a paused worker looks for a resume or a stop, in seconds
+PAUSE_POLL = 0.01
+
 
 class WorkerError(Exception):
     worker_id = None
@@ -20,6 +26,16 @@ class WorkerError(Exception):
         self.worker_id = worker_id
 
 
+def make_queue(maxsize=0, backend=PROCESS_BACKEND):
+    """
+    Threads share the consumer's memory, so they can pass batches through a plain
+    Queue instead of pickling them through a pipe.
+    """
+    if backend == THREAD_BACKEND:
+        return Queue.Queue(maxsize=maxsize)
+    return billiard.Queue(maxsize=maxsize)
+
+
 # def report_error(run_function):
 #     def wrapper():
 #         try:
@@ -28,33 +44,105 @@ class WorkerError(Exception):
 
 class Worker(billiard.Process):
     def __init__(self, worker_id, control_queue_depth=1, sleep_duration=1,
-                 **kwargs):
+                 block_timeout=1, max_open_files=None, max_chunk_cache_bytes=None,
+                 backend=PROCESS_BACKEND, metrics=None, **kwargs):
         super(Worker, self).__init__()
 
         np.random.seed()
+        # threads share the global numpy state, so anything that needs a repeatable
+        # sequence of draws uses this instead
+        self.random_state = np.random.RandomState()
+
+        self.backend = backend
+        self.thread = None
 
-        self.control_queue = multiprocessing.Queue(maxsize=control_queue_depth)
+        if backend == THREAD_BACKEND:
+            self.control_queue = Queue.Queue(maxsize=control_queue_depth)
+        else:
+            self.control_queue = multiprocessing.Queue(maxsize=control_queue_depth)
         self.worker_id = worker_id
 
         self.stop = multiprocessing.Value('i', 0)
         self.stop_check = False
 
+        # checked with a plain memory read on every loop, the control queue is only
+        # looked at while send_command has put more commands than were taken off it
+        self.stop_flag = multiprocessing.RawValue('i', 0)
+        self.command_generation = multiprocessing.RawValue('l', 0)
+        self.command_lock = multiprocessing.Lock()
+        self.seen_generation = 0
+        self.paused = False
+
         self.batch_count = 0
-        self.file_handle_holder = dict()
+        self.file_handle_holder = FileHandleCache(max_open_files=max_open_files,
+                                                  max_chunk_cache_bytes=max_chunk_cache_bytes)
         self.sleep_duration = sleep_duration
+        self.block_timeout = block_timeout
+
+        # a WorkerMetrics slot in the data provider's MetricsRegistry, recording is a no-op without one
+        self.metrics = metrics or NULL_METRICS
 
     def run(self, **kwargs):
         return
 
-    def send_command(self, payload, block=True):
-        try:
-            self.control_queue.put(payload, block=block)
+    def start(self):
+        if self.backend != THREAD_BACKEND:
+            return super(Worker, self).start()
+
+        assert self.thread is None, 'cannot start a worker twice'
+        self.thread = threading.Thread(target=self.run, name="worker-{0}".format(self.worker_id))
+        self.thread.daemon = self.daemon
+        self.thread.start()
+
+    def join(self, timeout=None):
+        if self.backend != THREAD_BACKEND:
+            return super(Worker, self).join(timeout)
+
+        assert self.thread is not None, 'can only join a started worker'
+        self.thread.join(timeout)
+
+    def is_alive(self):
+        if self.backend != THREAD_BACKEND:
+            return super(Worker, self).is_alive()
+
+        return self.thread is not None and self.thread.is_alive()
+
+    def request_stop(self):
+        self.stop_flag.value = 1
+
+    def close(self):
+        """
+        Closes the pipes of a stopped worker, billiard keeps a process's sentinel open
+        until then.
+        """
+        if self.backend != THREAD_BACKEND:
+            super(Worker, self).close()
+            self.control_queue.close()
+
+    def send_command(self, payload, block=True, timeout=None):
+        """
+        Queues a command, the worker takes it at its next check. The control queue holds
+        control_queue_depth commands, one by default, so while the worker has not taken the
+        previous one this blocks, for a worker waiting on a queue or a bucket up to about
+        block_timeout.
+        :param timeout: the most seconds to block, None blocks until there is room
+        :return: True if the command was queued
+        """
+        if payload == STOP_MESSAGE:
+            self.request_stop()
             return True
+
+        try:
+            self.control_queue.put(payload, block, timeout)
         except Queue.Full:
             # self.sleep()
             # worker_log.debug(" *{0}* command queue full".format(self.worker_id))
             return False
 
+        with self.command_lock:
+            self.command_generation.value += 1
+        return True
+
     def get_command(self, block=True):
         try:
             return self.control_queue.get(block=block)
@@ -68,20 +156,44 @@ class Worker(billiard.Process):
             tmp = self.get_command(block=False)
             if tmp is None:
                 return
-            elif tmp == STOP_MESSAGE:
+
+            self.seen_generation += 1
+            if tmp == STOP_MESSAGE:
                 # self.hard_stop.set()
                 self.stop_check = True
+            else:
+                self.handle_command(tmp)
+
+    def handle_command(self, command):
+        """
+        Called for every command but a stop. Subclasses handle their own commands and pass
+        the rest on to this.
+        :param command: a command name or a (command, payload) tuple
+        """
+        if command == PAUSE_MESSAGE:
+            self.paused = True
+        elif command == RESUME_MESSAGE:
+            self.paused = False
+        else:
+            worker_log.warning(" *{0}* ignoring unknown command {1}".format(self.worker_id, command))
 
     def should_stop(self):
-        self.get_all_commands()
-        return self.stop_check
+        # a command can still be on its way through the pipe, it is picked up on a later call
+        if self.command_generation.value != self.seen_generation:
+            self.get_all_commands()
+
+        # a paused worker sits here, wherever it checks, until it is resumed or stopped
+        while self.paused and not (self.stop_check or self.stop_flag.value == 1):
+            time.sleep(PAUSE_POLL)
+            if self.command_generation.value != self.seen_generation:
+                self.get_all_commands()
+
+        return self.stop_check or self.stop_flag.value == 1
 
     def seppuku(self):
-        for file_handle in self.file_handle_holder:
-            try:
-                self.file_handle_holder[file_handle].close()
-            except Exception as e:
-                lg.debug(e)
+        worker_log.debug(" *{0}* file_handle_stats={1}".format(self.worker_id,
+                                                              self.file_handle_holder.stats()))
+        self.file_handle_holder.close_all()
 
         with self.stop.get_lock():
             self.stop.value = 1
@@ -9,7 +9,6 @@ setuptools.setup(
         author_email="wghilliard@anomalousdl.com",
         url="https://github.com/anomalousdl/adlkit",
         install_requires=[
-            "keras",
             "numpy",
             "h5py",
             "theano",